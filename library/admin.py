@@ -1,5 +1,6 @@
-from django.contrib import admin
-from .models import Student, Book, BorrowRecord, Fine, UserProfile
+from django.contrib import admin, messages
+from .circulation import verify_returns
+from .models import Student, Book, BorrowRecord, Fine, LoanNotification, UserProfile, StudentCirculationStats
 
 
 @admin.register(UserProfile)
@@ -9,9 +10,24 @@ class UserProfileAdmin(admin.ModelAdmin):
 
 @admin.register(Student)
 class StudentAdmin(admin.ModelAdmin):
-    list_display = ['student_id', 'name', 'email', 'phone']
+    list_display = ['student_id', 'name', 'email', 'phone', 'borrowed_count', 'overdue_count', 'total_fines']
     search_fields = ['student_id', 'name', 'email']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_loan_stats()
+
+    @admin.display(description='Borrowed', ordering='borrowed_count')
+    def borrowed_count(self, obj):
+        return obj.borrowed_count
+
+    @admin.display(description='Overdue', ordering='overdue_count')
+    def overdue_count(self, obj):
+        return obj.overdue_count
+
+    @admin.display(description='Pending fines (RM)', ordering='total_fines')
+    def total_fines(self, obj):
+        return obj.total_fines
+
 @admin.register(Book)
 class BookAdmin(admin.ModelAdmin):
     list_display = ['isbn', 'title', 'author', 'category', 'available_copies', 'total_copies']
@@ -23,8 +39,31 @@ class BorrowRecordAdmin(admin.ModelAdmin):
     list_display = ['student', 'book', 'borrow_date', 'due_date', 'return_date', 'status']
     list_filter = ['status', 'borrow_date']
     search_fields = ['student__name', 'book__title']
+    actions = ['verify_selected_returns']
+
+    @admin.action(description='Verify selected pending returns (good condition)')
+    def verify_selected_returns(self, request, queryset):
+        record_ids = queryset.values_list('pk', flat=True)
+        outcomes = verify_returns({record_id: 'good' for record_id in record_ids}, 'Verified from admin')
+        verified = sum(1 for outcome in outcomes if outcome['verified'])
+        skipped = len(outcomes) - verified
+        self.message_user(request, f'{verified} return(s) verified.', messages.SUCCESS)
+        if skipped:
+            self.message_user(request, f'{skipped} record(s) skipped because they are not pending return.', messages.WARNING)
 
 @admin.register(Fine)
 class FineAdmin(admin.ModelAdmin):
     list_display = ['borrow_record', 'amount', 'status', 'paid_date']
-    list_filter = ['status']
\ No newline at end of file
+    list_filter = ['status']
+
+@admin.register(StudentCirculationStats)
+class StudentCirculationStatsAdmin(admin.ModelAdmin):
+    list_display = ['student', 'active_loans', 'overdue_loans', 'pending_fine_total', 'lifetime_borrows', 'updated_at']
+    search_fields = ['student__student_id', 'student__name']
+    readonly_fields = ['student', 'active_loans', 'overdue_loans', 'pending_fine_total', 'lifetime_borrows', 'updated_at']
+
+@admin.register(LoanNotification)
+class LoanNotificationAdmin(admin.ModelAdmin):
+    list_display = ['borrow_record', 'kind', 'sent_at']
+    list_filter = ['kind']
+    list_select_related = ['borrow_record__student', 'borrow_record__book']
@@ -0,0 +1,202 @@
+from decimal import Decimal
+from functools import wraps
+
+from django.conf import settings
+from django.db.models import F
+from django.http import JsonResponse
+from django.views.decorators.http import require_safe
+
+from .models import Book, BorrowRecord, Fine, StudentCirculationStats
+from .pagination import paginate_keyset
+from .search import book_page_queryset
+
+MAX_PAGE_SIZE = 100
+MAX_AVAILABILITY_IDS = 100
+LOAN_STATUSES = [status for status, _ in BorrowRecord.STATUS_CHOICES] + ['currently_borrowed']
+FINE_STATUSES = [status for status, _ in Fine.STATUS_CHOICES]
+
+BOOK_FIELDS = ['id', 'isbn', 'title', 'author', 'category', 'available_copies', 'total_copies']
+LOAN_FIELDS = [
+    'id', 'borrow_date', 'due_date', 'return_date', 'status',
+    'student__id', 'student__student_id', 'student__name', 'book__id', 'book__title',
+]
+
+
+def api_response(data, status=200):
+    # No spaces after separators; clients poll these
+    return JsonResponse(data, status=status, json_dumps_params={'separators': (',', ':')})
+
+
+def api_error(message, status):
+    return api_response({'error': message}, status=status)
+
+
+def api_login_required(role=None):
+    """login_required/role_required for the API: 401 or 403 rather than a redirect"""
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not request.user.is_authenticated:
+                return api_error('Authentication required', 401)
+            if role is not None and request.user_role != role:
+                return api_error(f'Only {role}s can use this endpoint', 403)
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _page_size(request):
+    try:
+        size = int(request.GET.get('limit', getattr(settings, 'LIBRARY_PAGE_SIZE', 25)))
+    except ValueError:
+        return None
+    return size if 1 <= size <= MAX_PAGE_SIZE else None
+
+
+def _database_int(value):
+    """``int(value)``, with ValueError past a 64-bit integer rather than an error from the database driver"""
+    number = int(value)
+    if not -2 ** 63 <= number < 2 ** 63:
+        raise ValueError(value)
+    return number
+
+
+def _page(page, serialize):
+    """A keyset page; clients pass ``next``/``previous`` back as ``?cursor=``"""
+    return {
+        'results': [serialize(row) for row in page],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    }
+
+
+def _book(book):
+    return {
+        'id': book.pk,
+        'isbn': book.isbn,
+        'title': book.title,
+        'author': book.author,
+        'category': book.category,
+        'available_copies': book.available_copies,
+        'total_copies': book.total_copies,
+    }
+
+
+def _loan(record):
+    return {
+        'id': record.pk,
+        'status': record.status,
+        'borrow_date': record.borrow_date,
+        'due_date': record.due_date,
+        'return_date': record.return_date,
+        'student': {'id': record.student.pk, 'student_id': record.student.student_id, 'name': record.student.name},
+        'book': {'id': record.book.pk, 'title': record.book.title},
+    }
+
+
+@require_safe
+def books(request):
+    """Catalog search: ``?q=`` ranked like the Books page, otherwise by title"""
+    per_page = _page_size(request)
+    if per_page is None:
+        return api_error(f'limit must be between 1 and {MAX_PAGE_SIZE}', 400)
+    queryset, ordering = book_page_queryset(request.GET.get('q', ''))
+    page = paginate_keyset(request, queryset.only(*BOOK_FIELDS), ordering, per_page=per_page)
+    return api_response(_page(page, _book))
+
+
+@require_safe
+def book_availability(request):
+    """Copy counts for ``?ids=1,2,3``, one cheap query however many books a kiosk shows"""
+    try:
+        ids = [_database_int(value) for value in request.GET.get('ids', '').split(',') if value]
+    except ValueError:
+        return api_error('ids must be a comma-separated list of book ids', 400)
+    if not 1 <= len(ids) <= MAX_AVAILABILITY_IDS:
+        return api_error(f'Pass between 1 and {MAX_AVAILABILITY_IDS} ids', 400)
+    rows = Book.objects.filter(pk__in=ids).order_by('pk').values('id', 'available_copies', 'total_copies', 'version')
+    return api_response({'results': list(rows)})
+
+
+@require_safe
+@api_login_required('student')
+def my_loans(request):
+    """The student's loans that aren't returned yet, soonest due first, with the fine so far"""
+    records = (
+        BorrowRecord.objects.filter(student__user=request.user, status__ne='returned')
+        .select_related('student', 'book').only(*LOAN_FIELDS)
+        .with_accrued_fine().order_by('due_date', 'pk')
+    )
+    results = []
+    for record in records:
+        loan = _loan(record)
+        # SQLite hands back Decimal('6'); show cents like the stored fines
+        loan['accrued_fine'] = record.accrued_fine.quantize(Decimal('0.01'))
+        results.append(loan)
+    return api_response({'results': results})
+
+
+@require_safe
+@api_login_required('student')
+def my_fines(request):
+    """The student's fines, newest loan first; ``?status=pending|paid``"""
+    per_page = _page_size(request)
+    if per_page is None:
+        return api_error(f'limit must be between 1 and {MAX_PAGE_SIZE}', 400)
+    status = request.GET.get('status', '')
+    if status and status not in FINE_STATUSES:
+        return api_error(f'status must be one of {", ".join(FINE_STATUSES)}', 400)
+
+    fines = Fine.objects.filter(borrow_record__student__user=request.user)
+    if status:
+        fines = fines.filter(status=status)
+    page = paginate_keyset(
+        request,
+        fines.annotate(borrow_date=F('borrow_record__borrow_date'))
+        .select_related('borrow_record__book')
+        .only('id', 'amount', 'status', 'paid_date', 'borrow_record__id', 'borrow_record__book__id',
+              'borrow_record__book__title'),
+        '-borrow_date',
+        per_page=per_page,
+    )
+    data = _page(page, lambda fine: {
+        'id': fine.pk,
+        'amount': fine.amount,
+        'status': fine.status,
+        'paid_date': fine.paid_date,
+        'loan': fine.borrow_record_id,
+        'book': {'id': fine.borrow_record.book.pk, 'title': fine.borrow_record.book.title},
+    })
+    # The maintained counter, rather than summing every fine again
+    data['pending_total'] = (
+        StudentCirculationStats.objects.filter(student__user=request.user)
+        .values_list('pending_fine_total', flat=True).first() or Decimal('0.00')
+    )
+    return api_response(data)
+
+
+@require_safe
+@api_login_required('librarian')
+def loans(request):
+    """All loans, newest first; ``?status=`` as on Borrow Records, ``?student=<pk>``"""
+    per_page = _page_size(request)
+    if per_page is None:
+        return api_error(f'limit must be between 1 and {MAX_PAGE_SIZE}', 400)
+    status = request.GET.get('status', '')
+    if status and status not in LOAN_STATUSES:
+        return api_error(f'status must be one of {", ".join(LOAN_STATUSES)}', 400)
+
+    records = BorrowRecord.objects.all()
+    if status == 'currently_borrowed':
+        records = records.filter(status__ne='returned')
+    elif status:
+        records = records.filter(status=status)
+    if request.GET.get('student'):
+        try:
+            records = records.filter(student_id=_database_int(request.GET['student']))
+        except ValueError:
+            return api_error('student must be a number', 400)
+    page = paginate_keyset(
+        request, records.select_related('student', 'book').only(*LOAN_FIELDS), '-borrow_date', per_page=per_page,
+    )
+    return api_response(_page(page, _loan))
@@ -0,0 +1,341 @@
+import asyncio
+import math
+import platform
+import threading
+import time
+from contextlib import contextmanager
+from types import ModuleType
+
+import django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connection, connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLPattern, include, path, reverse
+from django.utils import timezone
+
+from . import urls, views
+from .models import Book, BorrowRecord, Fine, Student
+from .seeding import SEED_LIBRARIAN
+
+ROLES = ['librarian', 'student']
+
+# These change data on a plain GET, so a benchmark must not request them
+SKIPPED_URLS = {
+    'logout': 'logs the client out',
+    'request_return': 'requests a return (moves the loan to pending_return) on GET',
+}
+
+# (url name, role, sync view, async view) compared by run_async_comparison()
+ASYNC_VIEWS = [
+    ('home', 'librarian', views.home, views.home_async),
+    ('student_dashboard', 'student', views.student_dashboard, views.student_dashboard_async),
+]
+
+# Extra query strings, to time the typical request rather than the worst one
+QUERY_STRINGS = {
+    'export_records': 'status=overdue',
+}
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def _first(queryset):
+    return queryset.order_by('pk').values_list('pk', flat=True).first()
+
+
+def url_arguments(student):
+    """Sample values for every URL parameter, or None where nothing suitable exists.
+
+    The student's own loans are used where a view checks ownership.
+    """
+    cover = Book.objects.exclude(cover_image='').exclude(cover_image__isnull=True).values_list('cover_image', flat=True).first()
+    return {
+        'book_id': _first(Book.objects.filter(available_copies__gt=0)) or _first(Book.objects.all()),
+        'student_id': student.pk if student else _first(Student.objects.all()),
+        'fine_id': _first(Fine.objects.filter(status='pending')) or _first(Fine.objects.all()),
+        'record_id': (
+            _first(BorrowRecord.objects.filter(status='pending_return'))
+            or _first(BorrowRecord.objects.all())
+        ),
+        'name': cover,
+        'dataset': 'loans',
+    }
+
+
+def benchmark_cases(student):
+    """``(url name, path)`` for every named route in library/urls.py"""
+    arguments = url_arguments(student)
+    cases = []
+    for pattern in urls.urlpatterns:
+        if not isinstance(pattern, URLPattern) or not pattern.name:
+            continue
+        names = list(pattern.pattern.converters)
+        if any(arguments.get(name) is None for name in names):
+            cases.append((pattern.name, None))
+            continue
+        url = reverse(pattern.name, kwargs={name: arguments[name] for name in names})
+        if pattern.name in QUERY_STRINGS:
+            url = f'{url}?{QUERY_STRINGS[pattern.name]}'
+        cases.append((pattern.name, url))
+    return cases
+
+
+def _measure(client, url, iterations, warmup):
+    for _ in range(warmup):
+        client.get(url)
+    timings = []
+    queries = []
+    status = None
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = client.get(url)
+            if response.streaming:
+                # Exports do their work while the body is read
+                for _ in response.streaming_content:
+                    pass
+            timings.append((time.perf_counter() - start) * 1000)
+        queries.append(len(captured))
+        status = response.status_code
+    return {
+        'status': status,
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p90_ms': round(percentile(timings, 0.90), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'max_ms': round(max(timings), 3),
+        'queries': max(queries),
+    }
+
+
+def run_benchmark(librarian, student_user, iterations=20, warmup=2, progress=None):
+    """Time every library URL as a librarian and as a student.
+
+    Each URL is fetched ``warmup`` times untimed, then ``iterations`` times
+    with wall-clock latency and SQL query counts recorded. Returns a dict
+    ready to be dumped as JSON, with results sorted by URL name and role so
+    two runs diff cleanly.
+    """
+    student = Student.objects.filter(user=student_user).first()
+    cases = benchmark_cases(student)
+    clients = {'librarian': Client(raise_request_exception=False), 'student': Client(raise_request_exception=False)}
+    clients['librarian'].force_login(librarian)
+    clients['student'].force_login(student_user)
+
+    results = []
+    # The test client always sends Host: testserver
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        for name, url in cases:
+            for role in ROLES:
+                result = {'url_name': name, 'role': role, 'path': url}
+                if name in SKIPPED_URLS:
+                    result['skipped'] = SKIPPED_URLS[name]
+                elif url is None:
+                    result['skipped'] = 'no sample data for its URL parameters'
+                else:
+                    result.update(_measure(clients[role], url, iterations, warmup))
+                results.append(result)
+                if progress is not None:
+                    progress(result)
+
+    results.sort(key=lambda result: (result['url_name'], result['role']))
+    return {
+        'meta': {
+            'created_at': timezone.now().isoformat(),
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'iterations': iterations,
+            'warmup': warmup,
+            'librarian': librarian.username,
+            'student': student_user.username,
+            'rows': {
+                'books': Book.objects.count(),
+                'students': Student.objects.count(),
+                'loans': BorrowRecord.objects.count(),
+                'fines': Fine.objects.count(),
+            },
+        },
+        'results': results,
+    }
+
+
+def default_accounts():
+    """The seed_library accounts, or the first librarian/student on file"""
+    librarian = (
+        User.objects.filter(username=SEED_LIBRARIAN).first()
+        or User.objects.filter(userprofile__role='librarian').order_by('pk').first()
+    )
+    # Prefer a student with loans so the dashboard has something to show
+    student = (
+        Student.objects.filter(user__isnull=False, borrowrecord__status__ne='returned')
+        .order_by('pk').select_related('user').first()
+        or Student.objects.filter(user__isnull=False).order_by('pk').select_related('user').first()
+    )
+    return librarian, student.user if student else None
+
+
+@contextmanager
+def simulated_db_latency(seconds, connect_seconds=0):
+    """Sleep ``seconds`` before every query, on every connection and thread.
+
+    Each new connection also sleeps ``connect_seconds``, the handshake (and
+    authentication) a networked database costs. Stands in for a database
+    server across the network; SQLite answers in microseconds, which hides
+    what running queries side by side can save and what extra connections cost.
+    """
+    enabled = threading.Event()
+    enabled.set()
+
+    def delay(execute, sql, params, many, context):
+        if enabled.is_set():
+            time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    def install(sender, connection, **kwargs):
+        if enabled.is_set():
+            time.sleep(connect_seconds)
+        # Fired again each time a closed connection reconnects
+        if delay not in connection.execute_wrappers:
+            connection.execute_wrappers.append(delay)
+
+    connection_created.connect(install, weak=False, dispatch_uid='library_simulated_latency')
+    opened = connections.all(initialized_only=True)
+    for conn in opened:
+        conn.execute_wrappers.append(delay)
+    try:
+        yield
+    finally:
+        # Connections in other threads keep the wrapper, switched off
+        enabled.clear()
+        connection_created.disconnect(dispatch_uid='library_simulated_latency')
+        for conn in opened:
+            conn.execute_wrappers.remove(delay)
+
+
+@contextmanager
+def conn_max_age(seconds):
+    """Temporarily set CONN_MAX_AGE on every database alias.
+
+    Connections read their settings dict when they connect, and every
+    thread's connection shares the one in ``connections.settings``.
+    """
+    previous = {alias: connections.settings[alias].get('CONN_MAX_AGE', 0) for alias in connections}
+    for alias in connections:
+        connections.settings[alias]['CONN_MAX_AGE'] = seconds
+    try:
+        yield
+    finally:
+        for alias, value in previous.items():
+            connections.settings[alias]['CONN_MAX_AGE'] = value
+
+
+async def _measure_async(client, url, iterations, concurrency):
+    await client.get(url)
+    timings = []
+    status = None
+    for _ in range(iterations):
+        start = time.perf_counter()
+        response = await client.get(url)
+        timings.append((time.perf_counter() - start) * 1000)
+        status = response.status_code
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client.get(url) for _ in range(concurrency)))
+    burst = (time.perf_counter() - start) * 1000
+    return {
+        'status': status,
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'concurrent_requests': concurrency,
+        'concurrent_wall_ms': round(burst, 3),
+    }
+
+
+def _as_served(view):
+    """``view`` with the close_old_connections() calls the ASGI handler makes around a request.
+
+    The test client leaves them out so tests can share one connection; the
+    request thread's connection setup would then go unmeasured.
+    """
+    if asyncio.iscoroutinefunction(view):
+        async def served(request, *args, **kwargs):
+            await sync_to_async(close_old_connections)()
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                await sync_to_async(close_old_connections)()
+    else:
+        def served(request, *args, **kwargs):
+            close_old_connections()
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                close_old_connections()
+    return served
+
+
+def run_async_comparison(librarian, student_user, iterations=20, concurrency=10, latency=0.005,
+                         connect_latency=0.0, max_age=None, progress=None):
+    """Time the sync and async versions of each ASYNC_VIEWS page through Django's ASGI handler.
+
+    Every query is delayed by ``latency`` seconds and every new connection
+    by ``connect_latency`` (see simulated_db_latency); ``max_age``, if
+    given, replaces CONN_MAX_AGE for the run. Each version is requested
+    ``iterations`` times one after another, then ``concurrency`` times at
+    once. Returns a dict ready to be dumped as JSON.
+    """
+    urlconf = ModuleType('library_async_benchmark_urls')
+    urlconf.urlpatterns = [
+        path(f'__benchmark__/{mode}/{name}/', _as_served(view))
+        for name, role, sync_view, async_view in ASYNC_VIEWS
+        for mode, view in (('sync', sync_view), ('async', async_view))
+    ] + [path('', include(settings.ROOT_URLCONF))]
+
+    clients = {'librarian': AsyncClient(), 'student': AsyncClient()}
+    clients['librarian'].force_login(librarian)
+    clients['student'].force_login(student_user)
+
+    results = []
+    settings_override = override_settings(
+        ROOT_URLCONF=urlconf, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+    )
+    if max_age is None:
+        max_age = connections.settings[DEFAULT_DB_ALIAS].get('CONN_MAX_AGE', 0)
+    with settings_override, conn_max_age(max_age), simulated_db_latency(latency, connect_latency):
+        for name, role, sync_view, async_view in ASYNC_VIEWS:
+            for mode in ('sync', 'async'):
+                result = {'url_name': name, 'role': role, 'mode': mode}
+                result.update(asyncio.run(
+                    _measure_async(clients[role], f'/__benchmark__/{mode}/{name}/', iterations, concurrency)
+                ))
+                results.append(result)
+                if progress is not None:
+                    progress(result)
+
+    return {
+        'meta': {
+            'created_at': timezone.now().isoformat(),
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'iterations': iterations,
+            'concurrency': concurrency,
+            'latency_ms': latency * 1000,
+            'connect_latency_ms': connect_latency * 1000,
+            'conn_max_age': max_age,
+            'librarian': librarian.username,
+            'student': student_user.username,
+        },
+        'results': results,
+    }
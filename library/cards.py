@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .models import Book
+
+CARD_CACHE_PREFIX = 'library:card:'
+# Librarians get an Edit button; everyone else sees the same card
+CARD_VARIANTS = ['librarian', 'reader']
+# All a catalog page has to load; cards come from the cache
+CARD_PAGE_FIELDS = ['id', 'title', 'version']
+
+
+def card_variant(role):
+    return 'librarian' if role == 'librarian' else 'reader'
+
+
+def book_card_key(book_id, version, variant):
+    return f'{CARD_CACHE_PREFIX}{book_id}:{version}:{variant}'
+
+
+def render_book_cards(books, role):
+    """Return the catalog card HTML for each of ``books``, in order.
+
+    Only ``id`` and ``version`` need to be loaded on ``books``. Cards are
+    cached per (book, version, variant), so a changed book simply misses;
+    the misses are rendered from one query for their full rows.
+    """
+    variant = card_variant(role)
+    keys = {book.pk: book_card_key(book.pk, book.version, variant) for book in books}
+    cards = cache.get_many(list(keys.values()))
+
+    missing = [pk for pk, key in keys.items() if key not in cards]
+    if missing:
+        rendered = {}
+        for pk, book in Book.objects.in_bulk(missing).items():
+            rendered[keys[pk]] = render_to_string('library/book_card.html', {'book': book, 'user_role': variant})
+        cache.set_many(rendered, getattr(settings, 'LIBRARY_BOOK_CARD_CACHE_TIMEOUT', 86400))
+        cards.update(rendered)
+
+    # A book deleted since the page query has no card
+    return [mark_safe(cards[keys[book.pk]]) for book in books if keys[book.pk] in cards]
+
+
+def drop_book_cards(book):
+    cache.delete_many([book_card_key(book.pk, book.version, variant) for variant in CARD_VARIANTS])
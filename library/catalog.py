@@ -0,0 +1,192 @@
+import csv
+import json
+import time
+
+from django.db import transaction
+from django.db.models import F
+
+from .dashboard import adjust_dashboard_counter
+from .models import Book, IdentifierSequence, normalize_book_key
+from .search import index_books
+
+BOOK_ISBN_SEQUENCE = 'book_isbn'
+# "BK" plus 11 digits fills the 13 character isbn column and can't clash with
+# the old random six digit "BKnnnnnn" codes
+BOOK_ISBN_PREFIX = 'BK'
+BOOK_ISBN_DIGITS = 11
+
+BOOK_IMPORT_FIELDS = ['isbn', 'title', 'author', 'publisher', 'category', 'description']
+
+# Only the first few bad rows are kept for the report
+MAX_REPORTED_ERRORS = 20
+
+
+def allocate_identifiers(name, count=1):
+    """Reserve ``count`` consecutive numbers from a named sequence.
+
+    The block is claimed with a single ``UPDATE ... SET last_value =
+    last_value + count``, so concurrent callers always get disjoint ranges.
+    """
+    with transaction.atomic():
+        IdentifierSequence.objects.get_or_create(name=name)
+        IdentifierSequence.objects.filter(name=name).update(last_value=F('last_value') + count)
+        last = IdentifierSequence.objects.filter(name=name).values_list('last_value', flat=True).get()
+    return range(last - count + 1, last + 1)
+
+
+def allocate_book_isbns(count=1):
+    """Return ``count`` unused generated ISBNs for books added without one"""
+    isbns = []
+    while len(isbns) < count:
+        candidates = [
+            f'{BOOK_ISBN_PREFIX}{value:0{BOOK_ISBN_DIGITS}d}'
+            for value in allocate_identifiers(BOOK_ISBN_SEQUENCE, count - len(isbns))
+        ]
+        # Skip any code somebody typed in by hand
+        taken = set(Book.objects.filter(isbn__in=candidates).values_list('isbn', flat=True))
+        isbns.extend(isbn for isbn in candidates if isbn not in taken)
+    return isbns
+
+
+def read_csv_rows(stream):
+    """Yield one dict per CSV line, keyed by the header row"""
+    yield from csv.DictReader(stream)
+
+
+def read_jsonl_rows(stream):
+    """Yield one object per JSON line, or ``None`` for a line that doesn't parse"""
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def _clean(value):
+    return str(value).strip() if value is not None else ''
+
+
+def book_from_row(row):
+    """Build an unsaved Book from an import row, raises ValueError if it is unusable"""
+    if not isinstance(row, dict):
+        raise ValueError('not a record')
+    values = {field: _clean(row.get(field)) for field in BOOK_IMPORT_FIELDS}
+    values['isbn'] = values['isbn'].replace('-', '').replace(' ', '')
+    for field in ['title', 'author']:
+        if not values[field]:
+            raise ValueError(f'missing {field}')
+    for field in BOOK_IMPORT_FIELDS:
+        max_length = Book._meta.get_field(field).max_length
+        if max_length and len(values[field]) > max_length:
+            raise ValueError(f'{field} longer than {max_length} characters')
+
+    try:
+        total_copies = int(_clean(row.get('total_copies')) or 1)
+        available_copies = int(_clean(row.get('available_copies')) or total_copies)
+    except ValueError:
+        raise ValueError('copies must be whole numbers')
+    if total_copies < 0 or not 0 <= available_copies <= total_copies:
+        raise ValueError('available_copies must be between 0 and total_copies')
+
+    return Book(
+        isbn=values['isbn'],
+        title=values['title'],
+        author=values['author'],
+        publisher=values['publisher'],
+        category=values['category'],
+        description=values['description'] or None,
+        total_copies=total_copies,
+        available_copies=available_copies,
+        dedupe_key=normalize_book_key(values['title'], values['author']),
+    )
+
+
+class ImportResult:
+    """Running totals for import_books()"""
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.errors = []
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        """Input rows handled per second"""
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+def _insert_batch(books, result):
+    # Drop repeats inside the batch, then anything already in the catalog
+    # (which includes the rows earlier batches of this import created)
+    unique, seen_isbns, seen_keys = [], set(), set()
+    for book in books:
+        if (book.isbn and book.isbn in seen_isbns) or book.dedupe_key in seen_keys:
+            continue
+        if book.isbn:
+            seen_isbns.add(book.isbn)
+        seen_keys.add(book.dedupe_key)
+        unique.append(book)
+
+    with transaction.atomic():
+        taken_isbns = set(
+            Book.objects.filter(isbn__in=list(seen_isbns)).values_list('isbn', flat=True)
+        )
+        taken_keys = set(
+            Book.objects.filter(dedupe_key__in=list(seen_keys)).values_list('dedupe_key', flat=True)
+        )
+        new_books = [
+            book for book in unique
+            if book.isbn not in taken_isbns and book.dedupe_key not in taken_keys
+        ]
+        missing_isbn = [book for book in new_books if not book.isbn]
+        for book, isbn in zip(missing_isbn, allocate_book_isbns(len(missing_isbn))):
+            book.isbn = isbn
+        Book.objects.bulk_create(new_books)
+        # bulk_create skips the post_save signal that normally does these
+        index_books([book for book in new_books if book.pk is not None])
+
+    adjust_dashboard_counter('total_books', len(new_books))
+    result.created += len(new_books)
+    result.duplicates += len(books) - len(new_books)
+
+
+def import_books(rows, batch_size=1000, progress=None):
+    """Stream rows (dicts) into the Book table.
+
+    Rows are validated one by one and written with ``bulk_create`` every
+    ``batch_size`` rows, so memory use depends on the batch size rather than
+    the input size. Rows whose ISBN or normalized title+author is already in
+    the catalog (or earlier in the input) are counted as duplicates and
+    skipped. ``progress`` is called with the running ImportResult after each
+    batch.
+    """
+    result = ImportResult()
+    batch = []
+    for line, row in enumerate(rows, start=1):
+        result.rows += 1
+        try:
+            batch.append(book_from_row(row))
+        except ValueError as exc:
+            result.invalid += 1
+            if len(result.errors) < MAX_REPORTED_ERRORS:
+                result.errors.append(f'Row {line}: {exc}')
+            continue
+        if len(batch) >= batch_size:
+            _insert_batch(batch, result)
+            batch = []
+            if progress is not None:
+                progress(result)
+    if batch:
+        _insert_batch(batch, result)
+        if progress is not None:
+            progress(result)
+    return result
@@ -0,0 +1,344 @@
+import random
+import time
+from collections import defaultdict
+from datetime import timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import OperationalError, transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from .dashboard import invalidate_loan_counters
+from .models import Book, BorrowRecord, Fine, JobWatermark, Student, StudentCirculationStats
+
+ACTIVE_STATUSES = ['borrowed', 'overdue', 'pending_return']
+
+STAT_FIELDS = ['active_loans', 'overdue_loans', 'pending_fine_total', 'lifetime_borrows']
+
+# JobWatermark name for sweep_overdue_loans()
+OVERDUE_SWEEP = 'overdue_sweep'
+
+
+class BookUnavailable(Exception):
+    """Raised by checkout_book() when no copy is left to lend"""
+
+
+class AlreadyBorrowed(Exception):
+    """Raised by checkout_book() when the student still has a copy of the book"""
+
+
+def get_student_stats(student):
+    """Return the student's counters, building the row on first use"""
+    try:
+        return StudentCirculationStats.objects.get(student=student)
+    except StudentCirculationStats.DoesNotExist:
+        recompute_student_stats([student.pk])
+        return StudentCirculationStats.objects.get(student=student)
+
+
+def adjust_student_stats(student_id, **deltas):
+    """Apply counter deltas with a single UPDATE.
+
+    Call inside the same transaction as the loan/fine change so the counters
+    never drift from the rows they summarise.
+    """
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    updated = StudentCirculationStats.objects.filter(student_id=student_id).update(
+        updated_at=timezone.now(),
+        **{field: F(field) + delta for field, delta in deltas.items()},
+    )
+    if not updated:
+        # No row yet: the change is already in the source tables, so recount
+        recompute_student_stats([student_id])
+
+
+def recompute_student_stats(student_ids):
+    """Rebuild the counters for the given students from BorrowRecord and Fine"""
+    students = (
+        Student.objects.filter(pk__in=student_ids)
+        .with_loan_stats()
+        .annotate(lifetime_borrows=Count('borrowrecord'))
+        .order_by()
+    )
+    now = timezone.now()
+    rows = [
+        StudentCirculationStats(
+            student_id=student.pk,
+            active_loans=student.borrowed_count,
+            overdue_loans=student.overdue_count,
+            pending_fine_total=student.total_fines,
+            lifetime_borrows=student.lifetime_borrows,
+            updated_at=now,
+        )
+        for student in students
+    ]
+    with transaction.atomic():
+        existing = set(
+            StudentCirculationStats.objects.filter(student_id__in=student_ids)
+            .values_list('student_id', flat=True)
+        )
+        StudentCirculationStats.objects.bulk_update(
+            [row for row in rows if row.student_id in existing],
+            STAT_FIELDS + ['updated_at'],
+        )
+        StudentCirculationStats.objects.bulk_create(
+            [row for row in rows if row.student_id not in existing]
+        )
+    return len(rows)
+
+
+def mark_overdue_loans(now=None, since=None, batch_size=500):
+    """Flip borrowed loans past their due date to overdue and bump the counters.
+
+    Loans waiting in ``pending_return`` keep that status, the same rule
+    ``BorrowRecord.save()`` applies. With ``since``, only loans that fell
+    due at or after it are looked at. Each batch of ``batch_size`` loans is
+    one UPDATE in its own transaction. Returns the number of loans updated.
+    """
+    if now is None:
+        now = timezone.now()
+    newly_overdue = BorrowRecord.objects.filter(status='borrowed', due_date__lt=now)
+    if since is not None:
+        newly_overdue = newly_overdue.filter(due_date__gte=since)
+    # loan_status_due_idx order, so batches need no sort
+    newly_overdue = newly_overdue.order_by('due_date', 'pk')
+
+    count = 0
+    while True:
+        with transaction.atomic():
+            batch = list(newly_overdue.select_for_update().values('pk', 'student_id')[:batch_size])
+            if not batch:
+                break
+            count += BorrowRecord.objects.filter(pk__in=[row['pk'] for row in batch]).update(status='overdue')
+            per_student = defaultdict(int)
+            for row in batch:
+                per_student[row['student_id']] += 1
+            for student_id, overdue in per_student.items():
+                adjust_student_stats(student_id, overdue_loans=overdue)
+    return count
+
+
+def sweep_overdue_loans(now=None, batch_size=500):
+    """mark_overdue_loans() for loans that fell due since the previous sweep.
+
+    The previous sweep's ``now`` is kept as the ``overdue_sweep``
+    JobWatermark; the first sweep looks at every loan. Loans saved with a
+    due date already behind the watermark are flipped by
+    ``BorrowRecord.save()`` instead. Returns the number of loans updated.
+    """
+    if now is None:
+        now = timezone.now()
+    watermark, _ = JobWatermark.objects.get_or_create(name=OVERDUE_SWEEP)
+    count = mark_overdue_loans(now, since=watermark.value, batch_size=batch_size)
+    watermark.value = now
+    watermark.save(update_fields=['value'])
+    return count
+
+
+def _apply_fine_deltas(deltas):
+    for student_id, delta in deltas.items():
+        adjust_student_stats(student_id, pending_fine_total=delta)
+
+
+def accrue_fines(now=None, batch_size=500):
+    """Bring the Fine ledger up to date for unreturned overdue loans.
+
+    Loans that became overdue since the last run get a pending Fine, and
+    pending fines whose ``accrued_through`` day is behind today are
+    re-priced. Everything else is left untouched, so running this more than
+    once a day is cheap. Returns ``(created, updated)``.
+    """
+    if now is None:
+        now = timezone.now()
+    today = now.astimezone(dt_timezone.utc).date()
+    overdue = BorrowRecord.objects.with_accrued_fine(now).filter(
+        # Same rows as status__in=ACTIVE_STATUSES, but matches active_loan_due_idx
+        status__ne='returned',
+        due_date__lt=now,
+    ).order_by('due_date', 'pk')  # index order, so batches need no sort
+
+    created = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                overdue.filter(fine__isnull=True)
+                .values('pk', 'student_id', 'accrued_fine')[:batch_size]
+            )
+            if not batch:
+                break
+            Fine.objects.bulk_create([
+                Fine(borrow_record_id=row['pk'], amount=row['accrued_fine'], accrued_through=today)
+                for row in batch
+            ])
+            deltas = defaultdict(int)
+            for row in batch:
+                deltas[row['student_id']] += row['accrued_fine']
+            _apply_fine_deltas(deltas)
+        created += len(batch)
+
+    updated = 0
+    stale = overdue.filter(
+        Q(fine__accrued_through__lt=today) | Q(fine__accrued_through__isnull=True),
+        fine__status='pending',
+    )
+    while True:
+        with transaction.atomic():
+            batch = list(
+                stale.values('student_id', 'fine__id', 'fine__amount', 'accrued_fine')[:batch_size]
+            )
+            if not batch:
+                break
+            Fine.objects.bulk_update(
+                [
+                    Fine(pk=row['fine__id'], amount=row['accrued_fine'], accrued_through=today)
+                    for row in batch
+                ],
+                ['amount', 'accrued_through'],
+            )
+            deltas = defaultdict(int)
+            for row in batch:
+                deltas[row['student_id']] += row['accrued_fine'] - row['fine__amount']
+            _apply_fine_deltas(deltas)
+        updated += len(batch)
+
+    return created, updated
+
+
+def _is_lock_error(exc):
+    # SQLite reports writer contention as "database is locked" (or "table is
+    # locked" with a shared cache)
+    return 'locked' in str(exc)
+
+
+def checkout_book(student, book_id, borrow_duration_days, notes=None, attempts=5, backoff=0.05):
+    """Lend one copy of a book to a student.
+
+    The copy is claimed with a conditional ``UPDATE ... WHERE
+    available_copies > 0`` in the same transaction that creates the loan, so
+    concurrent checkouts can never drive the count below zero. Lock contention
+    is retried with jittered exponential backoff. Raises ``BookUnavailable``
+    when the last copy is gone and ``AlreadyBorrowed`` when the student has
+    the book out already.
+    """
+    for attempt in range(attempts):
+        try:
+            with transaction.atomic():
+                claimed = Book.objects.filter(pk=book_id, available_copies__gt=0).touch(
+                    available_copies=F('available_copies') - 1,
+                )
+                if not claimed:
+                    raise BookUnavailable(book_id)
+                # Checked after the claim, whose write lock on the book makes a
+                # second checkout of it wait until this one commits
+                if BorrowRecord.objects.filter(
+                    student=student, book_id=book_id, status__in=ACTIVE_STATUSES,
+                ).exists():
+                    raise AlreadyBorrowed(book_id)
+                now = timezone.now()
+                record = BorrowRecord.objects.create(
+                    student=student,
+                    book_id=book_id,
+                    borrow_date=now,
+                    due_date=now + timedelta(days=borrow_duration_days),
+                    borrow_duration_days=borrow_duration_days,
+                    notes=notes,
+                    status='borrowed',
+                )
+                adjust_student_stats(student.pk, active_loans=1, lifetime_borrows=1)
+            return record
+        except OperationalError as exc:
+            if not _is_lock_error(exc) or attempt == attempts - 1:
+                raise
+            time.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+def verify_returns(conditions, librarian_notes='', now=None):
+    """Verify many pending returns in one transaction.
+
+    ``conditions`` maps borrow record ids to a book condition ('good',
+    'damaged', 'lost'). Status changes, copy increments and fines are written
+    with bulk queries instead of several round trips per record. Returns one
+    outcome dict per requested id, in the order given.
+    """
+    if now is None:
+        now = timezone.now()
+    outcomes = {
+        record_id: {'record_id': record_id, 'verified': False, 'record': None, 'fine_amount': None}
+        for record_id in conditions
+    }
+
+    with transaction.atomic():
+        records = list(
+            BorrowRecord.objects.select_for_update()
+            .filter(pk__in=list(conditions))
+            .select_related('fine', 'student', 'book')
+        )
+        returned = []
+        for record in records:
+            outcome = outcomes[record.pk]
+            outcome['record'] = record
+            if record.status != 'pending_return':
+                outcome['message'] = 'Not pending return'
+                continue
+            record.status = 'returned'
+            record.return_date = now
+            record.notes = f"Condition: {conditions[record.pk]}\nLibrarian Notes: {librarian_notes}"
+            returned.append(record)
+        BorrowRecord.objects.bulk_update(returned, ['status', 'return_date', 'notes'])
+
+        # One UPDATE for every book, however many copies came back
+        copies = defaultdict(int)
+        for record in returned:
+            copies[record.book_id] += 1
+        if copies:
+            Book.objects.filter(pk__in=list(copies)).touch(
+                available_copies=F('available_copies') + Case(
+                    *[When(pk=book_id, then=Value(count)) for book_id, count in copies.items()],
+                    output_field=IntegerField(),
+                ),
+            )
+
+        new_fines, changed_fines = [], []
+        active_deltas = defaultdict(int)
+        fine_deltas = defaultdict(int)
+        for record in returned:
+            outcome = outcomes[record.pk]
+            outcome['verified'] = True
+            outcome['message'] = 'Returned'
+            active_deltas[record.student_id] -= 1
+
+            fine_amount = Decimal(str(record.calculate_fine()))
+            if fine_amount <= 0:
+                continue
+            outcome['fine_amount'] = fine_amount
+            try:
+                fine = record.fine
+            except Fine.DoesNotExist:
+                new_fines.append(Fine(borrow_record=record, amount=fine_amount, status='pending'))
+                fine_deltas[record.student_id] += fine_amount
+                continue
+            # Don't touch fines that were already paid
+            if fine.status == 'pending':
+                fine_deltas[record.student_id] += fine_amount - fine.amount
+                fine.amount = fine_amount
+                fine.accrued_through = None
+                changed_fines.append(fine)
+        Fine.objects.bulk_create(new_fines)
+        Fine.objects.bulk_update(changed_fines, ['amount', 'accrued_through'])
+
+        for student_id, delta in active_deltas.items():
+            adjust_student_stats(
+                student_id,
+                active_loans=delta,
+                pending_fine_total=fine_deltas.get(student_id, 0),
+            )
+
+    # bulk_update skips the model signals that normally drop these
+    if returned:
+        invalidate_loan_counters()
+
+    for outcome in outcomes.values():
+        outcome.setdefault('message', 'Borrow record not found')
+    return list(outcomes.values())
@@ -0,0 +1,42 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, connection
+
+
+def _on_own_connection(function):
+    def run():
+        # What Django does around each request: reuse the worker thread's
+        # connection while CONN_MAX_AGE allows, reconnect once it's stale
+        close_old_connections()
+        try:
+            return function()
+        finally:
+            close_old_connections()
+    return run
+
+
+def _in_transaction():
+    return connection.in_atomic_block
+
+
+async def gather_queries(*functions):
+    """Run independent read-only ORM callables at the same time and return their results.
+
+    Django's async ORM methods (``aget``, ``acount``...) all go through one
+    thread-sensitive executor, so awaiting several with ``asyncio.gather()``
+    still runs them one after another. Here each callable gets a worker
+    thread, and so a database connection, of its own. Worker connections
+    are kept for CONN_MAX_AGE like request connections; at the default of
+    0 each request opens and closes one per callable.
+
+    Inside a transaction (ATOMIC_REQUESTS, TestCase) other connections can't
+    see its uncommitted rows, so the callables run in turn on the request's
+    connection instead.
+    """
+    if await sync_to_async(_in_transaction)():
+        return await sync_to_async(lambda: [function() for function in functions])()
+    return await asyncio.gather(*(
+        sync_to_async(_on_own_connection(function), thread_sensitive=False)()
+        for function in functions
+    ))
@@ -0,0 +1,3 @@
+def user_role(request):
+    """Expose the role resolved by UserRoleMiddleware to templates"""
+    return {'user_role': getattr(request, 'user_role', None)}
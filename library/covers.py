@@ -0,0 +1,131 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .models import Book
+
+logger = logging.getLogger(__name__)
+
+# Bounding boxes (width, height); covers are shrunk to fit, never enlarged
+COVER_SIZES = {
+    'small': (160, 240),    # previews on the borrow/delete pages
+    'medium': (400, 600),   # catalog cards
+    'large': (800, 1200),   # book detail page
+}
+THUMBNAIL_DIR = 'thumbs'
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+
+_executor = None
+_slots = None
+_executor_lock = threading.Lock()
+
+
+def thumbnail_name(name, size, extension):
+    """Storage name of one derivative, e.g. book_covers/ab/thumbs/ab12...ef-medium.webp"""
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, THUMBNAIL_DIR, f'{stem}-{size}.{extension}')
+
+
+def thumbnail_url(field, size):
+    """URLs of the ``(jpeg, webp)`` derivatives, or ``None`` if they aren't built yet"""
+    jpeg_name = thumbnail_name(field.name, size, 'jpg')
+    # The WebP file is written before the JPEG, so one check covers both
+    if not field.storage.exists(jpeg_name):
+        return None
+    return field.storage.url(jpeg_name), field.storage.url(thumbnail_name(field.name, size, 'webp'))
+
+
+def _save(storage, name, image, **options):
+    buffer = BytesIO()
+    image.save(buffer, **options)
+    # Keep the derived name; storage.save() would rename the file after its hash
+    storage.save_exact(name, ContentFile(buffer.getvalue()))
+
+
+def generate_thumbnails(name, storage=None):
+    """Write every JPEG and WebP derivative of the cover stored as ``name``.
+
+    Returns False (and logs) when the file is missing or not an image.
+    """
+    if storage is None:
+        storage = Book._meta.get_field('cover_image').storage
+    try:
+        with storage.open(name) as source:
+            original = ImageOps.exif_transpose(Image.open(source))
+            original.load()
+    except (OSError, UnidentifiedImageError):
+        logger.warning('Cannot build thumbnails for %s', name, exc_info=True)
+        return False
+
+    if original.mode not in ('RGB', 'L'):
+        original = original.convert('RGB')
+    for size, box in COVER_SIZES.items():
+        image = original.copy()
+        image.thumbnail(box, Image.LANCZOS)
+        _save(storage, thumbnail_name(name, size, 'webp'), image, format='WEBP', quality=WEBP_QUALITY, method=4)
+        _save(
+            storage, thumbnail_name(name, size, 'jpg'), image,
+            format='JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True,
+        )
+    return True
+
+
+def thumbnails_built(names):
+    """Move on the version of books using these covers, so cached cards pick up the thumbnails"""
+    Book.objects.filter(cover_image__in=list(names)).touch()
+
+
+def _build(name):
+    if generate_thumbnails(name):
+        thumbnails_built([name])
+
+
+def _get_executor():
+    global _executor, _slots
+    with _executor_lock:
+        if _executor is None:
+            workers = getattr(settings, 'LIBRARY_THUMBNAIL_WORKERS', 2)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cover-thumbnails')
+            _slots = threading.BoundedSemaphore(getattr(settings, 'LIBRARY_THUMBNAIL_QUEUE', 50))
+        return _executor
+
+
+def _run(name):
+    try:
+        _build(name)
+    except Exception:
+        logger.exception('Thumbnail job for %s failed', name)
+    finally:
+        # Pool threads outlive the job; don't leave their connection open
+        connection.close()
+        _slots.release()
+
+
+def schedule_thumbnails(name):
+    """Build a cover's thumbnails in the background once the transaction commits.
+
+    Jobs run on a small shared thread pool. When its backlog is full the job
+    is dropped; pages keep serving the original until build_cover_thumbnails
+    catches up. ``LIBRARY_THUMBNAIL_WORKERS = 0`` builds them inline instead.
+    """
+    if not getattr(settings, 'LIBRARY_THUMBNAIL_WORKERS', 2):
+        transaction.on_commit(lambda: _build(name))
+        return
+
+    def submit():
+        executor = _get_executor()
+        if not _slots.acquire(blocking=False):
+            logger.warning('Thumbnail queue full, skipping %s', name)
+            return
+        executor.submit(_run, name)
+
+    transaction.on_commit(submit)
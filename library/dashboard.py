@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Book, BorrowRecord, Student
+
+CACHE_PREFIX = 'library:dashboard:'
+COUNTER_KEYS = ['total_books', 'total_students', 'borrowed_books', 'overdue_books']
+# Loan counters can't be adjusted in place (overdue depends on the clock), so
+# loan changes drop them and the next page view recounts
+LOAN_COUNTER_KEYS = ['borrowed_books', 'overdue_books']
+HITS_KEY = CACHE_PREFIX + 'hits'
+MISSES_KEY = CACHE_PREFIX + 'misses'
+
+
+def _timeout():
+    # Upper bound on how stale the counters may get between invalidations
+    return getattr(settings, 'LIBRARY_DASHBOARD_CACHE_TIMEOUT', 60)
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Key expired or was never set
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def compute_dashboard_stats(now=None):
+    if now is None:
+        now = timezone.now()
+    # status__ne rather than status__in so the active_loan_due_idx partial index applies
+    active = BorrowRecord.objects.filter(status__ne='returned')
+    return {
+        'total_books': Book.objects.count(),
+        'total_students': Student.objects.count(),
+        # Count all books that are currently borrowed (not returned yet)
+        'borrowed_books': active.count(),
+        # Count overdue books: due_date has passed and status is not 'returned'
+        'overdue_books': active.filter(due_date__lt=now).count(),
+    }
+
+
+def get_dashboard_stats():
+    """Return the librarian dashboard counters, from the cache when possible"""
+    keys = [CACHE_PREFIX + name for name in COUNTER_KEYS]
+    cached = cache.get_many(keys)
+    if len(cached) == len(keys):
+        _count(HITS_KEY)
+        return {name: cached[CACHE_PREFIX + name] for name in COUNTER_KEYS}
+
+    _count(MISSES_KEY)
+    stats = compute_dashboard_stats()
+    cache.set_many({CACHE_PREFIX + name: value for name, value in stats.items()}, _timeout())
+    return stats
+
+
+def adjust_dashboard_counter(name, delta):
+    """Nudge a cached counter, leaving it for a recount if it isn't cached"""
+    try:
+        cache.incr(CACHE_PREFIX + name, delta)
+    except ValueError:
+        pass
+
+
+def invalidate_loan_counters():
+    cache.delete_many([CACHE_PREFIX + name for name in LOAN_COUNTER_KEYS])
+
+
+def dashboard_cache_info():
+    return {
+        'hits': cache.get(HITS_KEY, 0),
+        'misses': cache.get(MISSES_KEY, 0),
+    }
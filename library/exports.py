@@ -0,0 +1,185 @@
+import csv
+import io
+import json
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.utils import timezone
+
+from .circulation import ACTIVE_STATUSES
+from .models import BorrowRecord, Fine, Student
+
+EXPORT_FORMATS = ['csv', 'jsonl']
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+# Rows fetched from the database per round trip
+DEFAULT_CHUNK_SIZE = 2000
+# Output is handed on in pieces of roughly this many characters
+BUFFER_SIZE = 64 * 1024
+
+
+class Export:
+    """How to select, filter and flatten one exportable table"""
+
+    def __init__(self, model, related, date_field, columns, statuses):
+        self.model = model
+        self.related = related
+        self.date_field = date_field
+        # (column name, function taking the row object)
+        self.columns = columns
+        # status value -> Q-style filter kwargs
+        self.statuses = statuses
+
+    @property
+    def header(self):
+        return [name for name, _ in self.columns]
+
+    def queryset(self, start=None, end=None, status=''):
+        """Rows to export, in primary key order; ``start``/``end`` are inclusive dates"""
+        queryset = self.model.objects.select_related(*self.related).order_by('pk')
+        if start:
+            queryset = queryset.filter(**{f'{self.date_field}__gte': _day_start(start)})
+        if end:
+            queryset = queryset.filter(**{f'{self.date_field}__lt': _day_start(end + timedelta(days=1))})
+        if status:
+            queryset = queryset.filter(**self.statuses[status])
+        return queryset
+
+    def row(self, obj):
+        return [_plain(value(obj)) for _, value in self.columns]
+
+
+def _day_start(day):
+    # Range on the raw column rather than __date so the date index can be used
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+EXPORTS = {
+    'loans': Export(
+        BorrowRecord,
+        related=['student', 'book'],
+        date_field='borrow_date',
+        columns=[
+            ('id', lambda record: record.pk),
+            ('student_id', lambda record: record.student.student_id),
+            ('student_name', lambda record: record.student.name),
+            ('isbn', lambda record: record.book.isbn),
+            ('title', lambda record: record.book.title),
+            ('borrow_date', lambda record: record.borrow_date),
+            ('due_date', lambda record: record.due_date),
+            ('return_requested_date', lambda record: record.return_requested_date),
+            ('return_date', lambda record: record.return_date),
+            ('status', lambda record: record.status),
+        ],
+        statuses={
+            # Same grouping as the borrow list's "Currently Borrowed" filter
+            'currently_borrowed': {'status__in': ACTIVE_STATUSES},
+            **{value: {'status': value} for value, _ in BorrowRecord.STATUS_CHOICES},
+        },
+    ),
+    'fines': Export(
+        Fine,
+        related=['borrow_record__student', 'borrow_record__book'],
+        date_field='borrow_record__borrow_date',
+        columns=[
+            ('id', lambda fine: fine.pk),
+            ('loan_id', lambda fine: fine.borrow_record_id),
+            ('student_id', lambda fine: fine.borrow_record.student.student_id),
+            ('student_name', lambda fine: fine.borrow_record.student.name),
+            ('isbn', lambda fine: fine.borrow_record.book.isbn),
+            ('title', lambda fine: fine.borrow_record.book.title),
+            ('borrow_date', lambda fine: fine.borrow_record.borrow_date),
+            ('due_date', lambda fine: fine.borrow_record.due_date),
+            ('amount', lambda fine: fine.amount),
+            ('accrued_through', lambda fine: fine.accrued_through),
+            ('status', lambda fine: fine.status),
+            ('paid_date', lambda fine: fine.paid_date),
+        ],
+        statuses={value: {'status': value} for value, _ in Fine.STATUS_CHOICES},
+    ),
+    'students': Export(
+        Student,
+        related=['circulation_stats'],
+        date_field='created_at',
+        columns=[
+            ('id', lambda student: student.pk),
+            ('student_id', lambda student: student.student_id),
+            ('name', lambda student: student.name),
+            ('email', lambda student: student.email),
+            ('phone', lambda student: student.phone),
+            ('created_at', lambda student: student.created_at),
+            ('active_loans', lambda student: _stat(student, 'active_loans')),
+            ('overdue_loans', lambda student: _stat(student, 'overdue_loans')),
+            ('pending_fine_total', lambda student: _stat(student, 'pending_fine_total')),
+        ],
+        statuses={
+            'borrowing': {'circulation_stats__active_loans__gt': 0},
+            'overdue': {'circulation_stats__overdue_loans__gt': 0},
+            'owing': {'circulation_stats__pending_fine_total__gt': 0},
+        },
+    ),
+}
+
+
+def _stat(student, field):
+    try:
+        return getattr(student.circulation_stats, field)
+    except Student.circulation_stats.RelatedObjectDoesNotExist:
+        # Row not built yet; reconcile_circulation_stats fills it in
+        return None
+
+
+def _chunked(lines):
+    buffer = io.StringIO()
+    for line in lines:
+        buffer.write(line)
+        if buffer.tell() >= BUFFER_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _csv_lines(export, objects):
+    line = io.StringIO()
+    writer = csv.writer(line)
+
+    def render(values):
+        line.seek(0)
+        line.truncate()
+        writer.writerow(values)
+        return line.getvalue()
+
+    yield render(export.header)
+    for obj in objects:
+        yield render(export.row(obj))
+
+
+def _jsonl_lines(export, objects):
+    header = export.header
+    for obj in objects:
+        yield json.dumps(dict(zip(header, export.row(obj)))) + '\n'
+
+
+def stream_export(name, fmt='csv', start=None, end=None, status='', chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the export as text chunks without holding the result set in memory.
+
+    Rows are read with ``.iterator(chunk_size=...)`` so only one chunk of
+    model instances is alive at a time.
+    """
+    export = EXPORTS[name]
+    objects = export.queryset(start, end, status).iterator(chunk_size=chunk_size)
+    lines = _csv_lines(export, objects) if fmt == 'csv' else _jsonl_lines(export, objects)
+    return _chunked(lines)
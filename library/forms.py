@@ -1,6 +1,12 @@
 from django import forms
 from .models import Book, Student, BorrowRecord
 
+CONDITION_CHOICES = [
+    ('good', 'Good Condition'),
+    ('damaged', 'Damaged'),
+    ('lost', 'Lost'),
+]
+
 class BookForm(forms.ModelForm):
     class Meta:
         model = Book
@@ -49,11 +55,7 @@ class BorrowBookForm(forms.ModelForm):
 
 class ReturnVerificationForm(forms.Form):
     condition = forms.ChoiceField(
-        choices=[
-            ('good', 'Good Condition'),
-            ('damaged', 'Damaged'),
-            ('lost', 'Lost'),
-        ],
+        choices=CONDITION_CHOICES,
         widget=forms.RadioSelect,
         label='Book Condition'
     )
@@ -65,4 +67,25 @@ class ReturnVerificationForm(forms.Form):
         }),
         required=False,
         label='Librarian Notes'
-    )
\ No newline at end of file
+    )
+
+class ExportFilterForm(forms.Form):
+    format = forms.ChoiceField(choices=[('csv', 'CSV'), ('jsonl', 'JSON Lines')], required=False)
+    start = forms.DateField(required=False, label='From')
+    end = forms.DateField(required=False, label='To')
+    status = forms.ChoiceField(required=False)
+
+    def __init__(self, *args, statuses=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['status'].choices = [('', 'All')] + [(status, status) for status in statuses]
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start = cleaned_data.get('start')
+        end = cleaned_data.get('end')
+        
+        if start and end and start > end:
+            raise forms.ValidationError('Start date must be on or before the end date')
+        
+        cleaned_data['format'] = cleaned_data.get('format') or 'csv'
+        return cleaned_data
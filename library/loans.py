@@ -0,0 +1,33 @@
+from django.utils import timezone
+
+
+class LoanView:
+    """A loan for the circulation templates, its date maths done once.
+
+    ``accrued_fine``, ``days_until_due``, ``days_overdue``, ``is_overdue``
+    and ``should_warn`` are plain attributes worked out against one "now";
+    everything else (``book``, ``status``, ``fine``...) comes from the loan.
+    """
+
+    __slots__ = ('record', 'accrued_fine', 'days_until_due', 'days_overdue', 'is_overdue', 'should_warn')
+
+    def __init__(self, record, now):
+        self.record = record
+        self.accrued_fine = record.calculate_fine(now)
+        self.days_until_due = record.days_until_due(now)
+        self.days_overdue = record.days_overdue(now)
+        self.is_overdue = record.is_overdue(now)
+        self.should_warn = record.should_warn(now, days_left=self.days_until_due)
+
+    def __getattr__(self, name):
+        # Only reached for names not in __slots__
+        if name == 'record':
+            raise AttributeError(name)
+        return getattr(self.record, name)
+
+
+def loan_views(records, now=None):
+    """Wrap ``records`` in LoanViews sharing a single timestamp"""
+    if now is None:
+        now = timezone.now()
+    return [LoanView(record, now) for record in records]
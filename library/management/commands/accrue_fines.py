@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from library.circulation import accrue_fines
+
+class Command(BaseCommand):
+    help = 'Accrue fines for overdue loans into the Fine ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of fines written per transaction (default: 500)',
+        )
+        parser.add_argument(
+            '--daemon',
+            action='store_true',
+            help='Keep running and accrue again every --interval seconds',
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=3600,
+            help='Seconds between runs in daemon mode (default: 3600)',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        if options['interval'] < 0:
+            raise CommandError('--interval must not be negative')
+        
+        while True:
+            created, updated = accrue_fines(batch_size=options['batch_size'])
+            
+            self.stdout.write(
+                self.style.SUCCESS(f'Successfully accrued fines: {created} new, {updated} updated')
+            )
+            
+            if not options['daemon']:
+                break
+            time.sleep(options['interval'])
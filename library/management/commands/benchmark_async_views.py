@@ -0,0 +1,82 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from library.benchmark import default_accounts, run_async_comparison
+
+class Command(BaseCommand):
+    help = 'Compare the sync and async dashboard views under ASGI with simulated database latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=20,
+            help='Sequential requests per view and mode (default: 20)',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=10,
+            help='Simultaneous requests in the burst test (default: 10)',
+        )
+        parser.add_argument(
+            '--latency-ms',
+            type=float,
+            default=5.0,
+            help='Delay added to every SQL query (default: 5)',
+        )
+        parser.add_argument(
+            '--connect-ms',
+            type=float,
+            default=20.0,
+            help='Delay added to every new database connection (default: 20)',
+        )
+        parser.add_argument(
+            '--conn-max-age',
+            type=int,
+            help='Seconds to keep database connections open, in place of CONN_MAX_AGE (default: the setting)',
+        )
+        parser.add_argument('--librarian', help='Username to log in as librarian (default: seed_librarian)')
+        parser.add_argument('--student', help='Username to log in as student (default: a student with loans)')
+        parser.add_argument('--output', help='Write the JSON report here instead of standard output')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--iterations and --concurrency must be at least 1')
+        
+        librarian, student = default_accounts()
+        try:
+            if options['librarian']:
+                librarian = User.objects.get(username=options['librarian'])
+            if options['student']:
+                student = User.objects.get(username=options['student'])
+        except User.DoesNotExist as exc:
+            raise CommandError(str(exc))
+        if librarian is None or student is None:
+            raise CommandError('Need a librarian and a student account; run seed_library first')
+        
+        def progress(result):
+            self.stderr.write(
+                f"{result['url_name']:<20} {result['mode']:<6} {result['status']} "
+                f"p50={result['p50_ms']:.1f}ms p95={result['p95_ms']:.1f}ms "
+                f"{result['concurrent_requests']} at once={result['concurrent_wall_ms']:.0f}ms"
+            )
+        
+        report = run_async_comparison(
+            librarian, student,
+            iterations=options['iterations'],
+            concurrency=options['concurrency'],
+            latency=options['latency_ms'] / 1000,
+            connect_latency=options['connect_ms'] / 1000,
+            max_age=options['conn_max_age'],
+            progress=progress,
+        )
+        
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Successfully wrote {len(report['results'])} results to {options['output']}"))
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,65 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from library.benchmark import default_accounts, run_benchmark
+
+class Command(BaseCommand):
+    help = 'Time every library URL as a librarian and a student, reporting JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=20,
+            help='Timed requests per URL and role (default: 20)',
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=2,
+            help='Untimed requests per URL and role first (default: 2)',
+        )
+        parser.add_argument('--librarian', help='Username to log in as librarian (default: seed_librarian)')
+        parser.add_argument('--student', help='Username to log in as student (default: a student with loans)')
+        parser.add_argument('--output', help='Write the JSON report here instead of standard output')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1')
+        
+        librarian, student = default_accounts()
+        try:
+            if options['librarian']:
+                librarian = User.objects.get(username=options['librarian'])
+            if options['student']:
+                student = User.objects.get(username=options['student'])
+        except User.DoesNotExist as exc:
+            raise CommandError(str(exc))
+        if librarian is None or student is None:
+            raise CommandError('Need a librarian and a student account; run seed_library first')
+        
+        def progress(result):
+            if 'skipped' in result:
+                line = f"{result['url_name']:<28} {result['role']:<10} skipped: {result['skipped']}"
+            else:
+                line = (
+                    f"{result['url_name']:<28} {result['role']:<10} {result['status']} "
+                    f"p50={result['p50_ms']:.1f}ms p95={result['p95_ms']:.1f}ms queries={result['queries']}"
+                )
+            self.stderr.write(line)
+        
+        report = run_benchmark(
+            librarian, student,
+            iterations=options['iterations'],
+            warmup=options['warmup'],
+            progress=progress,
+        )
+        
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Successfully wrote {len(report['results'])} results to {options['output']}"))
+        else:
+            self.stdout.write(output)
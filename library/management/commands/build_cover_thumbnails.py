@@ -0,0 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from library.covers import COVER_SIZES, generate_thumbnails, thumbnail_name, thumbnails_built
+from library.models import Book
+
+class Command(BaseCommand):
+    help = 'Build missing cover thumbnails for existing books'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Rebuild thumbnails that already exist',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of covers processed in parallel (default: 4)',
+        )
+
+    def handle(self, *args, **options):
+        storage = Book._meta.get_field('cover_image').storage
+        names = (
+            Book.objects.exclude(cover_image='').exclude(cover_image__isnull=True)
+            .order_by('cover_image').values_list('cover_image', flat=True).distinct()
+            .iterator(chunk_size=500)
+        )
+        if not options['force']:
+            # The last file generate_thumbnails() writes marks a finished set
+            last_size = list(COVER_SIZES)[-1]
+            names = (name for name in names if not storage.exists(thumbnail_name(name, last_size, 'jpg')))
+
+        built = failed = 0
+        with ThreadPoolExecutor(max_workers=max(options['workers'], 1)) as pool:
+            # Hand the pool a slice at a time so a big catalog isn't queued all at once
+            while True:
+                batch = list(islice(names, 100))
+                if not batch:
+                    break
+                done = []
+                for name, ok in zip(batch, pool.map(lambda name: generate_thumbnails(name, storage), batch)):
+                    if ok:
+                        done.append(name)
+                    else:
+                        failed += 1
+                thumbnails_built(done)
+                built += len(done)
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully built thumbnails for {built} covers ({failed} failed)'))
+        if failed:
+            self.stderr.write('Failed covers are missing or not images; see the log for details')
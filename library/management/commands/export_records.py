@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from library.exports import DEFAULT_CHUNK_SIZE, EXPORT_FORMATS, EXPORTS, stream_export
+from library.forms import ExportFilterForm
+
+class Command(BaseCommand):
+    help = 'Stream loans, fines or students to CSV or JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--start', help='First date to include (YYYY-MM-DD)')
+        parser.add_argument('--end', help='Last date to include (YYYY-MM-DD)')
+        parser.add_argument('--status', default='', help='Only export rows with this status')
+        parser.add_argument(
+            '--output',
+            help='File to write (default: standard output)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help=f'Rows fetched per database round trip (default: {DEFAULT_CHUNK_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        dataset = options['dataset']
+        form = ExportFilterForm(
+            {field: options[field] or '' for field in ['format', 'start', 'end', 'status']},
+            statuses=EXPORTS[dataset].statuses,
+        )
+        if not form.is_valid():
+            raise CommandError('; '.join(error for errors in form.errors.values() for error in errors))
+
+        chunks = stream_export(
+            dataset,
+            form.cleaned_data['format'],
+            start=form.cleaned_data['start'],
+            end=form.cleaned_data['end'],
+            status=form.cleaned_data['status'],
+            chunk_size=options['chunk_size'],
+        )
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+
+        with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stdout.write(self.style.SUCCESS(f'Successfully exported {dataset} to {options["output"]}'))
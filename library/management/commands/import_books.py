@@ -0,0 +1,80 @@
+import io
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from library.catalog import import_books, read_csv_rows, read_jsonl_rows
+
+READERS = {
+    'csv': read_csv_rows,
+    'jsonl': read_jsonl_rows,
+}
+
+# Seconds between progress lines
+PROGRESS_INTERVAL = 5
+
+class Command(BaseCommand):
+    help = 'Import books from a CSV or JSON Lines file, skipping duplicates'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='File to import, or - to read from standard input',
+        )
+        parser.add_argument(
+            '--format',
+            choices=sorted(READERS),
+            help='Input format (default: guessed from the file extension)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of books inserted per bulk_create (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format']
+        if fmt is None:
+            extension = os.path.splitext(path)[1].lower().lstrip('.')
+            fmt = 'jsonl' if extension in ('jsonl', 'ndjson') else 'csv'
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        last_report = [time.monotonic()]
+
+        def progress(result):
+            if time.monotonic() - last_report[0] < PROGRESS_INTERVAL:
+                return
+            last_report[0] = time.monotonic()
+            self.stdout.write(
+                f'{result.rows} rows read, {result.created} created ({result.rate:.0f} rows/s)'
+            )
+
+        try:
+            if path == '-':
+                stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='')
+            else:
+                # newline='' lets the csv module handle line breaks inside quoted fields
+                stream = open(path, encoding='utf-8-sig', newline='')
+        except OSError as exc:
+            raise CommandError(f'Cannot open {path}: {exc}')
+
+        with stream:
+            result = import_books(
+                READERS[fmt](stream),
+                batch_size=options['batch_size'],
+                progress=progress,
+            )
+
+        for error in result.errors:
+            self.stderr.write(error)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully imported {result.created} books from {result.rows} rows '
+                f'({result.duplicates} duplicates, {result.invalid} invalid) '
+                f'in {result.elapsed:.1f}s ({result.rate:.0f} rows/s)'
+            )
+        )
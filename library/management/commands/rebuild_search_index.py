@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from library.search import rebuild_index, search_index_enabled
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for the book catalog'
+
+    def handle(self, *args, **kwargs):
+        if not search_index_enabled():
+            self.stdout.write(
+                self.style.WARNING('Full-text search index is only available on SQLite, nothing to do')
+            )
+            return
+
+        count = rebuild_index()
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully indexed {count} book(s)')
+        )
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from library.circulation import recompute_student_stats
+from library.models import Student
+
+class Command(BaseCommand):
+    help = 'Rebuild per-student circulation counters from borrow records and fines'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of students recounted per transaction (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        total = 0
+        last_id = 0
+
+        # Walk students by primary key so each chunk is a short transaction
+        while True:
+            student_ids = list(
+                Student.objects.filter(pk__gt=last_id)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:chunk_size]
+            )
+            if not student_ids:
+                break
+            total += recompute_student_stats(student_ids)
+            last_id = student_ids[-1]
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully reconciled circulation stats for {total} student(s)')
+        )
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from library.seeding import SEED_LIBRARIAN, SEED_PASSWORD, seed_library
+
+class Command(BaseCommand):
+    help = 'Fill the database with synthetic books, students, loans and fines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=1000, help='Books to create (default: 1000)')
+        parser.add_argument('--students', type=int, default=500, help='Students to create (default: 500)')
+        parser.add_argument('--loans', type=int, default=10000, help='Borrow records to create (default: 10000)')
+        parser.add_argument(
+            '--history-days',
+            type=int,
+            default=365,
+            help='Loans start at random times over this many past days (default: 365)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Rows inserted per bulk_create (default: 2000)',
+        )
+        parser.add_argument('--seed', type=int, help='Random seed, for repeatable data')
+
+    def handle(self, *args, **options):
+        if min(options['books'], options['students'], options['loans']) < 0 or options['batch_size'] < 1:
+            raise CommandError('Counts must be positive')
+        
+        created = seed_library(
+            books=options['books'],
+            students=options['students'],
+            loans=options['loans'],
+            history_days=options['history_days'],
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+            progress=lambda message: self.stdout.write(f'  {message}'),
+        )
+        
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Successfully created {created['books']} books, {created['students']} students, "
+                f"{created['loans']} loans and {created['fines']} fines"
+            )
+        )
+        self.stdout.write(
+            f'Log in as {SEED_LIBRARIAN} or seed_student_0000000 with password {SEED_PASSWORD}; '
+            f'run accrue_fines to price fines on loans still out'
+        )
@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from library.notifications import send_due_notifications
+
+class Command(BaseCommand):
+    help = 'Email students a digest of their due-soon and newly overdue loans'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Number of digests handed to the mail server per batch (default: 100)',
+        )
+        parser.add_argument(
+            '--overdue-days',
+            type=int,
+            default=7,
+            help='Only send overdue notices for loans that fell due in this many days (default: 7)',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['overdue_days'] < 1:
+            raise CommandError('--batch-size and --overdue-days must be at least 1')
+        
+        digests, loans = send_due_notifications(
+            overdue_within=timedelta(days=options['overdue_days']),
+            batch_size=options['batch_size'],
+        )
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully sent {digests} digest(s) covering {loans} loan(s)')
+        )
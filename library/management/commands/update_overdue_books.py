@@ -1,20 +1,51 @@
-from django.core.management.base import BaseCommand
-from django.utils import timezone
-from library.models import BorrowRecord
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from library.circulation import mark_overdue_loans, sweep_overdue_loans
 
 class Command(BaseCommand):
     help = 'Update overdue book statuses'
 
-    def handle(self, *args, **kwargs):
-        # Find all borrowed books that are now overdue
-        overdue_records = BorrowRecord.objects.filter(
-            status__in=['borrowed', 'pending_return'],
-            due_date__lt=timezone.now()
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of loans updated per transaction (default: 500)',
+        )
+        parser.add_argument(
+            '--daemon',
+            action='store_true',
+            help='Keep running and sweep loans that fell due since the last tick every --interval seconds',
         )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=60,
+            help='Seconds between ticks in daemon mode (default: 60)',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        if options['interval'] < 0:
+            raise CommandError('--interval must not be negative')
         
-        count = overdue_records.count()
-        overdue_records.update(status='overdue')
+        if not options['daemon']:
+            # Find all borrowed books that are now overdue and update them
+            # together with the per-student overdue counters
+            count = mark_overdue_loans(batch_size=options['batch_size'])
+            
+            self.stdout.write(
+                self.style.SUCCESS(f'Successfully updated {count} overdue book(s)')
+            )
+            return
         
-        self.stdout.write(
-            self.style.SUCCESS(f'Successfully updated {count} overdue book(s)')
-        )
\ No newline at end of file
+        while True:
+            start = time.perf_counter()
+            count = sweep_overdue_loans(batch_size=options['batch_size'])
+            elapsed = (time.perf_counter() - start) * 1000
+            
+            self.stdout.write(f'Swept overdue loans: {count} updated in {elapsed:.1f} ms')
+            self.stdout.flush()
+            time.sleep(options['interval'])
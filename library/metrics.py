@@ -0,0 +1,222 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates, Template
+
+from .dashboard import dashboard_cache_info
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the request latency histogram
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The request being measured in this thread/task, if any
+_current = ContextVar('library_request_stats', default=None)
+
+_IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def sql_shape(sql):
+    """The SQL with its parameters stripped, so repeats of one query compare equal.
+
+    Django already sends values as ``%s`` parameters; only IN lists of
+    different lengths need folding.
+    """
+    return _SPACE_RE.sub(' ', _IN_LIST_RE.sub('IN (...)', sql)).strip()
+
+
+class RequestStats:
+    """What one request spent on SQL and templates"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.shapes = Counter()
+        # Async views may run queries for one request on several threads
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper() hook
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.sql_time += elapsed
+                self.queries += 1
+                self.shapes[sql_shape(sql)] += 1
+
+    def repeated_queries(self, threshold):
+        """Query shapes run more than ``threshold`` times, most repeated first"""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > threshold]
+
+
+class _ViewMetrics:
+    def __init__(self):
+        self.requests = Counter()  # by status code
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.latency = 0.0
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.n_plus_one = 0
+
+
+_views = defaultdict(_ViewMetrics)
+_lock = threading.Lock()
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper on every connection, feeding the request being measured if there is one"""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    # connection_created receiver. A context variable rather than a per-request
+    # execute_wrapper() reaches the worker threads async views query from
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def measuring(stats):
+    """Attribute SQL and template time in this block to ``stats``"""
+    previous = _current.get()
+    _current.set(stats)
+    try:
+        yield stats
+    finally:
+        # Not reset(token): a streamed body may be closed from another context
+        _current.set(previous)
+
+
+def finish_request(stats, view_name, status_code):
+    """Fold a finished request into the per-view totals"""
+    latency = time.perf_counter() - stats.start
+    threshold = getattr(settings, 'LIBRARY_N_PLUS_ONE_THRESHOLD', 10)
+    repeated = stats.repeated_queries(threshold)
+    for shape, count in repeated:
+        logger.warning('Possible N+1 in %s: %d x %s', view_name, count, shape[:300])
+
+    with _lock:
+        metrics = _views[view_name]
+        metrics.requests[status_code] += 1
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                metrics.buckets[index] += 1
+        metrics.latency += latency
+        metrics.queries += stats.queries
+        metrics.sql_time += stats.sql_time
+        metrics.template_time += stats.template_time
+        metrics.n_plus_one += len(repeated)
+
+
+def reset_metrics():
+    with _lock:
+        _views.clear()
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, adding render time to the current request's stats.
+
+    Only top-level renders are timed; ``{% include %}`` happens inside them.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format (version 0.0.4).
+
+    Totals are kept per process; with several workers each reports its own.
+    """
+    with _lock:
+        snapshot = {
+            name: (
+                dict(metrics.requests), list(metrics.buckets), metrics.latency, metrics.queries,
+                metrics.sql_time, metrics.template_time, metrics.n_plus_one,
+            )
+            for name, metrics in _views.items()
+        }
+
+    lines = [
+        '# HELP library_requests_total Requests handled, by URL name and status code.',
+        '# TYPE library_requests_total counter',
+    ]
+    for view, (requests, *_) in sorted(snapshot.items()):
+        for status, count in sorted(requests.items()):
+            lines.append(f'library_requests_total{_labels(view=view, status=status)} {count}')
+
+    lines += [
+        '# HELP library_request_duration_seconds Time to the last byte of the response.',
+        '# TYPE library_request_duration_seconds histogram',
+    ]
+    for view, (requests, buckets, latency, *_) in sorted(snapshot.items()):
+        for bound, count in zip(LATENCY_BUCKETS, buckets):
+            lines.append(f'library_request_duration_seconds_bucket{_labels(view=view, le=bound)} {count}')
+        total = sum(requests.values())
+        lines.append(f'library_request_duration_seconds_bucket{_labels(view=view, le="+Inf")} {total}')
+        lines.append(f'library_request_duration_seconds_sum{_labels(view=view)} {latency:.6f}')
+        lines.append(f'library_request_duration_seconds_count{_labels(view=view)} {total}')
+
+    totals = [
+        ('library_db_queries_total', 'counter', 'SQL queries run.', 3, '{}'),
+        ('library_db_query_seconds_total', 'counter', 'Time spent in SQL queries.', 4, '{:.6f}'),
+        ('library_template_render_seconds_total', 'counter', 'Time spent rendering templates.', 5, '{:.6f}'),
+        (
+            'library_n_plus_one_total', 'counter',
+            'Query shapes repeated more than LIBRARY_N_PLUS_ONE_THRESHOLD times in one request.', 6, '{}',
+        ),
+    ]
+    for metric, kind, description, field, number in totals:
+        lines += [f'# HELP {metric} {description}', f'# TYPE {metric} {kind}']
+        for view, values in sorted(snapshot.items()):
+            lines.append(f'{metric}{_labels(view=view)} {number.format(values[field])}')
+
+    cache_info = dashboard_cache_info()
+    lines += [
+        '# HELP library_dashboard_cache_hits_total Dashboard counter lookups served from cache.',
+        '# TYPE library_dashboard_cache_hits_total counter',
+        f'library_dashboard_cache_hits_total {cache_info["hits"]}',
+        '# HELP library_dashboard_cache_misses_total Dashboard counter lookups that recounted.',
+        '# TYPE library_dashboard_cache_misses_total counter',
+        f'library_dashboard_cache_misses_total {cache_info["misses"]}',
+    ]
+    return '\n'.join(lines) + '\n'
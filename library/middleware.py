@@ -0,0 +1,81 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.utils.functional import SimpleLazyObject
+
+from .metrics import RequestStats, finish_request, measuring
+from .roles import get_user_role
+
+
+class UserRoleMiddleware:
+    """Resolve the user's role once per request as ``request.user_role``"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        request.user_role = SimpleLazyObject(lambda: get_user_role(request.user))
+        # Under ASGI, hand back the coroutine so async views stay off the sync thread
+        return self.get_response(request)
+
+
+class RequestMetricsMiddleware:
+    """Record latency, SQL and template time per URL name for the /metrics view.
+
+    Goes first in MIDDLEWARE so the session and auth queries are counted too.
+    Streamed exports run their queries while the body is sent, so those are
+    measured until the last chunk.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        with measuring(stats):
+            response = self.get_response(request)
+        return self._finish(request, response, stats)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        with measuring(stats):
+            response = await self.get_response(request)
+        return self._finish(request, response, stats)
+
+    def _finish(self, request, response, stats):
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else 'unresolved'
+
+        # FileResponse keeps its file for wsgi.file_wrapper; wrapping it would lose that
+        if response.streaming and getattr(response, 'file_to_stream', None) is None:
+            if response.is_async:
+                content = self._astream(response.streaming_content, stats, view_name, response)
+            else:
+                content = self._stream(response.streaming_content, stats, view_name, response)
+            response.streaming_content = content
+        else:
+            finish_request(stats, view_name, response.status_code)
+        return response
+
+    def _stream(self, content, stats, view_name, response):
+        try:
+            with measuring(stats):
+                yield from content
+        finally:
+            finish_request(stats, view_name, response.status_code)
+
+    async def _astream(self, content, stats, view_name, response):
+        try:
+            with measuring(stats):
+                async for chunk in content:
+                    yield chunk
+        finally:
+            finish_request(stats, view_name, response.status_code)
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+
+BOOK_SEARCH_COLUMNS = ['title', 'author', 'publisher', 'category', 'description', 'isbn']
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    columns = ', '.join(BOOK_SEARCH_COLUMNS)
+    source_columns = ', '.join(f"COALESCE({column}, '')" for column in BOOK_SEARCH_COLUMNS)
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS library_book_fts USING fts5("
+        f"{columns}, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(
+        f"INSERT INTO library_book_fts (rowid, {columns}) "
+        f"SELECT id, {source_columns} FROM library_book"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS library_book_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0004_borrowrecord_borrow_duration_days_borrowrecord_notes_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
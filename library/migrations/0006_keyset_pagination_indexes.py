@@ -0,0 +1,25 @@
+# Generated by Django 4.2.27 on 2026-10-16 22:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0005_book_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['title', 'id'], name='book_title_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowrecord',
+            index=models.Index(fields=['borrow_date', 'id'], name='borrow_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['name', 'id'], name='student_name_id_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.27 on 2026-10-16 22:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_circulation_stats(apps, schema_editor):
+    Student = apps.get_model('library', 'Student')
+    BorrowRecord = apps.get_model('library', 'BorrowRecord')
+    Fine = apps.get_model('library', 'Fine')
+    StudentCirculationStats = apps.get_model('library', 'StudentCirculationStats')
+
+    stats = {
+        student_id: StudentCirculationStats(student_id=student_id)
+        for student_id in Student.objects.values_list('id', flat=True)
+    }
+    loans = BorrowRecord.objects.values('student_id').annotate(
+        active=models.Count('id', filter=models.Q(status__in=['borrowed', 'pending_return', 'overdue'])),
+        overdue=models.Count('id', filter=models.Q(status='overdue')),
+        lifetime=models.Count('id'),
+    )
+    for row in loans:
+        stats[row['student_id']].active_loans = row['active']
+        stats[row['student_id']].overdue_loans = row['overdue']
+        stats[row['student_id']].lifetime_borrows = row['lifetime']
+    fines = Fine.objects.filter(status='pending').values('borrow_record__student_id').annotate(
+        total=models.Sum('amount'),
+    )
+    for row in fines:
+        stats[row['borrow_record__student_id']].pending_fine_total = row['total']
+    StudentCirculationStats.objects.bulk_create(stats.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0006_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentCirculationStats',
+            fields=[
+                ('student', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='circulation_stats', serialize=False, to='library.student')),
+                ('active_loans', models.IntegerField(default=0)),
+                ('overdue_loans', models.IntegerField(default=0)),
+                ('pending_fine_total', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('lifetime_borrows', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(populate_circulation_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-16 22:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0007_studentcirculationstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fine',
+            name='accrued_through',
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
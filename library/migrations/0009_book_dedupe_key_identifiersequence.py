@@ -0,0 +1,52 @@
+# Generated by Django 4.2.27 on 2026-10-16 22:38
+
+import hashlib
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+
+def _normalize(value):
+    # Frozen copy of library.models.normalize_book_key
+    value = unicodedata.normalize('NFKD', value or '')
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return ' '.join(re.findall(r'\w+', value.casefold()))
+
+
+def populate_dedupe_keys(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    batch = []
+    for book in Book.objects.only('id', 'title', 'author').order_by('pk').iterator(chunk_size=1000):
+        book.dedupe_key = hashlib.sha1(
+            f'{_normalize(book.title)}|{_normalize(book.author)}'.encode()
+        ).hexdigest()
+        batch.append(book)
+        if len(batch) == 1000:
+            Book.objects.bulk_update(batch, ['dedupe_key'])
+            batch = []
+    Book.objects.bulk_update(batch, ['dedupe_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0008_fine_accrued_through'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdentifierSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='dedupe_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=40),
+        ),
+        migrations.RunPython(populate_dedupe_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.27 on 2026-10-16 22:47
+
+from django.db import migrations, models
+import library.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0009_book_dedupe_key_identifiersequence'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='cover_image',
+            field=models.ImageField(blank=True, null=True, storage=library.storage.ContentAddressedStorage(), upload_to='book_covers/'),
+        ),
+    ]
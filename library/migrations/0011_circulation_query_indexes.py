@@ -0,0 +1,29 @@
+# Generated by Django 4.2.27 on 2026-10-16 22:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0010_book_cover_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='borrowrecord',
+            index=models.Index(fields=['status', 'due_date'], name='loan_status_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowrecord',
+            index=models.Index(fields=['student', 'status'], name='loan_student_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowrecord',
+            index=models.Index(condition=models.Q(('status__ne', 'returned')), fields=['due_date'], name='active_loan_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fine',
+            index=models.Index(fields=['status', 'borrow_record'], name='fine_status_loan_idx'),
+        ),
+    ]
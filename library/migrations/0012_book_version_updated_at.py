@@ -0,0 +1,25 @@
+# Generated by Django 4.2.27 on 2026-10-16 23:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0011_circulation_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
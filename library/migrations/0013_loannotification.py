@@ -0,0 +1,28 @@
+# Generated by Django 4.2.27 on 2026-10-16 23:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0012_book_version_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoanNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('due_soon', 'Due soon'), ('overdue', 'Overdue')], max_length=10)),
+                ('sent_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('borrow_record', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='library.borrowrecord')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='loannotification',
+            constraint=models.UniqueConstraint(fields=('borrow_record', 'kind'), name='loan_notification_once'),
+        ),
+    ]
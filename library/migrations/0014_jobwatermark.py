@@ -0,0 +1,21 @@
+# Generated by Django 4.2.27 on 2026-10-16 23:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0013_loannotification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
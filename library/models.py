@@ -1,7 +1,66 @@
 from django.db import models
+from django.db.models import (
+    Case, Count, DecimalField, ExpressionWrapper, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When,
+)
+from django.db.models.functions import Coalesce, Greatest, TruncDate
 from django.contrib.auth.models import User
 from django.utils import timezone
-from datetime import timedelta
+from datetime import timedelta, timezone as dt_timezone
+from decimal import Decimal
+import hashlib
+import re
+import unicodedata
+
+from .storage import cover_storage
+
+# Late return fine, charged per calendar day overdue
+FINE_PER_DAY = Decimal('1.00')
+
+
+def normalize_book_key(title, author):
+    """Hash of the case/accent/punctuation-insensitive title and author, used to spot duplicate books"""
+    def normalize(value):
+        value = unicodedata.normalize('NFKD', value or '')
+        value = ''.join(char for char in value if not unicodedata.combining(char))
+        return ' '.join(re.findall(r'\w+', value.casefold()))
+    return hashlib.sha1(f'{normalize(title)}|{normalize(author)}'.encode()).hexdigest()
+
+
+class DaysBetween(models.Func):
+    """Whole calendar days from ``start`` to ``end`` (both date expressions)"""
+    output_field = IntegerField()
+
+    def __init__(self, end, start, **extra):
+        super().__init__(end, start, **extra)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='CAST(julianday(%(expressions)s) AS INTEGER)',
+            arg_joiner=') - julianday(',
+            **extra_context,
+        )
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='(%(expressions)s)', arg_joiner=' - ', **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, function='DATEDIFF', **extra_context)
+
+
+@models.Field.register_lookup
+class NotEqual(models.Lookup):
+    """``field__ne=value``, rendered as ``<>``.
+
+    Unlike ``exclude()``'s ``NOT (field = value)``, SQLite can match this
+    against a partial index with the same condition.
+    """
+    lookup_name = 'ne'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} <> {rhs}', lhs_params + rhs_params
 
 # Add this new model for user profiles
 class UserProfile(models.Model):
@@ -17,6 +76,44 @@ class UserProfile(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.role}"
 
+class StudentQuerySet(models.QuerySet):
+    def with_loan_stats(self):
+        """Annotate borrowed_count, overdue_count and total_fines in a single query"""
+        pending_fines = Fine.objects.filter(
+            borrow_record__student=OuterRef('pk'),
+            status='pending',
+        ).values('borrow_record__student').annotate(total=Sum('amount')).values('total')
+
+        return self.annotate(
+            borrowed_count=Count(
+                'borrowrecord',
+                filter=Q(borrowrecord__status__in=['borrowed', 'pending_return', 'overdue']),
+            ),
+            overdue_count=Count(
+                'borrowrecord',
+                filter=Q(borrowrecord__status='overdue'),
+            ),
+            # Subquery rather than a second join so fines aren't multiplied by loans
+            total_fines=Coalesce(
+                Subquery(pending_fines, output_field=DecimalField(max_digits=10, decimal_places=2)),
+                Value(Decimal('0.00')),
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            ),
+        )
+
+    def with_circulation_stats(self):
+        """Same figures as with_loan_stats(), read from the maintained StudentCirculationStats row"""
+        return self.annotate(
+            borrowed_count=Coalesce('circulation_stats__active_loans', 0),
+            overdue_count=Coalesce('circulation_stats__overdue_loans', 0),
+            total_fines=Coalesce(
+                'circulation_stats__pending_fine_total',
+                Value(Decimal('0.00')),
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            ),
+        )
+
+
 class Student(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True)
     student_id = models.CharField(max_length=20, unique=True)
@@ -25,11 +122,27 @@ class Student(models.Model):
     phone = models.CharField(max_length=15)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = StudentQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.student_id} - {self.name}"
 
     class Meta:
         ordering = ['name']
+        indexes = [
+            # Keyset pagination reads (name, id) ranges
+            models.Index(fields=['name', 'id'], name='student_name_id_idx'),
+        ]
+
+
+class BookQuerySet(models.QuerySet):
+    def touch(self, **changes):
+        """``update(**changes)`` that also moves each book's version and updated_at on.
+
+        Use it for any bulk change to what a catalog card shows, since
+        ``update()`` skips save().
+        """
+        return self.update(version=F('version') + 1, updated_at=timezone.now(), **changes)
 
 
 class Book(models.Model):
@@ -39,16 +152,76 @@ class Book(models.Model):
     publisher = models.CharField(max_length=100)
     category = models.CharField(max_length=50)
     description = models.TextField(blank=True, null=True)  # New field
-    cover_image = models.ImageField(upload_to='book_covers/', blank=True, null=True)  # New field
+    cover_image = models.ImageField(upload_to='book_covers/', storage=cover_storage, blank=True, null=True)  # New field
     total_copies = models.IntegerField(default=1)
     available_copies = models.IntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
+    # normalize_book_key(title, author), kept in step by save()
+    dedupe_key = models.CharField(max_length=40, db_index=True, editable=False, default='')
+    # Bumped on every change; cached catalog cards are keyed on (id, version)
+    version = models.PositiveIntegerField(default=1, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BookQuerySet.as_manager()
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        self.dedupe_key = normalize_book_key(self.title, self.author)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            changed = {'version', 'updated_at'}
+            if {'title', 'author'} & set(update_fields):
+                changed.add('dedupe_key')
+            kwargs['update_fields'] = set(update_fields) | changed
+        bumped = not self._state.adding
+        if bumped:
+            # F() so two concurrent saves can't both write the same version
+            self.version = F('version') + 1
+        super().save(*args, **kwargs)
+        if bumped:
+            self.refresh_from_db(fields=['version'])
+
     class Meta:
         ordering = ['title']
+        indexes = [
+            # Keyset pagination reads (title, id) ranges
+            models.Index(fields=['title', 'id'], name='book_title_id_idx'),
+        ]
+
+
+class BorrowRecordQuerySet(models.QuerySet):
+    def with_accrued_fine(self, now=None):
+        """Annotate accrued_days and accrued_fine using the same rules as calculate_fine()"""
+        if now is None:
+            now = timezone.now()
+        # calculate_fine() compares the UTC calendar dates of the stored datetimes
+        due_day = TruncDate('due_date', tzinfo=dt_timezone.utc)
+        return_day = TruncDate('return_date', tzinfo=dt_timezone.utc)
+        today = Value(now.astimezone(dt_timezone.utc).date())
+
+        # Same calendar day but past the due time still counts as one day
+        accrued_days = Case(
+            When(
+                status__in=['borrowed', 'overdue', 'pending_return'],
+                due_date__lt=now,
+                then=Greatest(DaysBetween(today, due_day), Value(1)),
+            ),
+            When(
+                status='returned',
+                return_date__gt=F('due_date'),
+                then=Greatest(DaysBetween(return_day, due_day), Value(1)),
+            ),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+        return self.annotate(accrued_days=accrued_days).annotate(
+            accrued_fine=ExpressionWrapper(
+                F('accrued_days') * Value(FINE_PER_DAY),
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            ),
+        )
 
 
 class BorrowRecord(models.Model):
@@ -69,6 +242,8 @@ class BorrowRecord(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='borrowed')
     notes = models.TextField(blank=True, null=True)
 
+    objects = BorrowRecordQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.student.name} - {self.book.title}"
 
@@ -87,8 +262,10 @@ class BorrowRecord(models.Model):
         
         super().save(*args, **kwargs)
 
-    def calculate_fine(self):
+    def calculate_fine(self, now=None):
         """Calculate fine based on overdue days"""
+        if now is None:
+            now = timezone.now()
         if self.status == 'returned' and self.return_date:
             if self.return_date > self.due_date:
                 # Calculate days overdue based on dates
@@ -98,32 +275,36 @@ class BorrowRecord(models.Model):
                 # If same calendar day but time has passed, count as 1 day
                 if days_overdue == 0:
                     days_overdue = 1
-                return days_overdue * 1.0  # RM1 per day
+                return days_overdue * float(FINE_PER_DAY)
         elif self.status in ['borrowed', 'overdue', 'pending_return']:
-            if timezone.now() > self.due_date:
+            if now > self.due_date:
                 # Calculate days overdue based on dates
-                now_date = timezone.now().date()
+                now_date = now.date()
                 due_date = self.due_date.date() if hasattr(self.due_date, 'date') else self.due_date
                 days_overdue = (now_date - due_date).days
                 # If same calendar day but time has passed, count as 1 day overdue
                 if days_overdue == 0:
                     days_overdue = 1
-                return days_overdue * 1.0
+                return days_overdue * float(FINE_PER_DAY)
         return 0.0
     
-    def days_until_due(self):
+    def days_until_due(self, now=None):
         """Calculate days until due date (negative if overdue)"""
         if self.status == 'returned':
             return None
-        delta = self.due_date - timezone.now()
+        if now is None:
+            now = timezone.now()
+        delta = self.due_date - now
         return delta.days
     
-    def days_overdue(self):
+    def days_overdue(self, now=None):
         """Calculate days overdue as a positive number"""
-        if self.status == 'returned' or timezone.now() <= self.due_date:
+        if now is None:
+            now = timezone.now()
+        if self.status == 'returned' or now <= self.due_date:
             return 0
         # Calculate days overdue based on dates
-        now_date = timezone.now().date()
+        now_date = now.date()
         due_date = self.due_date.date() if hasattr(self.due_date, 'date') else self.due_date
         days_overdue = (now_date - due_date).days
         # If same calendar day but time has passed, count as 1 day overdue
@@ -131,19 +312,34 @@ class BorrowRecord(models.Model):
             days_overdue = 1
         return days_overdue
     
-    def is_overdue(self):
+    def is_overdue(self, now=None):
         """Check if book is overdue"""
-        return timezone.now() > self.due_date and self.status != 'returned'
+        if now is None:
+            now = timezone.now()
+        return now > self.due_date and self.status != 'returned'
     
-    def should_warn(self):
+    def should_warn(self, now=None, days_left=None):
         """Check if student should receive warning (within 3 days of due date)"""
         if self.status in ['borrowed', 'pending_return']:
-            days_left = self.days_until_due()
+            if days_left is None:
+                days_left = self.days_until_due(now)
             return days_left is not None and 0 <= days_left <= 3
         return False
 
     class Meta:
         ordering = ['-borrow_date']
+        indexes = [
+            # Keyset pagination reads (borrow_date, id) ranges, newest first
+            models.Index(fields=['borrow_date', 'id'], name='borrow_date_id_idx'),
+            # Overdue sweeps and dashboard counts: status = / IN (...) AND due_date < now
+            models.Index(fields=['status', 'due_date'], name='loan_status_due_idx'),
+            # One student's loans in a given state (borrow limits, dashboard, stats)
+            models.Index(fields=['student', 'status'], name='loan_student_status_idx'),
+            # Unreturned loans only, so it stays small however long the history
+            # gets. Queries must say status__ne='returned' to use it: SQLite
+            # won't match a partial index against status IN (...)
+            models.Index(fields=['due_date'], name='active_loan_due_idx', condition=Q(status__ne='returned')),
+        ]
 
 
 class Fine(models.Model):
@@ -156,9 +352,71 @@ class Fine(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
     paid_date = models.DateTimeField(null=True, blank=True)
+    # Last (UTC) day the accrual job brought this fine up to date, blank once final
+    accrued_through = models.DateField(null=True, blank=True)
 
     def __str__(self):
         return f"Fine for {self.borrow_record.student.name} - RM{self.amount}"
 
     class Meta:
-        ordering = ['-borrow_record__borrow_date']
\ No newline at end of file
+        ordering = ['-borrow_record__borrow_date']
+        indexes = [
+            # Pending/paid lists and totals; borrow_record leads on to the student
+            models.Index(fields=['status', 'borrow_record'], name='fine_status_loan_idx'),
+        ]
+
+
+class IdentifierSequence(models.Model):
+    """Named counter handing out blocks of unique numbers (see library.catalog)"""
+    name = models.CharField(max_length=50, unique=True)
+    last_value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_value}"
+
+
+class JobWatermark(models.Model):
+    """How far a named background job has got (see update_overdue_books --daemon)"""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.value}"
+
+
+class StudentCirculationStats(models.Model):
+    """Denormalized loan counters per student, kept up to date by library.circulation"""
+    student = models.OneToOneField(
+        Student,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='circulation_stats',
+    )
+    active_loans = models.IntegerField(default=0)
+    overdue_loans = models.IntegerField(default=0)
+    pending_fine_total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    lifetime_borrows = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Circulation stats for {self.student_id}"
+
+
+class LoanNotification(models.Model):
+    """A reminder already emailed for a loan, so send_due_notifications sends each one once"""
+    KIND_CHOICES = [
+        ('due_soon', 'Due soon'),
+        ('overdue', 'Overdue'),
+    ]
+
+    borrow_record = models.ForeignKey(BorrowRecord, on_delete=models.CASCADE, related_name='notifications')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    sent_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} notice for loan {self.borrow_record_id}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['borrow_record', 'kind'], name='loan_notification_once'),
+        ]
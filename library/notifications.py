@@ -0,0 +1,103 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .loans import loan_views
+from .models import FINE_PER_DAY, BorrowRecord, LoanNotification
+
+# Same window as BorrowRecord.should_warn(): 0 to 3 whole days left
+DUE_SOON_DAYS = 3
+
+
+def due_soon_loans(now):
+    """Borrowed loans inside the warning window that haven't had a due-soon notice"""
+    return (
+        BorrowRecord.objects.filter(
+            # loan_status_due_idx
+            status='borrowed',
+            due_date__gte=now,
+            due_date__lt=now + timedelta(days=DUE_SOON_DAYS + 1),
+        )
+        .exclude(notifications__kind='due_soon')
+        .select_related('student', 'book')
+        .order_by('due_date', 'pk')
+    )
+
+
+def overdue_loans(now, within):
+    """Loans still out that fell due in the last ``within`` and haven't had an overdue notice.
+
+    Loans in ``pending_return`` are left out: the book is back, waiting to
+    be verified.
+
+    The window keeps the first run from mailing about every loan ever
+    overdue; run the command more often than ``within``.
+    """
+    return (
+        BorrowRecord.objects.filter(
+            # status <> 'returned' is what lets this match active_loan_due_idx
+            status__ne='returned',
+            due_date__lt=now,
+            due_date__gte=now - within,
+        )
+        .exclude(status='pending_return')
+        .exclude(notifications__kind='overdue')
+        .select_related('student', 'book')
+        .order_by('due_date', 'pk')
+    )
+
+
+def build_digests(now, overdue_within):
+    """``(message, [(loan id, kind), ...])`` for each student with something to hear about"""
+    digests = {}
+    for kind, records in (('due_soon', due_soon_loans(now)), ('overdue', overdue_loans(now, overdue_within))):
+        for loan in loan_views(records, now):
+            digest = digests.setdefault(loan.student_id, {
+                'student': loan.student, 'due_soon': [], 'overdue': [], 'fine_per_day': FINE_PER_DAY,
+            })
+            digest[kind].append(loan)
+
+    messages = []
+    for digest in digests.values():
+        message = EmailMessage(
+            subject='Library reminder: books due back',
+            body=render_to_string('library/email/due_digest.txt', digest),
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[digest['student'].email],
+        )
+        sent = [(loan.pk, kind) for kind in ('due_soon', 'overdue') for loan in digest[kind]]
+        messages.append((message, sent))
+    return messages
+
+
+def send_due_notifications(now=None, overdue_within=timedelta(days=7), batch_size=100, connection=None):
+    """Email each student one digest of their due-soon and newly overdue loans.
+
+    Every digest goes over one email connection, ``batch_size`` at a time.
+    A batch is recorded in LoanNotification once it has been sent, so a
+    rerun skips it; a batch that fails to send is retried next run.
+    Returns ``(digests, loans)`` sent.
+    """
+    if now is None:
+        now = timezone.now()
+    digests = build_digests(now, overdue_within)
+    if not digests:
+        return 0, 0
+
+    connection = connection or get_connection()
+    loans = 0
+    # One SMTP session for every batch
+    with connection:
+        for start in range(0, len(digests), batch_size):
+            batch = digests[start:start + batch_size]
+            connection.send_messages([message for message, sent in batch])
+            records = [
+                LoanNotification(borrow_record_id=loan_id, kind=kind, sent_at=now)
+                for message, sent in batch for loan_id, kind in sent
+            ]
+            LoanNotification.objects.bulk_create(records, ignore_conflicts=True)
+            loans += len(records)
+    return len(digests), loans
@@ -0,0 +1,151 @@
+import base64
+import json
+from datetime import date, datetime
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+class KeysetPage:
+    """One page of a keyset-paginated queryset plus the cursors around it"""
+
+    def __init__(self, items, next_cursor, previous_cursor, request, cursor_param):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self._request = request
+        self._cursor_param = cursor_param
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def _querystring(self, cursor):
+        params = self._request.GET.copy()
+        params[self._cursor_param] = cursor
+        return params.urlencode()
+
+    @property
+    def next_querystring(self):
+        return self._querystring(self.next_cursor) if self.has_next else ''
+
+    @property
+    def previous_querystring(self):
+        return self._querystring(self.previous_cursor) if self.has_previous else ''
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def encode_cursor(direction, value, pk):
+    payload = json.dumps([direction, _encode_value(value), pk], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def _key_field(queryset, key):
+    try:
+        return queryset.model._meta.get_field(key)
+    except FieldDoesNotExist:
+        annotation = queryset.query.annotations.get(key)
+        return annotation.output_field if annotation is not None else None
+
+
+def decode_cursor(cursor, queryset, key):
+    """Return ``(direction, value, pk)`` or ``None`` for a missing/garbled cursor"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, value, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if direction not in ('next', 'prev'):
+            return None
+        pk = int(pk)
+        # Past a 64-bit integer the database driver raises rather than matching nothing
+        if not -2 ** 63 <= pk < 2 ** 63:
+            return None
+        field = _key_field(queryset, key)
+        if field is not None:
+            value = field.to_python(value)
+        return direction, value, pk
+    except (ValueError, TypeError, ValidationError):
+        return None
+
+
+def _after(key, descending, value, pk):
+    """Rows strictly after (value, pk) in the given sort direction"""
+    op = 'lt' if descending else 'gt'
+    return Q(**{f'{key}__{op}': value}) | Q(**{key: value, f'pk__{op}': pk})
+
+
+def paginate_keyset(request, queryset, ordering, per_page=None, cursor_param='cursor'):
+    """Paginate ``queryset`` on a stable ``(ordering, pk)`` key.
+
+    ``ordering`` is a single field name, optionally prefixed with ``-``, that
+    matches the model's ``Meta.ordering`` (or an annotation such as
+    ``search_rank``). Each page is a ``WHERE key > cursor ORDER BY key LIMIT n``
+    range read, so deep pages cost the same as the first one.
+    """
+    if per_page is None:
+        per_page = getattr(settings, 'LIBRARY_PAGE_SIZE', 25)
+    descending = ordering.startswith('-')
+    key = ordering.lstrip('-')
+    pk_ordering = '-pk' if descending else 'pk'
+
+    cursor = decode_cursor(request.GET.get(cursor_param), queryset, key)
+    direction = cursor[0] if cursor else 'next'
+
+    if direction == 'next':
+        page_qs = queryset.order_by(ordering, pk_ordering)
+        if cursor:
+            page_qs = page_qs.filter(_after(key, descending, cursor[1], cursor[2]))
+    else:
+        # Walk backwards from the cursor, then flip the rows back into display order
+        reverse_ordering = key if descending else f'-{key}'
+        reverse_pk_ordering = 'pk' if descending else '-pk'
+        page_qs = queryset.order_by(reverse_ordering, reverse_pk_ordering).filter(
+            _after(key, not descending, cursor[1], cursor[2])
+        )
+
+    rows = list(page_qs[:per_page + 1])
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == 'prev':
+        rows.reverse()
+
+    def _cursor_for(row, row_direction):
+        return encode_cursor(row_direction, getattr(row, key), row.pk)
+
+    next_cursor = previous_cursor = None
+    if rows:
+        if direction == 'next':
+            if has_more:
+                next_cursor = _cursor_for(rows[-1], 'next')
+            if cursor:
+                previous_cursor = _cursor_for(rows[0], 'prev')
+        else:
+            next_cursor = _cursor_for(rows[-1], 'next')
+            if has_more:
+                previous_cursor = _cursor_for(rows[0], 'prev')
+
+    return KeysetPage(rows, next_cursor, previous_cursor, request, cursor_param)
@@ -0,0 +1,63 @@
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.shortcuts import redirect
+
+from .models import UserProfile
+
+ROLE_CACHE_PREFIX = 'library:role:'
+# Cached stand-in for "no profile", since the cache can't tell None from a miss
+NO_ROLE = ''
+
+
+def get_user_role(user):
+    """Return the user's profile role ('student'/'librarian') or None, cached per user"""
+    if not user.is_authenticated:
+        return None
+    key = ROLE_CACHE_PREFIX + str(user.pk)
+    role = cache.get(key)
+    if role is None:
+        role = (
+            UserProfile.objects.filter(user_id=user.pk).values_list('role', flat=True).first()
+            or NO_ROLE
+        )
+        # Profile signals clear the key, but only in this process's cache;
+        # the timeout bounds how long other workers can serve a changed role
+        cache.set(key, role, getattr(settings, 'LIBRARY_ROLE_CACHE_TIMEOUT', 300))
+    return role or None
+
+
+def invalidate_user_role(user_id):
+    cache.delete(ROLE_CACHE_PREFIX + str(user_id))
+
+
+def role_required(role, message='Access denied', redirect_to='home', level=messages.ERROR,
+                  denied_redirect_to=None, redirect_with_kwargs=False):
+    """Only let users whose profile has ``role`` into the view.
+
+    Users with a different role get ``message`` and are redirected to
+    ``redirect_to``; users without a profile get 'Access denied' and go to
+    ``denied_redirect_to`` (defaults to ``redirect_to``). With
+    ``redirect_with_kwargs`` the view's URL kwargs are passed on to the
+    redirect, e.g. back to the same book's detail page.
+    """
+    if denied_redirect_to is None:
+        denied_redirect_to = redirect_to
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            redirect_kwargs = kwargs if redirect_with_kwargs else {}
+            # request.user_role is lazy, so test truthiness rather than identity
+            user_role = request.user_role
+            if not user_role:
+                messages.error(request, 'Access denied')
+                return redirect(denied_redirect_to, **redirect_kwargs)
+            if user_role != role:
+                messages.add_message(request, level, message)
+                return redirect(redirect_to, **redirect_kwargs)
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,129 @@
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Book
+
+# FTS5 virtual table created by migration 0005 (SQLite only)
+BOOK_SEARCH_TABLE = 'library_book_fts'
+BOOK_SEARCH_COLUMNS = ['title', 'author', 'publisher', 'category', 'description', 'isbn']
+
+# bm25() column weights, in BOOK_SEARCH_COLUMNS order - a title hit outranks a description hit
+BOOK_SEARCH_WEIGHTS = [10.0, 5.0, 2.0, 2.0, 1.0, 5.0]
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def search_index_enabled():
+    """The full-text index only exists on the SQLite backend"""
+    return connection.vendor == 'sqlite'
+
+
+def build_match_expression(query):
+    """Turn free text into a safe FTS5 MATCH expression.
+
+    Every word becomes a quoted prefix term so partial words typed into the
+    search box still match, and FTS5 operators in user input are neutralised.
+    """
+    tokens = _TOKEN_RE.findall(query)
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_books(query, queryset=None):
+    """Return books matching ``query``, best match first.
+
+    The result is always annotated with ``search_rank`` so callers can order
+    and paginate on it; without the full-text index every match ranks 0.
+    """
+    if queryset is None:
+        queryset = Book.objects.all()
+    unranked = Value(0.0, output_field=FloatField())
+
+    if not search_index_enabled():
+        return queryset.filter(
+            Q(title__icontains=query) |
+            Q(author__icontains=query) |
+            Q(publisher__icontains=query) |
+            Q(category__icontains=query) |
+            Q(description__icontains=query) |
+            Q(isbn__icontains=query)
+        ).annotate(search_rank=unranked).order_by('search_rank', 'id')
+
+    match = build_match_expression(query)
+    if not match:
+        return queryset.none().annotate(search_rank=unranked)
+
+    weights = ', '.join(str(weight) for weight in BOOK_SEARCH_WEIGHTS)
+    book_table = Book._meta.db_table
+    matching_ids = RawSQL(
+        f'SELECT rowid FROM {BOOK_SEARCH_TABLE} WHERE {BOOK_SEARCH_TABLE} MATCH %s',
+        [match],
+    )
+    # bm25() is lower-is-better, so an ascending sort gives the best match first
+    rank = RawSQL(
+        f'SELECT bm25({BOOK_SEARCH_TABLE}, {weights}) FROM {BOOK_SEARCH_TABLE} '
+        f'WHERE {BOOK_SEARCH_TABLE} MATCH %s AND rowid = {book_table}.id',
+        [match],
+        output_field=FloatField(),
+    )
+    return queryset.filter(id__in=matching_ids).annotate(search_rank=rank).order_by('search_rank', 'id')
+
+
+def book_page_queryset(query):
+    """``(books, ordering)`` for a Books page: ranked matches for ``query``, or every book by title"""
+    if query:
+        return search_books(query), 'search_rank'
+    return Book.objects.all(), 'title'
+
+
+def index_book(book):
+    """Insert or refresh a single book in the search index"""
+    if not search_index_enabled():
+        return
+    values = [getattr(book, column) or '' for column in BOOK_SEARCH_COLUMNS]
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {BOOK_SEARCH_TABLE} WHERE rowid = %s', [book.pk])
+        cursor.execute(
+            f'INSERT INTO {BOOK_SEARCH_TABLE} (rowid, {", ".join(BOOK_SEARCH_COLUMNS)}) '
+            f'VALUES (%s, {", ".join(["%s"] * len(BOOK_SEARCH_COLUMNS))})',
+            [book.pk, *values],
+        )
+
+
+def index_books(books):
+    """Add freshly created books to the search index in one executemany"""
+    if not search_index_enabled() or not books:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {BOOK_SEARCH_TABLE} (rowid, {", ".join(BOOK_SEARCH_COLUMNS)}) '
+            f'VALUES (%s, {", ".join(["%s"] * len(BOOK_SEARCH_COLUMNS))})',
+            [[book.pk, *(getattr(book, column) or '' for column in BOOK_SEARCH_COLUMNS)] for book in books],
+        )
+
+
+def unindex_book(book_id):
+    """Remove a book from the search index"""
+    if not search_index_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {BOOK_SEARCH_TABLE} WHERE rowid = %s', [book_id])
+
+
+def rebuild_index():
+    """Repopulate the whole search index from the Book table, returns the row count"""
+    if not search_index_enabled():
+        return 0
+    columns = ', '.join(BOOK_SEARCH_COLUMNS)
+    source_columns = ', '.join(f"COALESCE({column}, '')" for column in BOOK_SEARCH_COLUMNS)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {BOOK_SEARCH_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {BOOK_SEARCH_TABLE} (rowid, {columns}) '
+            f'SELECT id, {source_columns} FROM {Book._meta.db_table}'
+        )
+        cursor.execute(f"INSERT INTO {BOOK_SEARCH_TABLE}({BOOK_SEARCH_TABLE}) VALUES ('optimize')")
+        cursor.execute(f'SELECT count(*) FROM {BOOK_SEARCH_TABLE}')
+        return cursor.fetchone()[0]
@@ -0,0 +1,195 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .catalog import allocate_book_isbns
+from .circulation import recompute_student_stats
+from .dashboard import CACHE_PREFIX, COUNTER_KEYS
+from .models import Book, BorrowRecord, Fine, Student, UserProfile, normalize_book_key
+from .search import rebuild_index
+
+CATEGORIES = ['Fiction', 'Science', 'History', 'Technology', 'Biography', 'Children', 'Poetry', 'Business']
+PUBLISHERS = ['Penguin', 'HarperCollins', 'Oxford', 'Pearson', "O'Reilly", 'Pelangi', 'Macmillan']
+WORDS = (
+    'river night garden shadow empire silent secret winter ocean machine city '
+    'light stone fire forest journey history science modern theory lost last'
+).split()
+NAMES = (
+    'Aisyah Ahmad Mei Ling Ravi Nurul Hafiz Siti Daniel Priya Wei Jun Farah Arjun '
+    'Sarah Kumar Lim Tan Wong Ismail Chen Lee Rahman Abdullah'
+).split()
+
+# The librarian account benchmark_views logs in as
+SEED_LIBRARIAN = 'seed_librarian'
+SEED_PASSWORD = 'library123'
+
+
+def _weights(count, skew):
+    """Zipf-like popularity: a few books/students account for most loans"""
+    return [1 / (rank ** skew) for rank in range(1, count + 1)]
+
+
+def _loan(rng, student_id, book_id, now, history_days):
+    """One loan with a plausible status for how long ago it started"""
+    borrow_date = now - timedelta(days=rng.uniform(0, history_days))
+    duration = 14 if rng.random() < 0.7 else 7
+    due_date = borrow_date + timedelta(days=duration)
+    record = BorrowRecord(
+        student_id=student_id,
+        book_id=book_id,
+        borrow_date=borrow_date,
+        due_date=due_date,
+        borrow_duration_days=duration,
+        status='borrowed',
+    )
+    if due_date > now:
+        # Still inside the loan period; a few are already handed back for checking
+        if rng.random() < 0.1:
+            record.status = 'pending_return'
+            record.return_requested_date = now - timedelta(hours=rng.uniform(0, 48))
+        return record
+
+    roll = rng.random()
+    if roll < 0.88 or due_date < now - timedelta(days=90):
+        # Most loans come back, a quarter of them a few days late
+        late_days = int(rng.expovariate(1 / 4)) + 1 if rng.random() < 0.25 else 0
+        returned = min(due_date + timedelta(days=late_days, hours=rng.uniform(-72, 0)), now)
+        record.status = 'returned'
+        record.return_requested_date = returned
+        record.return_date = returned
+    elif roll < 0.94:
+        record.status = 'pending_return'
+        record.return_requested_date = now - timedelta(hours=rng.uniform(0, 72))
+    else:
+        record.status = 'overdue'
+    return record
+
+
+def seed_library(books=1000, students=500, loans=10000, history_days=365, batch_size=2000, seed=None, progress=None):
+    """Bulk-insert a synthetic catalog, membership and loan history.
+
+    Rows are added to whatever is already there. Every student gets a login
+    (password ``SEED_PASSWORD``) and a ``seed_librarian`` account is created
+    if missing. Returned loans that came back late get a Fine (mostly paid);
+    fines on loans still out are left to ``accrue_fines``. Returns the number
+    of rows created per model.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    created = {'books': 0, 'students': 0, 'loans': 0, 'fines': 0}
+
+    def report(message):
+        if progress is not None:
+            progress(message)
+
+    password = make_password(SEED_PASSWORD)
+    if not User.objects.filter(username=SEED_LIBRARIAN).exists():
+        librarian = User.objects.create(username=SEED_LIBRARIAN, password=password, first_name='Seed')
+        UserProfile.objects.create(user=librarian, role='librarian')
+
+    book_ids = []
+    for start in range(0, books, batch_size):
+        count = min(batch_size, books - start)
+        batch = []
+        for isbn in allocate_book_isbns(count):
+            title = ' '.join(rng.sample(WORDS, rng.randint(2, 4))).title()
+            author = f'{rng.choice(NAMES)} {rng.choice(NAMES)}'
+            copies = rng.choice([1, 1, 2, 2, 3, 5])
+            batch.append(Book(
+                isbn=isbn,
+                title=title,
+                author=author,
+                publisher=rng.choice(PUBLISHERS),
+                category=rng.choice(CATEGORIES),
+                description=f'A {rng.choice(WORDS)} book about {rng.choice(WORDS)} and {rng.choice(WORDS)}.',
+                total_copies=copies,
+                available_copies=copies,
+                dedupe_key=normalize_book_key(title, author),
+            ))
+        with transaction.atomic():
+            book_ids.extend(book.pk for book in Book.objects.bulk_create(batch))
+        created['books'] += count
+        report(f'{created["books"]} books')
+
+    offset = User.objects.filter(username__startswith='seed_student_').count()
+    student_ids = []
+    for start in range(0, students, batch_size):
+        numbers = range(offset + start, offset + min(start + batch_size, students))
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(username=f'seed_student_{number:07d}', password=password, first_name=rng.choice(NAMES))
+                for number in numbers
+            ])
+            UserProfile.objects.bulk_create([UserProfile(user=user, role='student') for user in users])
+            batch = Student.objects.bulk_create([
+                Student(
+                    user=user,
+                    student_id=f'SEED{number:07d}',
+                    name=f'{user.first_name} {rng.choice(NAMES)}',
+                    email=f'seed{number:07d}@students.example.com',
+                    phone=f'01{rng.randint(10000000, 99999999)}',
+                )
+                for user, number in zip(users, numbers)
+            ])
+        student_ids.extend(student.pk for student in batch)
+        created['students'] += len(batch)
+        report(f'{created["students"]} students')
+
+    if loans and book_ids and student_ids:
+        book_weights = _weights(len(book_ids), 0.8)
+        student_weights = _weights(len(student_ids), 0.6)
+        rng.shuffle(student_ids)
+        for start in range(0, loans, batch_size):
+            count = min(batch_size, loans - start)
+            records = [
+                _loan(rng, student_id, book_id, now, history_days)
+                for student_id, book_id in zip(
+                    rng.choices(student_ids, student_weights, k=count),
+                    rng.choices(book_ids, book_weights, k=count),
+                )
+            ]
+            with transaction.atomic():
+                BorrowRecord.objects.bulk_create(records)
+                fines = []
+                for record in records:
+                    if record.status != 'returned':
+                        continue
+                    # Same rules as a real return, so a late return on the due day costs a day
+                    amount = Decimal(str(record.calculate_fine()))
+                    if not amount:
+                        continue
+                    paid = rng.random() < 0.7
+                    fines.append(Fine(
+                        borrow_record_id=record.pk,
+                        amount=amount,
+                        status='paid' if paid else 'pending',
+                        paid_date=min(record.return_date + timedelta(days=rng.uniform(0, 14)), now) if paid else None,
+                    ))
+                Fine.objects.bulk_create(fines)
+            created['loans'] += count
+            created['fines'] += len(fines)
+            report(f'{created["loans"]} loans')
+
+    # Keep copy counts consistent with the loans that are still out
+    active_loans = Subquery(
+        BorrowRecord.objects.filter(book=OuterRef('pk'), status__ne='returned')
+        .order_by().values('book').annotate(count=Count('id')).values('count')
+    )
+    with transaction.atomic():
+        Book.objects.update(total_copies=Greatest(F('total_copies'), Coalesce(active_loans, Value(0))))
+        Book.objects.touch(available_copies=F('total_copies') - Coalesce(active_loans, Value(0)))
+
+    # bulk_create skipped the signals that keep these in step
+    for start in range(0, len(student_ids), batch_size):
+        recompute_student_stats(student_ids[start:start + batch_size])
+    rebuild_index()
+    cache.delete_many([CACHE_PREFIX + name for name in COUNTER_KEYS])
+    return created
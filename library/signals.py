@@ -0,0 +1,71 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cards import drop_book_cards
+from .dashboard import adjust_dashboard_counter, invalidate_loan_counters
+from .metrics import install_query_recorder
+from .models import Book, BorrowRecord, Student, StudentCirculationStats, UserProfile
+from .roles import invalidate_user_role
+from .search import BOOK_SEARCH_COLUMNS, index_book, unindex_book
+
+
+@receiver(post_save, sender=Book)
+def update_book_search_index(sender, instance, update_fields=None, **kwargs):
+    # Availability-only saves (borrow/return) don't touch indexed text
+    if update_fields is not None and not set(update_fields) & set(BOOK_SEARCH_COLUMNS):
+        return
+    index_book(instance)
+
+
+@receiver(post_delete, sender=Book)
+def remove_book_from_search_index(sender, instance, **kwargs):
+    unindex_book(instance.pk)
+
+
+@receiver(post_delete, sender=Book)
+def drop_deleted_book_cards(sender, instance, **kwargs):
+    drop_book_cards(instance)
+
+
+@receiver(post_save, sender=Student)
+def create_circulation_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        StudentCirculationStats.objects.get_or_create(student=instance)
+
+
+@receiver(post_save, sender=Book)
+def count_new_book(sender, instance, created, **kwargs):
+    if created:
+        adjust_dashboard_counter('total_books', 1)
+
+
+@receiver(post_delete, sender=Book)
+def count_deleted_book(sender, instance, **kwargs):
+    adjust_dashboard_counter('total_books', -1)
+
+
+@receiver(post_save, sender=Student)
+def count_new_student(sender, instance, created, **kwargs):
+    if created:
+        adjust_dashboard_counter('total_students', 1)
+
+
+@receiver(post_delete, sender=Student)
+def count_deleted_student(sender, instance, **kwargs):
+    adjust_dashboard_counter('total_students', -1)
+
+
+@receiver(post_save, sender=BorrowRecord)
+@receiver(post_delete, sender=BorrowRecord)
+def drop_loan_counters(sender, instance, **kwargs):
+    invalidate_loan_counters()
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def drop_cached_role(sender, instance, **kwargs):
+    invalidate_user_role(instance.user_id)
+
+
+connection_created.connect(install_query_recorder, dispatch_uid='library_query_recorder')
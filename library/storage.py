@@ -0,0 +1,68 @@
+import hashlib
+import os
+import re
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from django.utils.functional import cached_property
+
+# <sha256>.<ext>, or a derivative of one such as <sha256>-medium.webp
+HASHED_NAME_RE = re.compile(r'^(?P<digest>[0-9a-f]{64}(?:-[a-z]+)?)\.[a-z0-9]+$')
+
+
+def content_digest(content):
+    sha256 = hashlib.sha256()
+    for chunk in content.chunks():
+        sha256.update(chunk)
+    content.seek(0)
+    return sha256.hexdigest()
+
+
+def hashed_name_etag(name):
+    """Strong ETag for a content-addressed name, or ``None`` for any other file"""
+    match = HASHED_NAME_RE.match(os.path.basename(name))
+    return f'"{match.group("digest")}"' if match else None
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """File storage that names uploads after the SHA-256 of their content.
+
+    ``book_covers/dune.jpg`` is stored as ``book_covers/ab/ab12...ef.jpg``;
+    uploading the same bytes again reuses the existing file instead of
+    writing a copy. A stored file therefore never changes, which is what
+    lets cover_file() mark it immutable.
+    """
+
+    @cached_property
+    def base_url(self):
+        return self._value_or_setting(self._base_url, getattr(settings, 'LIBRARY_COVER_URL', '/covers/'))
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        digest = content_digest(content)
+        extension = os.path.splitext(name)[1].lower()
+        hashed = os.path.join(os.path.dirname(name), digest[:2], digest + extension).replace('\\', '/')
+        if self.exists(hashed):
+            return hashed
+        # Two uploads of the same new file racing here both get written, the
+        # loser under a suffixed name; both names stay valid
+        return super().save(hashed, content, max_length)
+
+    def save_exact(self, name, content):
+        """Write ``content`` under exactly ``name``, replacing any old file.
+
+        For derived files such as thumbnails, whose names are worked out
+        from the original rather than from their own bytes.
+        """
+        if self.exists(name):
+            self.delete(name)
+        return super().save(name, content)
+
+
+cover_storage = ContentAddressedStorage()
@@ -0,0 +1,24 @@
+from django import template
+
+from ..covers import COVER_SIZES, thumbnail_url
+
+register = template.Library()
+
+
+@register.inclusion_tag('library/cover_image.html')
+def cover_image(book, size='medium'):
+    """Render a book's cover at one of COVER_SIZES.
+
+    Serves the WebP thumbnail to browsers that take it and the JPEG one to
+    the rest, falling back to the original upload until the thumbnails exist.
+    """
+    if size not in COVER_SIZES:
+        raise template.TemplateSyntaxError(f'Unknown cover size {size!r}')
+    context = {'alt': book.title, 'src': None, 'webp': None}
+    if book.cover_image:
+        urls = thumbnail_url(book.cover_image, size)
+        if urls is None:
+            context['src'] = book.cover_image.url
+        else:
+            context['src'], context['webp'] = urls
+    return context
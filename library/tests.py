@@ -1,3 +1,1412 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+import unittest.mock
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from types import ModuleType
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends import locmem
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+from PIL import Image
+
+from .benchmark import conn_max_age
+from .catalog import allocate_book_isbns, import_books
+from . import views
+from .circulation import (
+    OVERDUE_SWEEP, AlreadyBorrowed, BookUnavailable, accrue_fines, checkout_book, mark_overdue_loans, sweep_overdue_loans,
+)
+from .concurrency import gather_queries
+from .covers import thumbnail_name
+from .dashboard import compute_dashboard_stats, dashboard_cache_info, get_dashboard_stats
+from .loans import LoanView, loan_views
+from .metrics import RequestStats, finish_request, measuring, render_metrics, reset_metrics, sql_shape
+from .notifications import send_due_notifications
+from .roles import get_user_role
+from .search import BOOK_SEARCH_TABLE, build_match_expression, search_books
+from .seeding import seed_library
+from .models import Book, BorrowRecord, Fine, JobWatermark, LoanNotification, Student, StudentCirculationStats, UserProfile
+
+
+def make_student(index):
+    return Student.objects.create(
+        student_id=f'S{index:04d}',
+        name=f'Student {index:04d}',
+        email=f'student{index}@example.com',
+        phone='0123456789',
+    )
+
+
+def make_book(index, copies=3):
+    return Book.objects.create(
+        isbn=f'BK{index:06d}',
+        title=f'Book {index:04d}',
+        author='Author',
+        publisher='Publisher',
+        category='Fiction',
+        total_copies=copies,
+        available_copies=copies,
+    )
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'the FTS5 index is SQLite only')
+class BookSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        librarian = User.objects.create_user('librarian', password='secret')
+        UserProfile.objects.create(user=librarian, role='librarian')
+        self.client.force_login(librarian)
+
+    def indexed_ids(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT rowid FROM {BOOK_SEARCH_TABLE} ORDER BY rowid')
+            return [row[0] for row in cursor.fetchall()]
+
+    def titles(self, query):
+        return list(search_books(query).values_list('title', flat=True))
+
+    def test_index_follows_create_edit_and_delete(self):
+        book = make_book(1)
+        self.assertEqual(self.indexed_ids(), [book.pk])
+        self.assertEqual(self.titles('Book 0001'), ['Book 0001'])
+
+        book.title = 'Dragon Tales'
+        book.save()
+        self.assertEqual(self.titles('dragon'), ['Dragon Tales'])
+        self.assertEqual(self.titles('0001'), [])
+
+        book.delete()
+        self.assertEqual(self.indexed_ids(), [])
+        self.assertEqual(self.titles('dragon'), [])
+
+    def test_availability_only_saves_skip_reindexing(self):
+        book = make_book(1)
+        book.available_copies -= 1
+        with CaptureQueriesContext(connection) as context:
+            book.save(update_fields=['available_copies'])
+        self.assertFalse([query for query in context if BOOK_SEARCH_TABLE in query['sql']])
+
+        with CaptureQueriesContext(connection) as context:
+            book.save(update_fields=['title'])
+        self.assertTrue([query for query in context if BOOK_SEARCH_TABLE in query['sql']])
+
+    def test_operators_and_quotes_are_neutralised(self):
+        make_book(1)
+        self.assertEqual(build_match_expression('war AND peace'), '"war"* "AND"* "peace"*')
+        self.assertEqual(build_match_expression('"unbalanced'), '"unbalanced"*')
+        self.assertEqual(build_match_expression('title:x* -y'), '"title"* "x"* "y"*')
+        for query in ['"', 'AND', '*', '-', 'NOT', '(', 'OR book', 'NEAR(book 0001)', 'author:"']:
+            with self.subTest(query=query):
+                # Would raise an FTS5 syntax error if passed through as-is
+                list(search_books(query))
+        self.assertEqual(self.titles('"'), [])
+        self.assertEqual(self.titles('-Book'), ['Book 0001'])
+
+    def search_page(self, query):
+        response = self.client.get(reverse('book_list'), {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [book.title for book in response.context['books']]
+
+    def test_book_list_with_no_search_terms(self):
+        make_book(1)
+        self.assertEqual(self.search_page('!!!'), [])
+
+    def test_book_list_without_the_index_falls_back_to_icontains(self):
+        make_book(1)
+        make_book(2)
+        with unittest.mock.patch('library.search.search_index_enabled', return_value=False):
+            self.assertEqual(self.search_page('book 000'), ['Book 0001', 'Book 0002'])
+            self.assertEqual(self.search_page('!!!'), [])
+
+    def test_ranked_by_weighted_bm25(self):
+        in_description = make_book(1)
+        in_description.title = 'Gardening'
+        in_description.description = 'Has a chapter on dragons'
+        in_description.save()
+        in_title = make_book(2)
+        in_title.title = 'Dragons of Autumn'
+        in_title.save()
+        make_book(3)
+        self.assertEqual(self.titles('dragons'), ['Dragons of Autumn', 'Gardening'])
+        self.assertEqual(self.titles('drag'), ['Dragons of Autumn', 'Gardening'])
+
+    def test_rebuild_command_repopulates_index(self):
+        books = [make_book(index) for index in range(3)]
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {BOOK_SEARCH_TABLE}')
+        self.assertEqual(self.titles('Book'), [])
+
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Successfully indexed 3 book(s)', out.getvalue())
+        self.assertEqual(self.indexed_ids(), sorted(book.pk for book in books))
+        self.assertEqual(len(self.titles('Book')), 3)
+
+
+def raw_cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+@override_settings(LIBRARY_PAGE_SIZE=3)
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.librarian = User.objects.create_user('librarian', password='secret')
+        UserProfile.objects.create(user=self.librarian, role='librarian')
+        self.client.force_login(self.librarian)
+        now = timezone.now()
+        # Every ordering key has ties that straddle page boundaries
+        for index in range(8):
+            book = Book.objects.create(
+                isbn=f'BK{index:06d}', title=f'Title {index // 3}', author=f'Author {index}',
+                publisher='Publisher', category='Fiction', total_copies=3, available_copies=3,
+            )
+            student = Student.objects.create(
+                student_id=f'S{index:04d}', name=f'Name {index // 4}', email=f's{index}@example.com', phone='1',
+            )
+            BorrowRecord.objects.create(
+                student=student, book=book, borrow_date=now - timedelta(days=index // 3),
+                due_date=now + timedelta(days=7),
+            )
+
+    def page(self, url, context_name, cursor=None, params=None):
+        params = dict(params or {})
+        if cursor:
+            params['cursor'] = cursor
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.context[context_name]
+
+    def walk(self, url, context_name, params=None):
+        pages = [self.page(url, context_name, params=params)]
+        while pages[-1].next_cursor:
+            pages.append(self.page(url, context_name, pages[-1].next_cursor, params))
+        forward = [[row.pk for row in page] for page in pages]
+
+        backward = [forward[-1]]
+        page = pages[-1]
+        while page.previous_cursor:
+            page = self.page(url, context_name, page.previous_cursor, params)
+            backward.insert(0, [row.pk for row in page])
+        return forward, backward
+
+    def test_walks_forward_and_back_without_gaps_or_repeats(self):
+        cases = [
+            ('book_list', 'books', Book.objects.order_by('title', 'pk')),
+            ('student_list', 'students', Student.objects.order_by('name', 'pk')),
+            ('borrow_list', 'records', BorrowRecord.objects.order_by('-borrow_date', '-pk')),
+        ]
+        for url_name, context_name, expected in cases:
+            with self.subTest(url_name):
+                forward, backward = self.walk(reverse(url_name), context_name)
+                self.assertEqual([len(page) for page in forward], [3, 3, 2])
+                self.assertEqual(sum(forward, []), list(expected.values_list('pk', flat=True)))
+                self.assertEqual(backward, forward)
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'the FTS5 index is SQLite only')
+    def test_walks_ranked_search_results(self):
+        forward, backward = self.walk(reverse('book_list'), 'books', {'q': 'title'})
+        self.assertEqual([len(page) for page in forward], [3, 3, 2])
+        self.assertEqual(sorted(sum(forward, [])), sorted(Book.objects.values_list('pk', flat=True)))
+        self.assertEqual(backward, forward)
+
+    def test_walks_search_results_without_the_index(self):
+        with unittest.mock.patch('library.search.search_index_enabled', return_value=False):
+            forward, backward = self.walk(reverse('book_list'), 'books', {'q': 'title'})
+        self.assertEqual([len(page) for page in forward], [3, 3, 2])
+        self.assertEqual(sum(forward, []), list(Book.objects.order_by('pk').values_list('pk', flat=True)))
+        self.assertEqual(backward, forward)
+
+    def test_search_without_words_is_an_empty_page(self):
+        page = self.page(reverse('book_list'), 'books', params={'q': '!!!'})
+        self.assertEqual(list(page), [])
+        self.assertIsNone(page.next_cursor)
+        self.assertIsNone(page.previous_cursor)
+
+    def test_bad_cursors_fall_back_to_the_first_page(self):
+        first = [row.pk for row in self.page(reverse('borrow_list'), 'records')]
+        cursors = [
+            'garbage!',
+            'e30',  # {}
+            raw_cursor(['sideways', '2020-01-01T00:00:00', 1]),
+            raw_cursor(['next', 'not a date', 1]),
+            raw_cursor(['next', '2020-01-01T00:00:00', 'abc']),
+            raw_cursor(['prev', [1, 2], None]),
+            raw_cursor(['next', '2020-01-01T00:00:00', 10 ** 30]),
+            raw_cursor(5),
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                self.assertEqual([row.pk for row in self.page(reverse('borrow_list'), 'records', cursor)], first)
+
+    def test_deep_pages_cost_the_same_queries(self):
+        for index in range(8, 40):
+            Student.objects.create(student_id=f'S{index:04d}', name=f'Name {index // 4}', email=f's{index}@example.com', phone='1')
+        url = reverse('student_list')
+        self.page(url, 'students')  # caches the role
+        with CaptureQueriesContext(connection) as first:
+            page = self.page(url, 'students')
+        while page.next_cursor:
+            with CaptureQueriesContext(connection) as deep:
+                page = self.page(url, 'students', page.next_cursor)
+        self.assertEqual(len(deep), len(first))
+
+
+class StudentLoanStatsTests(TestCase):
+    def setUp(self):
+        self.librarian = User.objects.create_user('librarian', password='secret')
+        UserProfile.objects.create(user=self.librarian, role='librarian')
+        self.client.force_login(self.librarian)
+        self.book = make_book(1)
+
+    def add_students(self, count, start=0):
+        now = timezone.now()
+        for index in range(start, start + count):
+            student = make_student(index)
+            BorrowRecord.objects.create(student=student, book=self.book, due_date=now + timedelta(days=7))
+            BorrowRecord.objects.create(student=student, book=self.book, due_date=now - timedelta(days=2))
+            returned = BorrowRecord.objects.create(
+                student=student,
+                book=self.book,
+                due_date=now - timedelta(days=10),
+                return_date=now - timedelta(days=5),
+                status='returned',
+            )
+            Fine.objects.create(borrow_record=returned, amount=Decimal('5.00'))
+
+    def student_list_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('student_list'))
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_with_loan_stats(self):
+        self.add_students(1)
+        student = Student.objects.with_loan_stats().get()
+        self.assertEqual(student.borrowed_count, 2)
+        self.assertEqual(student.overdue_count, 1)
+        self.assertEqual(student.total_fines, Decimal('5.00'))
+
+    def test_with_loan_stats_without_loans(self):
+        make_student(99)
+        student = Student.objects.with_loan_stats().get()
+        self.assertEqual(student.borrowed_count, 0)
+        self.assertEqual(student.overdue_count, 0)
+        self.assertEqual(student.total_fines, Decimal('0.00'))
+
+    def test_student_list_query_count_is_constant(self):
+        self.add_students(2)
+        self.student_list_queries()  # warm the role cache
+        few = self.student_list_queries()
+        self.add_students(10, start=2)
+        many = self.student_list_queries()
+        self.assertEqual(few, many)
+
+
+class CirculationStatsTests(TestCase):
+    def setUp(self):
+        self.librarian = User.objects.create_user('librarian', password='secret')
+        UserProfile.objects.create(user=self.librarian, role='librarian')
+        user = User.objects.create_user('student', password='secret')
+        UserProfile.objects.create(user=user, role='student')
+        self.student = Student.objects.create(
+            user=user, student_id='S0001', name='Student', email='student@example.com', phone='1'
+        )
+        self.client.force_login(user)
+        self.book = make_book(1)
+
+    def assertStatsMatchSourceTables(self):
+        stats = StudentCirculationStats.objects.get(student=self.student)
+        expected = Student.objects.with_loan_stats().get(pk=self.student.pk)
+        self.assertEqual(stats.active_loans, expected.borrowed_count)
+        self.assertEqual(stats.overdue_loans, expected.overdue_count)
+        self.assertEqual(stats.pending_fine_total, expected.total_fines)
+        self.assertEqual(stats.lifetime_borrows, BorrowRecord.objects.filter(student=self.student).count())
+        return stats
+
+    def test_counters_follow_the_loan_lifecycle(self):
+        self.client.post(reverse('borrow_book', args=[self.book.id]), {'borrow_duration_days': 7})
+        record = BorrowRecord.objects.get()
+        self.assertEqual(self.assertStatsMatchSourceTables().active_loans, 1)
+
+        # Let the loan run late and sweep it
+        BorrowRecord.objects.filter(pk=record.pk).update(due_date=timezone.now() - timedelta(days=3))
+        mark_overdue_loans()
+        self.assertEqual(self.assertStatsMatchSourceTables().overdue_loans, 1)
+
+        self.client.get(reverse('request_return', args=[record.id]))
+        self.assertStatsMatchSourceTables()
+
+        self.client.force_login(self.librarian)
+        self.client.post(reverse('verify_return', args=[record.id]), {'condition': 'good'})
+        stats = self.assertStatsMatchSourceTables()
+        self.assertEqual(stats.active_loans, 0)
+        self.assertEqual(stats.pending_fine_total, Decimal('3.00'))
+
+        self.client.post(reverse('mark_fine_paid', args=[Fine.objects.get().id]))
+        self.assertEqual(self.assertStatsMatchSourceTables().pending_fine_total, Decimal('0.00'))
+
+    def test_reconcile_command_repairs_drift(self):
+        BorrowRecord.objects.create(student=self.student, book=self.book, due_date=timezone.now() + timedelta(days=7))
+        StudentCirculationStats.objects.filter(student=self.student).update(active_loans=42)
+        call_command('reconcile_circulation_stats', chunk_size=1, stdout=StringIO())
+        self.assertEqual(self.assertStatsMatchSourceTables().active_loans, 1)
+
+
+class OverdueSweepTests(TestCase):
+    def setUp(self):
+        self.student = make_student(1)
+        self.book = make_book(1)
+
+    def loan(self, due_date):
+        record = BorrowRecord.objects.create(student=self.student, book=self.book, due_date=timezone.now() + timedelta(days=1))
+        BorrowRecord.objects.filter(pk=record.pk).update(due_date=due_date)
+        return record
+
+    def test_each_sweep_picks_up_from_the_watermark(self):
+        now = timezone.now()
+        for days in range(1, 6):
+            self.loan(now - timedelta(days=days))
+        due_later = self.loan(now + timedelta(hours=1))
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(sweep_overdue_loans(now, batch_size=2), 5)
+        updates = [query for query in context if query['sql'].startswith('UPDATE "library_borrowrecord"')]
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(JobWatermark.objects.get(name=OVERDUE_SWEEP).value, now)
+        self.assertEqual(StudentCirculationStats.objects.get(student=self.student).overdue_loans, 5)
+
+        # Behind the watermark, so left alone; the one that has just fallen due is swept
+        missed = self.loan(now - timedelta(days=9))
+        self.assertEqual(sweep_overdue_loans(now + timedelta(hours=2)), 1)
+        due_later.refresh_from_db()
+        missed.refresh_from_db()
+        self.assertEqual((due_later.status, missed.status), ('overdue', 'borrowed'))
+
+    def test_daemon_tick_reports_count(self):
+        self.loan(timezone.now() - timedelta(days=1))
+        out = StringIO()
+        with unittest.mock.patch('time.sleep', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                call_command('update_overdue_books', daemon=True, stdout=out)
+        self.assertRegex(out.getvalue(), r'Swept overdue loans: 1 updated in [\d.]+ ms')
+
+    def test_rejects_bad_batch_size_and_interval(self):
+        record = self.loan(timezone.now() - timedelta(days=1))
+        for options, message in [({'batch_size': 0}, '--batch-size'), ({'interval': -1}, '--interval')]:
+            with self.subTest(**options):
+                with self.assertRaisesMessage(CommandError, message):
+                    call_command('update_overdue_books', daemon=True, stdout=StringIO(), **options)
+        record.refresh_from_db()
+        self.assertEqual(record.status, 'borrowed')
+
+
+class AccruedFineTests(TestCase):
+    def setUp(self):
+        self.student = make_student(1)
+        self.book = make_book(1)
+
+    def loan(self, due_date, status='borrowed', return_date=None):
+        record = BorrowRecord(student=self.student, book=self.book, due_date=due_date, status=status)
+        record.return_date = return_date
+        record.save()
+        return record
+
+    def test_matches_calculate_fine(self):
+        now = timezone.now()
+        records = [
+            self.loan(now + timedelta(days=3)),
+            self.loan(now - timedelta(minutes=1)),
+            self.loan(now - timedelta(days=1, hours=2)),
+            self.loan(now - timedelta(days=12), status='pending_return'),
+            self.loan(now - timedelta(days=5), status='returned', return_date=now - timedelta(days=5, minutes=-5)),
+            self.loan(now - timedelta(days=9), status='returned', return_date=now - timedelta(days=2)),
+            self.loan(now - timedelta(days=2), status='returned', return_date=now - timedelta(days=3)),
+        ]
+        annotated = {
+            record.pk: record
+            for record in BorrowRecord.objects.with_accrued_fine(now)
+        }
+        for record in records:
+            with self.subTest(due_date=record.due_date, status=record.status):
+                self.assertEqual(float(annotated[record.pk].accrued_fine), record.calculate_fine())
+
+
+class LoanViewTests(TestCase):
+    def setUp(self):
+        self.record = BorrowRecord.objects.create(
+            student=make_student(1), book=make_book(1), due_date=timezone.now() + timedelta(days=2, hours=1),
+        )
+
+    def test_fields_are_worked_out_against_one_now(self):
+        due_soon = LoanView(self.record, self.record.due_date - timedelta(days=2, hours=1))
+        self.assertEqual(due_soon.days_until_due, 2)
+        self.assertTrue(due_soon.should_warn)
+        self.assertFalse(due_soon.is_overdue)
+        self.assertEqual(due_soon.accrued_fine, 0.0)
+
+        late = LoanView(self.record, self.record.due_date + timedelta(days=3))
+        self.assertTrue(late.is_overdue)
+        self.assertFalse(late.should_warn)
+        self.assertEqual(late.days_overdue, 3)
+        self.assertEqual(late.accrued_fine, self.record.calculate_fine(self.record.due_date + timedelta(days=3)))
+
+    def test_other_attributes_come_from_the_loan(self):
+        view, = loan_views([self.record])
+        self.assertEqual(view.pk, self.record.pk)
+        self.assertEqual(view.book.title, 'Book 0001')
+        with self.assertRaises(AttributeError):
+            view.extra = 1  # __slots__, no per-instance dict
+
+
+class FineAccrualTests(TestCase):
+    def setUp(self):
+        self.student = make_student(1)
+        self.book = make_book(1)
+
+    def test_accrual_is_incremental(self):
+        now = timezone.now()
+        record = BorrowRecord.objects.create(student=self.student, book=self.book, due_date=now - timedelta(days=2))
+        BorrowRecord.objects.create(student=self.student, book=self.book, due_date=now + timedelta(days=2))
+
+        self.assertEqual(accrue_fines(now), (1, 0))
+        fine = Fine.objects.get()
+        self.assertEqual(fine.borrow_record, record)
+        self.assertEqual(fine.amount, Decimal('2.00'))
+
+        # Nothing changed since the last run
+        self.assertEqual(accrue_fines(now), (0, 0))
+
+        self.assertEqual(accrue_fines(now + timedelta(days=1)), (0, 1))
+        fine.refresh_from_db()
+        self.assertEqual(fine.amount, Decimal('3.00'))
+        stats = StudentCirculationStats.objects.get(student=self.student)
+        self.assertEqual(stats.pending_fine_total, Decimal('3.00'))
+
+    def test_paid_fines_are_left_alone(self):
+        now = timezone.now()
+        record = BorrowRecord.objects.create(student=self.student, book=self.book, due_date=now - timedelta(days=2))
+        Fine.objects.create(borrow_record=record, amount=Decimal('1.00'), status='paid', paid_date=now)
+        self.assertEqual(accrue_fines(now + timedelta(days=1)), (0, 0))
+
+    def test_command_rejects_bad_batch_size_and_interval(self):
+        BorrowRecord.objects.create(student=self.student, book=self.book, due_date=timezone.now() - timedelta(days=2))
+        for options, message in [({'batch_size': 0}, '--batch-size'), ({'interval': -1}, '--interval')]:
+            with self.subTest(**options):
+                with self.assertRaisesMessage(CommandError, message):
+                    call_command('accrue_fines', daemon=True, stdout=StringIO(), **options)
+        self.assertFalse(Fine.objects.exists())
+
+
+class DashboardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        librarian = User.objects.create_user('librarian', password='secret')
+        UserProfile.objects.create(user=librarian, role='librarian')
+        self.client.force_login(librarian)
+        self.book = make_book(1)
+
+    def test_counters_are_cached_and_adjusted(self):
+        self.assertEqual(get_dashboard_stats()['total_books'], 1)
+        with self.assertNumQueries(0):
+            get_dashboard_stats()
+        self.assertEqual(dashboard_cache_info(), {'hits': 1, 'misses': 1})
+
+        make_book(2)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_dashboard_stats()['total_books'], 2)
+
+    def test_loan_changes_drop_loan_counters(self):
+        self.assertEqual(get_dashboard_stats()['borrowed_books'], 0)
+        BorrowRecord.objects.create(
+            student=make_student(1), book=self.book, due_date=timezone.now() - timedelta(days=1)
+        )
+        stats = get_dashboard_stats()
+        self.assertEqual(stats['borrowed_books'], 1)
+        self.assertEqual(stats['overdue_books'], 1)
+        self.assertEqual(self.client.get(reverse('home')).status_code, 200)
+
+
+class BookCardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.librarian = User.objects.create_user('librarian', password='secret')
+        UserProfile.objects.create(user=self.librarian, role='librarian')
+        self.client.force_login(self.librarian)
+        self.book = make_book(1, copies=1)
+
+    def book_queries(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('book_list'))
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in captured if 'library_book' in query['sql']]
+
+    def test_cached_page_only_loads_ids_and_versions(self):
+        self.book_queries()
+        response, queries = self.book_queries()
+        self.assertContains(response, 'Book 0001')
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('description', queries[0])
+
+    def test_edits_and_loans_bump_the_version(self):
+        self.book_queries()
+        self.book.title = 'Renamed'
+        self.book.save()
+        self.assertEqual(self.book.version, 2)
+        self.assertContains(self.book_queries()[0], 'Renamed')
+
+        checkout_book(make_student(1), self.book.pk, 14)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.version, 3)
+        self.assertContains(self.book_queries()[0], 'Not Available')
+
+    def test_cards_vary_on_role(self):
+        edit_url = reverse('edit_book', args=[self.book.pk])
+        self.assertContains(self.client.get(reverse('book_list')), edit_url)
+        student = User.objects.create_user('student', password='secret')
+        UserProfile.objects.create(user=student, role='student')
+        self.client.force_login(student)
+        self.assertNotContains(self.client.get(reverse('book_list')), edit_url)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('student', password='secret')
+        UserProfile.objects.create(user=self.user, role='student')
+        self.student = make_student(1)
+        self.student.user = self.user
+        self.student.save()
+        self.client.force_login(self.user)
+        self.book = make_book(1)
+
+    def revalidate(self, url):
+        etag = self.client.get(url)['ETag']
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_catalog_is_not_modified(self):
+        response = self.client.get(reverse('book_list'))
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertTrue(response.has_header('Last-Modified'))
+        response = self.revalidate(reverse('book_list'))
+        self.assertEqual(response.status_code, 304)
+        self.assertTemplateNotUsed(response, 'library/book_list.html')
+
+        etag = response['ETag']
+        checkout_book(self.student, self.book.pk, 14)
+        self.assertEqual(self.client.get(reverse('book_list'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_detail_varies_on_overdue_status_and_user(self):
+        url = reverse('book_detail', args=[self.book.pk])
+        self.assertEqual(self.revalidate(url).status_code, 304)
+        etag = self.client.get(url)['ETag']
+
+        BorrowRecord.objects.create(
+            student=self.student, book=make_book(2), due_date=timezone.now() - timedelta(days=2), status='overdue'
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Borrowing Restricted')
+        etag = response['ETag']
+
+        librarian = User.objects.create_user('librarian', password='secret')
+        UserProfile.objects.create(user=librarian, role='librarian')
+        self.client.force_login(librarian)
+        self.assertContains(self.client.get(url, HTTP_IF_NONE_MATCH=etag), 'Edit Book')
+
+    def test_pending_messages_are_rendered(self):
+        etag = self.client.get(reverse('book_list'))['ETag']
+        self.client.get(reverse('student_list'))  # refused with an error message
+        self.assertEqual(self.client.get(reverse('book_list'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.librarian = User.objects.create_user('librarian', password='secret')
+        UserProfile.objects.create(user=self.librarian, role='librarian')
+        self.user = User.objects.create_user('student', password='secret')
+        UserProfile.objects.create(user=self.user, role='student')
+        self.student = make_student(1)
+        self.student.user = self.user
+        self.student.save()
+        self.books = [make_book(index) for index in range(3)]
+        now = timezone.now()
+        self.late = BorrowRecord.objects.create(
+            student=self.student, book=self.books[0], borrow_date=now - timedelta(days=20),
+            due_date=now - timedelta(days=6), status='overdue',
+        )
+        returned = BorrowRecord.objects.create(
+            student=self.student, book=self.books[1], borrow_date=now - timedelta(days=40),
+            due_date=now - timedelta(days=26), return_date=now - timedelta(days=24), status='returned',
+        )
+        Fine.objects.create(borrow_record=returned, amount=Decimal('2.00'))
+
+    def test_book_search_is_compact_and_paginated(self):
+        response = self.client.get(reverse('api_books'), {'limit': 2})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertNotIn(b', "', response.content)
+        data = response.json()
+        self.assertEqual([book['title'] for book in data['results']], ['Book 0000', 'Book 0001'])
+        data = self.client.get(reverse('api_books'), {'limit': 2, 'cursor': data['next']}).json()
+        self.assertEqual([book['title'] for book in data['results']], ['Book 0002'])
+        self.assertIsNone(data['next'])
+        self.assertEqual(self.client.get(reverse('api_books'), {'limit': 500}).status_code, 400)
+
+    def test_book_search_without_words_or_index(self):
+        data = self.client.get(reverse('api_books'), {'q': '!!!'}).json()
+        self.assertEqual(data, {'results': [], 'next': None, 'previous': None})
+        with unittest.mock.patch('library.search.search_index_enabled', return_value=False):
+            data = self.client.get(reverse('api_books'), {'q': 'book 000', 'limit': 2}).json()
+            data = self.client.get(reverse('api_books'), {'q': 'book 000', 'limit': 2, 'cursor': data['next']}).json()
+        self.assertEqual([book['title'] for book in data['results']], ['Book 0002'])
+
+    def test_availability_for_many_books_in_one_query(self):
+        ids = ','.join(str(book.pk) for book in self.books)
+        with self.assertNumQueries(1):
+            data = self.client.get(reverse('api_book_availability'), {'ids': ids}).json()
+        self.assertEqual([row['available_copies'] for row in data['results']], [3, 3, 3])
+        self.assertEqual(self.client.get(reverse('api_book_availability'), {'ids': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_book_availability'), {'ids': str(10 ** 30)}).status_code, 400)
+
+    def test_student_endpoints(self):
+        self.assertEqual(self.client.get(reverse('api_my_loans')).status_code, 401)
+        self.client.force_login(self.librarian)
+        self.assertEqual(self.client.get(reverse('api_my_loans')).status_code, 403)
+
+        self.client.force_login(self.user)
+        loans = self.client.get(reverse('api_my_loans')).json()['results']
+        self.assertEqual([(loan['id'], loan['accrued_fine']) for loan in loans], [(self.late.pk, '6.00')])
+        fines = self.client.get(reverse('api_my_fines'), {'status': 'pending'}).json()
+        self.assertEqual([fine['amount'] for fine in fines['results']], ['2.00'])
+        self.assertEqual(fines['results'][0]['book']['title'], 'Book 0001')
+
+    def test_loan_list_is_librarian_only_without_n_plus_one(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('api_loans')).status_code, 403)
+
+        self.client.force_login(self.librarian)
+        self.client.get(reverse('api_loans'))
+        with CaptureQueriesContext(connection) as few:
+            data = self.client.get(reverse('api_loans')).json()
+        self.assertEqual(len(data['results']), 2)
+        for index in range(5):
+            BorrowRecord.objects.create(student=make_student(index + 2), book=self.books[2], due_date=timezone.now())
+        with CaptureQueriesContext(connection) as many:
+            data = self.client.get(reverse('api_loans'), {'status': 'currently_borrowed'}).json()
+        self.assertEqual(len(data['results']), 6)
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(self.client.get(reverse('api_loans'), {'status': 'lost'}).status_code, 400)
+        for student in ['x', str(10 ** 30), str(-2 ** 63 - 1)]:
+            with self.subTest(student=student):
+                self.assertEqual(self.client.get(reverse('api_loans'), {'student': student}).status_code, 400)
+        data = self.client.get(reverse('api_loans'), {'student': self.student.pk}).json()
+        self.assertEqual(len(data['results']), 2)
+
+
+class DueNotificationTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.first, self.second, quiet = make_student(1), make_student(2), make_student(3)
+        book = make_book(1)
+        BorrowRecord.objects.create(student=self.first, book=book, due_date=now + timedelta(days=2))
+        BorrowRecord.objects.create(student=self.first, book=make_book(2), due_date=now - timedelta(days=2))
+        BorrowRecord.objects.create(student=self.second, book=book, due_date=now + timedelta(hours=5))
+        # Not due for a while, long overdue, or already back
+        BorrowRecord.objects.create(student=quiet, book=book, due_date=now + timedelta(days=10))
+        BorrowRecord.objects.create(student=quiet, book=book, due_date=now - timedelta(days=30))
+        BorrowRecord.objects.create(
+            student=quiet, book=book, due_date=now - timedelta(days=1), return_date=now, status='returned',
+        )
+        # Handed in late, waiting for a librarian to verify it
+        self.handed_in = BorrowRecord.objects.create(
+            student=quiet, book=book, due_date=now - timedelta(days=1), status='pending_return',
+        )
+
+    def test_one_digest_per_student_and_reruns_send_nothing(self):
+        out = StringIO()
+        with CaptureQueriesContext(connection) as context:
+            call_command('send_due_notifications', batch_size=1, stdout=out)
+        self.assertIn('2 digest(s) covering 3 loan(s)', out.getvalue())
+        loan_selects = [query for query in context if query['sql'].startswith('SELECT') and 'library_borrowrecord' in query['sql']]
+        self.assertEqual(len(loan_selects), 2)
+
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [self.first.email, self.second.email])
+        body = next(message.body for message in mail.outbox if message.to == [self.first.email])
+        self.assertIn('"Book 0001", due', body)
+        self.assertIn('"Book 0002", due', body)
+        self.assertIn('2 days overdue', body)
+        self.assertEqual(LoanNotification.objects.count(), 3)
+        self.assertFalse(LoanNotification.objects.filter(borrow_record=self.handed_in).exists())
+
+        call_command('send_due_notifications', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_rejects_empty_batches(self):
+        for batch_size in (0, -5):
+            with self.assertRaisesMessage(CommandError, '--batch-size'):
+                call_command('send_due_notifications', batch_size=batch_size, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_unsent_batch_is_not_recorded(self):
+        class BrokenBackend(locmem.EmailBackend):
+            def send_messages(self, messages):
+                raise ConnectionError('mail server went away')
+
+        with self.assertRaises(ConnectionError):
+            send_due_notifications(connection=BrokenBackend())
+        self.assertFalse(LoanNotification.objects.exists())
+        self.assertEqual(send_due_notifications(), (2, 3))
+
+
+class RoleTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('student', password='secret')
+        self.profile = UserProfile.objects.create(user=self.user, role='student')
+        self.client.force_login(self.user)
+
+    def test_role_required_redirects_other_roles(self):
+        response = self.client.get(reverse('student_list'))
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+
+    def test_role_is_cached_until_profile_changes(self):
+        self.assertEqual(get_user_role(self.user), 'student')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_role(self.user), 'student')
+
+        self.profile.role = 'librarian'
+        self.profile.save()
+        self.assertEqual(get_user_role(self.user), 'librarian')
+        self.assertEqual(self.client.get(reverse('student_list')).status_code, 200)
+
+    @override_settings(LIBRARY_ROLE_CACHE_TIMEOUT=0)
+    def test_cached_role_expires(self):
+        # A bulk update sends no signal; only the timeout picks it up
+        get_user_role(self.user)
+        UserProfile.objects.filter(pk=self.profile.pk).update(role='librarian')
+        self.assertEqual(get_user_role(self.user), 'librarian')
+
+
+class CheckoutConcurrencyTests(TransactionTestCase):
+    copies = 5
+    borrowers = 24
+
+    def test_concurrent_checkouts_never_oversell(self):
+        book = make_book(1, copies=self.copies)
+        students = [make_student(index) for index in range(self.borrowers)]
+        barrier = threading.Barrier(self.borrowers)
+        outcomes = []
+        lock = threading.Lock()
+
+        def borrow(student):
+            try:
+                barrier.wait()
+                try:
+                    checkout_book(student, book.pk, 14, attempts=20, backoff=0.01)
+                    outcome = 'borrowed'
+                except BookUnavailable:
+                    outcome = 'unavailable'
+                with lock:
+                    outcomes.append(outcome)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=borrow, args=(student,)) for student in students]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        book.refresh_from_db()
+        self.assertEqual(len(outcomes), self.borrowers)
+        self.assertEqual(outcomes.count('borrowed'), self.copies)
+        self.assertEqual(book.available_copies, 0)
+        self.assertEqual(BorrowRecord.objects.filter(book=book).count(), self.copies)
+
+    def test_concurrent_checkouts_by_one_student_lend_one_copy(self):
+        book = make_book(1, copies=self.copies)
+        student = make_student(1)
+        submits = 8
+        barrier = threading.Barrier(submits)
+        outcomes = []
+        lock = threading.Lock()
+
+        def borrow():
+            try:
+                barrier.wait()
+                try:
+                    checkout_book(student, book.pk, 14, attempts=20, backoff=0.01)
+                    outcome = 'borrowed'
+                except AlreadyBorrowed:
+                    outcome = 'already borrowed'
+                with lock:
+                    outcomes.append(outcome)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=borrow) for _ in range(submits)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        book.refresh_from_db()
+        self.assertEqual(sorted(outcomes), ['already borrowed'] * (submits - 1) + ['borrowed'])
+        self.assertEqual(book.available_copies, self.copies - 1)
+        self.assertEqual(BorrowRecord.objects.filter(book=book, student=student).count(), 1)
+        self.assertEqual(StudentCirculationStats.objects.get(student=student).active_loans, 1)
+
+
+class BulkVerifyReturnTests(TestCase):
+    def setUp(self):
+        librarian = User.objects.create_user('librarian', password='secret')
+        UserProfile.objects.create(user=librarian, role='librarian')
+        self.client.force_login(librarian)
+        self.book = make_book(1, copies=3)
+        self.book.available_copies = 0
+        self.book.save()
+
+    def test_bulk_verify_reports_each_record(self):
+        now = timezone.now()
+        on_time = BorrowRecord.objects.create(
+            student=make_student(1), book=self.book, due_date=now + timedelta(days=3), status='pending_return'
+        )
+        late = BorrowRecord.objects.create(
+            student=make_student(2), book=self.book, due_date=now - timedelta(days=4), status='pending_return'
+        )
+        still_out = BorrowRecord.objects.create(
+            student=make_student(3), book=self.book, due_date=now + timedelta(days=3)
+        )
+
+        response = self.client.post(reverse('bulk_verify_return'), {
+            'record_ids': [on_time.pk, late.pk, still_out.pk, 999],
+            f'condition_{late.pk}': 'damaged',
+        })
+        self.assertEqual(response.status_code, 200)
+        outcomes = {outcome['record_id']: outcome for outcome in response.context['outcomes']}
+        self.assertTrue(outcomes[on_time.pk]['verified'])
+        self.assertTrue(outcomes[late.pk]['verified'])
+        self.assertFalse(outcomes[still_out.pk]['verified'])
+        self.assertFalse(outcomes[999]['verified'])
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 2)
+        late.refresh_from_db()
+        self.assertEqual(late.status, 'returned')
+        self.assertIn('Condition: damaged', late.notes)
+        self.assertEqual(late.fine.amount, Decimal('4.00'))
+        self.assertEqual(StudentCirculationStats.objects.get(student=late.student).pending_fine_total, Decimal('4.00'))
+
+    def test_unusable_ids_are_dropped(self):
+        record = BorrowRecord.objects.create(
+            student=make_student(1), book=self.book, due_date=timezone.now() + timedelta(days=3), status='pending_return'
+        )
+        response = self.client.post(reverse('bulk_verify_return'), {'record_ids': [record.pk, 'x', 10 ** 30, -2 ** 63 - 1]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([outcome['record_id'] for outcome in response.context['outcomes']], [record.pk])
+        self.assertTrue(response.context['outcomes'][0]['verified'])
+
+        response = self.client.post(reverse('bulk_verify_return'), {'record_ids': [10 ** 30]})
+        self.assertRedirects(response, f"{reverse('borrow_list')}?status=pending_return", fetch_redirect_response=False)
+
+
+class ImportBooksTests(TestCase):
+    def test_duplicates_are_skipped(self):
+        make_book(1)
+        rows = [
+            {'isbn': '978-0-00-000001-1', 'title': 'Dune', 'author': 'Frank Herbert', 'total_copies': '2'},
+            {'isbn': '9780000000011', 'title': 'Dune (reprint)', 'author': 'Frank Herbert'},
+            {'title': '  dune ', 'author': 'FRANK HERBERT'},
+            {'title': 'Book 0001', 'author': 'author'},
+            {'title': 'Emma', 'author': 'Jane Austen'},
+            {'title': '', 'author': 'Nobody'},
+            None,
+        ]
+        result = import_books(rows, batch_size=2)
+        self.assertEqual((result.rows, result.created, result.duplicates, result.invalid), (7, 2, 3, 2))
+        dune = Book.objects.get(isbn='9780000000011')
+        self.assertEqual((dune.total_copies, dune.available_copies), (2, 2))
+        emma = Book.objects.get(title='Emma')
+        self.assertTrue(emma.isbn.startswith('BK'))
+        self.assertEqual(len(emma.isbn), 13)
+
+    def test_generated_isbns_are_unique(self):
+        first = allocate_book_isbns(3)
+        second = allocate_book_isbns(2)
+        self.assertEqual(len(set(first + second)), 5)
+
+    def test_command_reads_jsonl(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as handle:
+            handle.write('{"title": "Emma", "author": "Jane Austen"}\n')
+            handle.write('not json\n')
+            handle.write('{"title": "Persuasion", "author": "Jane Austen"}\n')
+        self.addCleanup(os.remove, handle.name)
+        out = StringIO()
+        call_command('import_books', handle.name, stdout=out, stderr=StringIO())
+        self.assertIn('Successfully imported 2 books from 3 rows', out.getvalue())
+        self.assertEqual(Book.objects.filter(author='Jane Austen').count(), 2)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        librarian = User.objects.create_user('librarian', password='secret')
+        UserProfile.objects.create(user=librarian, role='librarian')
+        self.client.force_login(librarian)
+        now = timezone.now()
+        book = make_book(1)
+        self.old = BorrowRecord.objects.create(
+            student=make_student(1), book=book, borrow_date=now - timedelta(days=40),
+            due_date=now - timedelta(days=26), status='returned', return_date=now - timedelta(days=30),
+        )
+        self.recent = BorrowRecord.objects.create(
+            student=make_student(2), book=book, borrow_date=now, due_date=now + timedelta(days=14)
+        )
+
+    def test_csv_export_streams_filtered_rows(self):
+        response = self.client.get(reverse('export_records', args=['loans']), {
+            'start': (timezone.localdate() - timedelta(days=1)).isoformat(),
+            'status': 'currently_borrowed',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'student_id', 'student_name'])
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], [str(self.recent.pk)])
+
+    def test_bad_filters_redirect_back(self):
+        response = self.client.get(reverse('export_records', args=['fines']), {'status': 'lost'})
+        self.assertRedirects(response, reverse('fine_list'))
+
+    def test_command_writes_jsonl(self):
+        out = StringIO()
+        call_command('export_records', 'loans', '--format', 'jsonl', '--status', 'returned', stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([(row['id'], row['status']) for row in rows], [(self.old.pk, 'returned')])
+
+
+def make_image(size=(1200, 1800), fmt='PNG'):
+    buffer = BytesIO()
+    Image.new('RGB', size, (200, 40, 40)).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+class CoverThumbnailTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root, LIBRARY_THUMBNAIL_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        librarian = User.objects.create_user('librarian', password='secret')
+        UserProfile.objects.create(user=librarian, role='librarian')
+        self.client.force_login(librarian)
+
+    def test_add_book_builds_thumbnails(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('add_book'), {
+                'title': 'Dune', 'author': 'Frank Herbert', 'publisher': 'Ace', 'category': 'Fiction',
+                'cover_image': SimpleUploadedFile('dune.png', make_image(), content_type='image/png'),
+            })
+        cover = Book.objects.get(title='Dune').cover_image
+        with cover.storage.open(thumbnail_name(cover.name, 'medium', 'jpg')) as thumb:
+            self.assertEqual(Image.open(thumb).size, (400, 600))
+        self.assertTrue(cover.storage.exists(thumbnail_name(cover.name, 'medium', 'webp')))
+
+        response = self.client.get(reverse('book_list'))
+        self.assertContains(response, cover.storage.url(thumbnail_name(cover.name, 'medium', 'webp')))
+        self.assertNotContains(response, f'src="{cover.url}"')
+
+    def test_original_is_served_until_backfilled(self):
+        book = make_book(1)
+        book.cover_image.save('plain.jpg', ContentFile(make_image((300, 300), 'JPEG')))
+        self.assertContains(self.client.get(reverse('book_list')), f'src="{book.cover_image.url}"')
+
+        out = StringIO()
+        call_command('build_cover_thumbnails', stdout=out)
+        self.assertIn('Successfully built thumbnails for 1 covers', out.getvalue())
+        # Small covers are never enlarged
+        with book.cover_image.storage.open(thumbnail_name(book.cover_image.name, 'large', 'jpg')) as thumb:
+            self.assertEqual(Image.open(thumb).size, (300, 300))
+        medium = book.cover_image.storage.url(thumbnail_name(book.cover_image.name, 'medium', 'jpg'))
+        self.assertContains(self.client.get(reverse('book_list')), f'src="{medium}"')
+
+
+class CoverStorageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.book = make_book(1)
+        self.book.cover_image.save('Dune Cover.PNG', ContentFile(make_image((30, 40))))
+
+    def test_identical_uploads_share_a_file(self):
+        other = make_book(2)
+        other.cover_image.save('copy.png', ContentFile(make_image((30, 40))))
+        self.assertEqual(other.cover_image.name, self.book.cover_image.name)
+        self.assertRegex(self.book.cover_image.name, r'^book_covers/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.assertTrue(self.book.cover_image.url.startswith('/covers/book_covers/'))
+
+    def test_cover_view_caching_headers(self):
+        url = self.book.cover_image.url
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('immutable', response['Cache-Control'])
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        body = b''.join(response.streaming_content)
+        partial = self.client.get(url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial.content, body[:10])
+        self.assertEqual(partial['Content-Range'], f'bytes 0-9/{len(body)}')
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=-5').content, body[-5:])
+        self.assertEqual(self.client.get(url, HTTP_RANGE=f'bytes={len(body)}-').status_code, 416)
+
+    def test_cover_view_rejects_other_paths(self):
+        self.assertEqual(self.client.get('/covers/book_covers/../secret.txt').status_code, 404)
+        self.assertEqual(self.client.get('/covers/book_covers/missing.png').status_code, 404)
+
+    @override_settings(LIBRARY_COVER_SENDFILE='x-accel-redirect')
+    def test_front_end_hand_off(self):
+        response = self.client.get(self.book.cover_image.url)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.book.cover_image.name}')
+        self.assertEqual(response.content, b'')
+
+
+# "SCAN library_fine" reads the whole table. "SCAN library_fine USING INDEX x"
+# walks an index in order, which only stays cheap when a LIMIT stops it early
+# (keyset pagination) or the index is partial; covering index scans only
+# serve COUNT(*) and are fine
+TABLE_SCAN_RE = re.compile(r'SCAN \S+')
+INDEX_WALK_RE = re.compile(r'SCAN \S+ USING INDEX (\S+)')
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        reset_metrics()
+        self.staff = User.objects.create_user('ops', password='secret', is_staff=True)
+        UserProfile.objects.create(user=self.staff, role='librarian')
+
+    def metric(self, body, name, **labels):
+        prefix = name + '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '} '
+        lines = [line for line in body.splitlines() if line.startswith(prefix)]
+        self.assertEqual(len(lines), 1, prefix)
+        return float(lines[0][len(prefix):])
+
+    def test_metrics_are_staff_only(self):
+        librarian = User.objects.create_user('librarian', password='secret')
+        UserProfile.objects.create(user=librarian, role='librarian')
+        self.client.force_login(librarian)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+    def test_records_queries_and_template_time_per_view(self):
+        make_book(1)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(reverse('book_list')).status_code, 200)
+        self.client.get(reverse('book_list'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertEqual(self.metric(body, 'library_requests_total', view='book_list', status=200), 2)
+        self.assertEqual(self.metric(body, 'library_request_duration_seconds_count', view='book_list'), 2)
+        self.assertGreater(self.metric(body, 'library_db_queries_total', view='book_list'), 0)
+        self.assertGreater(self.metric(body, 'library_db_query_seconds_total', view='book_list'), 0)
+        self.assertGreater(self.metric(body, 'library_template_render_seconds_total', view='book_list'), 0)
+        self.assertIn('library_dashboard_cache_hits_total ', body)
+
+    def test_streamed_export_is_measured_to_the_last_chunk(self):
+        make_book(1)
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('export_records', args=['loans']))
+        self.assertNotIn('export_records', render_metrics())
+        b''.join(response.streaming_content)
+        response.close()
+        body = render_metrics()
+        self.assertEqual(self.metric(body, 'library_requests_total', view='export_records', status=200), 1)
+        self.assertGreater(self.metric(body, 'library_db_queries_total', view='export_records'), 2)
+
+    @override_settings(LIBRARY_N_PLUS_ONE_THRESHOLD=2)
+    def test_repeated_query_shapes_count_as_n_plus_one(self):
+        books = [make_book(index) for index in range(3)]
+        self.assertEqual(
+            sql_shape('SELECT 1 FROM t WHERE id IN (%s, %s)'), sql_shape('SELECT 1 FROM t WHERE id IN (%s)')
+        )
+        stats = RequestStats()
+        with measuring(stats):
+            for book in books:
+                list(Book.objects.filter(pk=book.pk))
+            list(Book.objects.filter(pk__in=[book.pk for book in books]))
+        with self.assertLogs('library.metrics', 'WARNING'):
+            finish_request(stats, 'book_detail', 200)
+        self.assertEqual(stats.queries, 4)
+        self.assertEqual(self.metric(render_metrics(), 'library_n_plus_one_total', view='book_detail'), 1)
+
+
+class SeedAndBenchmarkTests(TestCase):
+    def test_seeded_data_is_consistent(self):
+        created = seed_library(books=30, students=10, loans=200, batch_size=50, seed=1)
+        self.assertEqual((created['books'], created['students'], created['loans']), (30, 10, 200))
+        self.assertFalse(Book.objects.filter(available_copies__lt=0).exists())
+        for book in Book.objects.all():
+            out = book.borrowrecord_set.exclude(status='returned').count()
+            self.assertEqual(book.available_copies, book.total_copies - out)
+        for stats in StudentCirculationStats.objects.all():
+            self.assertEqual(
+                stats.active_loans,
+                BorrowRecord.objects.filter(student=stats.student).exclude(status='returned').count(),
+            )
+        # Returned loans are fined exactly as a real late return would be
+        for record in BorrowRecord.objects.filter(status='returned').select_related('fine'):
+            fine = getattr(record, 'fine', None)
+            self.assertEqual(fine.amount if fine else Decimal('0'), Decimal(str(record.calculate_fine())))
+
+    def test_benchmark_covers_both_roles(self):
+        seed_library(books=10, students=3, loans=30, seed=2)
+        out = StringIO()
+        call_command('benchmark_views', iterations=1, warmup=0, stdout=out, stderr=StringIO())
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['meta']['rows']['loans'], 30)
+        timed = {(result['url_name'], result['role']): result for result in report['results'] if 'skipped' not in result}
+        self.assertEqual(timed[('book_list', 'librarian')]['status'], 200)
+        self.assertEqual(timed[('book_list', 'student')]['status'], 200)
+        self.assertEqual(timed[('student_list', 'student')]['status'], 302)
+        self.assertIn('p95_ms', timed[('home', 'librarian')])
+
+
+
+class StudentDashboardQueryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('student', password='secret')
+        UserProfile.objects.create(user=self.user, role='student')
+        self.student = make_student(1)
+        self.student.user = self.user
+        self.student.save()
+        self.client.force_login(self.user)
+
+    def add_loans(self, count, start=0):
+        now = timezone.now()
+        for index in range(start, start + count):
+            book = make_book(index)
+            BorrowRecord.objects.create(student=self.student, book=book, due_date=now + timedelta(days=2))
+            late = BorrowRecord.objects.create(student=self.student, book=book, due_date=now - timedelta(days=4))
+            returned = BorrowRecord.objects.create(
+                student=self.student, book=book, due_date=now - timedelta(days=10),
+                return_date=now - timedelta(days=8), status='returned',
+            )
+            Fine.objects.create(borrow_record=returned, amount=Decimal('2.00'))
+            Fine.objects.create(borrow_record=late, amount=Decimal('4.00'))
+
+    def dashboard_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('student_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return response, len(context)
+
+    def test_query_count_does_not_grow_with_loans(self):
+        self.add_loans(1)
+        self.dashboard_queries()  # builds the stats row
+        _, baseline = self.dashboard_queries()
+        self.add_loans(6, start=1)
+        response, queries = self.dashboard_queries()
+        self.assertEqual(queries, baseline)
+        self.assertEqual(len(response.context['borrowed_books']), 14)
+        self.assertIsInstance(response.context['borrowed_books'][0], LoanView)
+        self.assertEqual(len(response.context['borrow_history']), 5)
+        self.assertEqual(len(response.context['fines']), 14)
+
+
+# The async dashboards next to the usual routes, which they redirect to
+async_dashboard_urls = ModuleType('library_async_dashboard_urls')
+async_dashboard_urls.urlpatterns = [
+    path('async/home/', views.home_async),
+    path('async/dashboard/', views.student_dashboard_async),
+    path('', include('library.urls')),
+]
+
+
+@override_settings(ROOT_URLCONF=async_dashboard_urls)
+class AsyncDashboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.librarian = User.objects.create_user('librarian', password='secret')
+        UserProfile.objects.create(user=self.librarian, role='librarian')
+        self.user = User.objects.create_user('student', password='secret')
+        UserProfile.objects.create(user=self.user, role='student')
+        self.student = make_student(1)
+        self.student.user = self.user
+        self.student.save()
+        book = make_book(1)
+        BorrowRecord.objects.create(
+            student=self.student, book=book, due_date=timezone.now() - timedelta(days=3), status='borrowed',
+        )
+
+    async def test_home_matches_sync_view(self):
+        await sync_to_async(self.async_client.force_login)(self.librarian)
+        response = await self.async_client.get('/async/home/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['overdue_books'], 1)
+        self.assertEqual(len(response.context['recent_borrows']), 1)
+
+    async def test_access_rules_match_sync_views(self):
+        response = await self.async_client.get('/async/home/')
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith(settings.LOGIN_URL))
+
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get('/async/home/')
+        self.assertRedirects(response, reverse('student_dashboard'), fetch_redirect_response=False)
+
+        await sync_to_async(self.async_client.force_login)(self.librarian)
+        response = await self.async_client.get('/async/dashboard/')
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+
+    async def test_student_dashboard_matches_sync_view(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        await sync_to_async(self.client.force_login)(self.user)
+        response = await self.async_client.get('/async/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['student'], self.student)
+        self.assertEqual(len(response.context['borrowed_books']), 1)
+        sync_response = await sync_to_async(self.client.get)(reverse('student_dashboard'))
+        self.assertEqual(response.context['total_fines'], sync_response.context['total_fines'])
+
+
+class GatherQueriesTests(TransactionTestCase):
+    def test_results_in_order_from_separate_connections(self):
+        make_book(1)
+        make_book(2)
+        threads = []
+
+        def count_books():
+            threads.append(threading.get_ident())
+            return Book.objects.count()
+
+        def titles():
+            threads.append(threading.get_ident())
+            return list(Book.objects.order_by('title').values_list('title', flat=True))
+
+        results = async_to_sync(gather_queries)(count_books, titles)
+        self.assertEqual(results, [2, ['Book 0001', 'Book 0002']])
+        self.assertNotIn(threading.get_ident(), threads)
+
+    def test_worker_connections_follow_conn_max_age(self):
+        async def five_requests():
+            # One event loop, so one pool of worker threads, as under a server
+            for _ in range(5):
+                await gather_queries(lambda: Book.objects.count(), lambda: Book.objects.exists())
+
+        # The in-memory test database never really closes, so count the attempts
+        wrapper = type(connections['default'])
+        with unittest.mock.patch.object(wrapper, 'close', autospec=True, side_effect=wrapper.close) as close:
+            with conn_max_age(0):
+                async_to_sync(five_requests)()
+            self.assertGreaterEqual(close.call_count, 10)
+            close.reset_mock()
+            with conn_max_age(None):
+                async_to_sync(five_requests)()
+            self.assertEqual(close.call_count, 0)
+
+    def test_inside_a_transaction_runs_on_the_request_connection(self):
+        def inside():
+            make_book(1)
+            return async_to_sync(gather_queries)(lambda: Book.objects.count(), lambda: threading.get_ident())
+
+        with transaction.atomic():
+            count, thread = inside()
+        # Another connection couldn't have seen the uncommitted book
+        self.assertEqual(count, 1)
+        self.assertEqual(thread, threading.get_ident())
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite syntax')
+class QueryPlanTests(TestCase):
+    """EXPLAIN QUERY PLAN every statement the circulation hot paths run"""
+
+    def setUp(self):
+        librarian = User.objects.create_user('librarian', password='secret')
+        UserProfile.objects.create(user=librarian, role='librarian')
+        student_user = User.objects.create_user('student', password='secret')
+        UserProfile.objects.create(user=student_user, role='student')
+        self.student = make_student(1)
+        self.student.user = student_user
+        self.student.save()
+        self.book = make_book(1)
+        now = timezone.now()
+        BorrowRecord.objects.create(
+            student=self.student, book=self.book,
+            borrow_date=now - timedelta(days=10), due_date=now - timedelta(days=3),
+        )
+        self.librarian_client = self.client_class()
+        self.librarian_client.force_login(librarian)
+        self.student_client = self.client_class()
+        self.student_client.force_login(student_user)
+
+    def full_scans(self, run):
+        statements = []
+
+        def capture(execute, sql, params, many, context):
+            statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(capture):
+            run()
+        scans = []
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql LIKE '% WHERE %'")
+            partial_indexes = {row[0] for row in cursor.fetchall()}
+            for sql, params in statements:
+                if not re.match(r'\s*(SELECT|UPDATE|DELETE)\b', sql):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plan = [row[-1] for row in cursor.fetchall()]
+                walks_index = ' LIMIT ' not in sql and any(
+                    match.group(1) not in partial_indexes
+                    for match in map(INDEX_WALK_RE.fullmatch, plan) if match
+                )
+                if walks_index or any(TABLE_SCAN_RE.fullmatch(step) for step in plan):
+                    scans.append(f'{sql}\n  -> {plan}')
+        return scans
+
+    def test_hot_queries_use_indexes(self):
+        hot_paths = {
+            'dashboard counters': compute_dashboard_stats,
+            'overdue sweep': mark_overdue_loans,
+            'fine accrual': accrue_fines,
+            'home': lambda: self.librarian_client.get(reverse('home')),
+            'pending fines': lambda: self.librarian_client.get(reverse('fine_list'), {'status': 'pending'}),
+            'overdue loans': lambda: self.librarian_client.get(reverse('borrow_list'), {'status': 'overdue'}),
+            'student list': lambda: self.librarian_client.get(reverse('student_list')),
+            'student detail': lambda: self.librarian_client.get(reverse('student_detail', args=[self.student.pk])),
+            'student dashboard': lambda: self.student_client.get(reverse('student_dashboard')),
+            'borrow page': lambda: self.student_client.get(reverse('borrow_book', args=[self.book.pk])),
+        }
+        for name, run in hot_paths.items():
+            with self.subTest(name):
+                scans = self.full_scans(run)
+                self.assertEqual(scans, [], f'{name} falls back to a full scan:\n' + '\n'.join(scans))
+
+    def test_harness_spots_full_scans(self):
+        self.assertTrue(self.full_scans(lambda: list(Book.objects.filter(publisher='Publisher'))))
@@ -1,5 +1,12 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import api, views
+
+# Under an ASGI server the dashboards can run their independent queries concurrently
+if getattr(settings, 'LIBRARY_ASYNC_DASHBOARDS', False):
+    home_view, student_dashboard_view = views.home_async, views.student_dashboard_async
+else:
+    home_view, student_dashboard_view = views.home, views.student_dashboard
 
 urlpatterns = [
     # Authentication
@@ -9,7 +16,7 @@ urlpatterns = [
     path('logout/', views.logout_view, name='logout'),
     
     # Main pages
-    path('home/', views.home, name='home'),  # Librarian-only home page
+    path('home/', home_view, name='home'),  # Librarian-only home page
     path('books/', views.book_list, name='book_list'),
     path('students/', views.student_list, name='student_list'),
     path('students/<int:student_id>/', views.student_detail, name='student_detail'),  # Add this
@@ -17,7 +24,7 @@ urlpatterns = [
     path('fines/', views.fine_list, name='fine_list'),
     
     # Student dashboard
-    path('dashboard/', views.student_dashboard, name='student_dashboard'),
+    path('dashboard/', student_dashboard_view, name='student_dashboard'),
     
     # Book management
     path('books/add/', views.add_book, name='add_book'),
@@ -30,8 +37,25 @@ urlpatterns = [
     path('borrows/<int:record_id>/request-return/', views.request_return, name='request_return'),
     path('borrows/<int:record_id>/verify-return/', views.verify_return, name='verify_return'),
     path('borrows/<int:record_id>/reject-return/', views.reject_return, name='reject_return'),
+    path('borrows/verify-returns/', views.bulk_verify_return, name='bulk_verify_return'),
     
     # Fine Management
     path('fines/<int:fine_id>/mark-paid/', views.mark_fine_paid, name='mark_fine_paid'),
     path('fines/<int:record_id>/create-and-mark-paid/', views.create_and_mark_fine_paid, name='create_and_mark_fine_paid'),
+    
+    # Cover images
+    path('covers/<path:name>', views.cover_file, name='cover_file'),
+    
+    # Exports
+    path('exports/<str:dataset>/', views.export_records, name='export_records'),
+    
+    # JSON API (same session login and roles as the pages above)
+    path('api/books/', api.books, name='api_books'),
+    path('api/books/availability/', api.book_availability, name='api_book_availability'),
+    path('api/me/loans/', api.my_loans, name='api_my_loans'),
+    path('api/me/fines/', api.my_fines, name='api_my_fines'),
+    path('api/loans/', api.loans, name='api_loans'),
+    
+    # Monitoring
+    path('metrics/', views.metrics, name='metrics'),
 ]
\ No newline at end of file
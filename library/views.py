@@ -1,108 +1,167 @@
+import hashlib
+import mimetypes
+import posixpath
+import re
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.conf import settings
+from django.core.exceptions import PermissionDenied, SuspiciousFileOperation
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import require_safe
+from django.urls import reverse
 from django.contrib import messages
 from django.utils import timezone
 from django.db.models import Q
 from .models import Student, Book, BorrowRecord, Fine
-from datetime import timedelta
+from decimal import Decimal
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from .models import Student, Book, BorrowRecord, Fine, UserProfile
-from .forms import BookForm, BorrowBookForm, ReturnVerificationForm
+from .forms import BookForm, BorrowBookForm, ExportFilterForm, ReturnVerificationForm, CONDITION_CHOICES
+from .search import book_page_queryset
+from .cards import CARD_PAGE_FIELDS, render_book_cards
+from .loans import loan_views
+from .concurrency import gather_queries
+from .storage import hashed_name_etag
+from .catalog import allocate_book_isbns
+from .covers import schedule_thumbnails
+from .exports import CONTENT_TYPES, EXPORTS, stream_export
+from .pagination import paginate_keyset
+from .metrics import render_metrics
 from django.db.models import F
-from django.db import models
+from django.db import models, transaction
+from .dashboard import get_dashboard_stats
+from .roles import get_user_role, role_required
+from .circulation import (
+    AlreadyBorrowed, BookUnavailable, adjust_student_stats, checkout_book, get_student_stats,
+    recompute_student_stats, verify_returns,
+)
 
 def index(request):
     """Root URL handler - redirects to appropriate page based on authentication and role"""
     if request.user.is_authenticated:
-        try:
-            profile = UserProfile.objects.get(user=request.user)
-            if profile.role == 'librarian':
-                return redirect('home')
-            else:
-                return redirect('student_dashboard')
-        except UserProfile.DoesNotExist:
+        if not request.user_role:
             return redirect('login')
+        if request.user_role == 'librarian':
+            return redirect('home')
+        else:
+            return redirect('student_dashboard')
     else:
         return redirect('login')
 
+# The librarian home page sends students to their own dashboard
+librarian_home_only = role_required(
+    'librarian',
+    'Redirected to your dashboard',
+    redirect_to='student_dashboard',
+    level=messages.INFO,
+    denied_redirect_to='login',
+)
+
+
+def _allow(request):
+    # Stand-in view, so an async view can run the sync access decorators first
+    return None
+
+
+def _home_queries():
+    """The home page's independent reads, as callables for home_async to run at once"""
+    return [
+        # Counters are cached and kept current by model signals
+        get_dashboard_stats,
+        lambda: list(BorrowRecord.objects.select_related('student', 'book')[:5]),
+    ]
+
+
+def _home_context(stats, recent_borrows):
+    return {
+        'total_books': stats['total_books'],
+        'total_students': stats['total_students'],
+        'borrowed_books': stats['borrowed_books'],
+        'overdue_books': stats['overdue_books'],
+        'recent_borrows': recent_borrows,
+    }
+
+
 @login_required
+@librarian_home_only
 def home(request):
-    # Check if user is librarian - only librarians can access home page
-    try:
-        profile = UserProfile.objects.get(user=request.user)
-        if profile.role != 'librarian':
-            messages.info(request, 'Redirected to your dashboard')
-            return redirect('student_dashboard')
-    except UserProfile.DoesNotExist:
-        messages.error(request, 'Access denied')
-        return redirect('login')
-    
-    # Update overdue statuses for books that are past due date
-    # This ensures the status is current when displaying the home page
-    overdue_records = BorrowRecord.objects.filter(
-        status__in=['borrowed', 'pending_return'],
-        due_date__lt=timezone.now()
-    ).exclude(status='returned')
-    
-    # Update status to overdue (this will trigger the save() method which handles the logic)
-    for record in overdue_records:
-        if record.status != 'pending_return':  # Don't change pending_return status
-            record.status = 'overdue'
-            record.save(update_fields=['status'])
-    
-    total_books = Book.objects.count()
-    total_students = Student.objects.count()
-    # Count all books that are currently borrowed (not returned yet)
-    # This includes 'borrowed', 'overdue', and 'pending_return' statuses
-    borrowed_books = BorrowRecord.objects.filter(
-        status__in=['borrowed', 'overdue', 'pending_return']
-    ).exclude(status='returned').count()
-    
-    # Count overdue books: due_date has passed and status is not 'returned'
-    overdue_books = BorrowRecord.objects.filter(
-        status__in=['borrowed', 'overdue', 'pending_return'],
-        due_date__lt=timezone.now()
-    ).exclude(status='returned').count()
-    
-    recent_borrows = BorrowRecord.objects.all()[:5]
+    # Overdue statuses are kept current by update_overdue_books --daemon;
+    # the overdue counter below goes by due date either way
+    stats, recent_borrows = [query() for query in _home_queries()]
+    return render(request, 'library/home.html', _home_context(stats, recent_borrows))
+
+
+async def home_async(request):
+    """home() for ASGI servers, reading the counters and recent loans concurrently"""
+    denied = await sync_to_async(login_required(librarian_home_only(_allow)))(request)
+    if denied is not None:
+        return denied
     
-    context = {
-        'total_books': total_books,
-        'total_students': total_students,
-        'borrowed_books': borrowed_books,
-        'overdue_books': overdue_books,
-        'recent_borrows': recent_borrows,
-    }
-    return render(request, 'library/home.html', context)
+    stats, recent_borrows = await gather_queries(*_home_queries())
+    return await sync_to_async(render)(request, 'library/home.html', _home_context(stats, recent_borrows))
+
+
+def _page_etag(*parts):
+    """Weak ETag over everything a page depends on; equal pages may still differ in tokens"""
+    return 'W/"%s"' % hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def _not_modified(request, etag):
+    """A 304 response if the client's copy matches ``etag``, else None.
+
+    Only the ETag decides: Last-Modified can't see a change of user, role or
+    overdue status. Pages with a pending flash message are always rendered.
+    """
+    if request.method not in ('GET', 'HEAD') or len(messages.get_messages(request)):
+        return None
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _with_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # Availability changes all the time, so browsers must check back on every view
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 
 def book_list(request):
     query = request.GET.get('q', '')
-    if query:
-        books = Book.objects.filter(
-            Q(title__icontains=query) | 
-            Q(author__icontains=query) | 
-            Q(isbn__icontains=query)
-        )
-    else:
-        books = Book.objects.all()
+    # Ranked full-text search instead of icontains scans over the whole table
+    books, ordering = book_page_queryset(query)
+    
+    # Only ids and versions here; the cards themselves come from the cache
+    books = paginate_keyset(request, books.only(*CARD_PAGE_FIELDS, 'updated_at'), ordering)
     
-    return render(request, 'library/book_list.html', {'books': books, 'query': query})
+    # Same books at the same versions for the same user: the browser's copy is current
+    etag = _page_etag(
+        request.get_full_path(), [(book.pk, book.version) for book in books],
+        books.next_cursor, books.previous_cursor, request.user.pk, str(request.user_role),
+    )
+    last_modified = max((book.updated_at for book in books), default=None)
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+    
+    cards = render_book_cards(books, request.user_role)
+    response = render(request, 'library/book_list.html', {'books': books, 'cards': cards, 'query': query})
+    return _with_validators(response, etag, last_modified)
 
 
 @login_required
+@role_required('librarian', 'Only librarians can view student list')
 def student_list(request):
-    # Check if user is librarian
-    try:
-        profile = UserProfile.objects.get(user=request.user)
-        if profile.role != 'librarian':
-            messages.error(request, 'Only librarians can view student list')
-            return redirect('home')
-    except UserProfile.DoesNotExist:
-        messages.error(request, 'Access denied')
-        return redirect('home')
-    
     query = request.GET.get('q', '')
     if query:
         students = Student.objects.filter(
@@ -113,69 +172,41 @@ def student_list(request):
     else:
         students = Student.objects.all()
     
-    # Get borrow statistics for each student
-    student_data = []
-    for student in students:
-        borrowed_count = BorrowRecord.objects.filter(
-            student=student,
-            status__in=['borrowed', 'pending_return', 'overdue']
-        ).count()
-        
-        overdue_count = BorrowRecord.objects.filter(
-            student=student,
-            status='overdue'
-        ).count()
-        
-        total_fines = Fine.objects.filter(
-            borrow_record__student=student,
-            status='pending'
-        ).aggregate(total=models.Sum('amount'))['total'] or 0
-        
-        student_data.append({
-            'student': student,
-            'borrowed_count': borrowed_count,
-            'overdue_count': overdue_count,
-            'total_fines': total_fines,
-        })
+    # Borrowed/overdue counts and pending fines are read from the maintained stats rows
+    students = paginate_keyset(request, students.with_circulation_stats(), 'name')
     
     return render(request, 'library/student_list.html', {
-        'student_data': student_data,
-        'query': query
+        'students': students,
+        'query': query,
     })
 
 
 @login_required
+@role_required('librarian', 'Only librarians can view student details')
 def student_detail(request, student_id):
-    # Check if user is librarian
-    try:
-        profile = UserProfile.objects.get(user=request.user)
-        if profile.role != 'librarian':
-            messages.error(request, 'Only librarians can view student details')
-            return redirect('home')
-    except UserProfile.DoesNotExist:
-        messages.error(request, 'Access denied')
-        return redirect('home')
-    
-    student = get_object_or_404(Student, id=student_id)
+    student = get_object_or_404(Student.objects.with_loan_stats(), id=student_id)
     
     # Get all borrow records
     borrow_records = BorrowRecord.objects.filter(student=student).order_by('-borrow_date')
+    borrow_history = paginate_keyset(request, borrow_records.select_related('book'), '-borrow_date')
     
     # Get current borrowed books
-    current_borrows = borrow_records.filter(status__in=['borrowed', 'pending_return', 'overdue'])
+    current_borrows = loan_views(borrow_records.filter(
+        status__in=['borrowed', 'pending_return', 'overdue']
+    ).select_related('book', 'fine'))
     
     # Get fines
     fines = Fine.objects.filter(borrow_record__student=student)
-    pending_fines = fines.filter(status='pending')
-    total_pending_fines = pending_fines.aggregate(total=models.Sum('amount'))['total'] or 0
+    pending_fines = fines.filter(status='pending').select_related('borrow_record__book')
     
     context = {
         'student': student,
         'borrow_records': borrow_records,
+        'borrow_history': borrow_history,
         'current_borrows': current_borrows,
         'fines': fines,
         'pending_fines': pending_fines,
-        'total_pending_fines': total_pending_fines,
+        'total_pending_fines': student.total_fines,
     }
     
     return render(request, 'library/student_detail.html', context)
@@ -193,123 +224,103 @@ def borrow_list(request):
     else:
         records = BorrowRecord.objects.all()
     
-    return render(request, 'library/borrow_list.html', {'records': records, 'status_filter': status_filter})
+    records = paginate_keyset(request, records.select_related('student', 'book'), '-borrow_date')
+    records.items = loan_views(records)
+    
+    return render(request, 'library/borrow_list.html', {
+        'records': records,
+        'status_filter': status_filter,
+        'condition_choices': CONDITION_CHOICES,
+        # Librarians can verify a whole page of pending returns at once
+        'bulk_verify': status_filter == 'pending_return' and request.user_role == 'librarian',
+    })
 
 
 @login_required
 def fine_list(request):
     # Check if user is librarian
-    is_librarian = False
-    try:
-        profile = UserProfile.objects.get(user=request.user)
-        is_librarian = (profile.role == 'librarian')
-    except UserProfile.DoesNotExist:
-        pass
+    is_librarian = request.user_role == 'librarian'
     
     status_filter = request.GET.get('status', '')
     
-    # Get all existing fines from database
+    # Fines still accruing on unreturned loans are kept in the Fine table by the
+    # accrue_fines job, so the list is a plain read of stored amounts
     if status_filter:
-        existing_fines = Fine.objects.filter(status=status_filter)
+        fines = Fine.objects.filter(status=status_filter)
     else:
-        existing_fines = Fine.objects.all()
+        fines = Fine.objects.all()
     
-    # Get all overdue books that don't have a Fine record yet
-    overdue_records = BorrowRecord.objects.filter(
-        status__in=['overdue', 'borrowed', 'pending_return']
-    ).exclude(
-        id__in=existing_fines.values_list('borrow_record_id', flat=True)
-    )
+    # Totals cover every matching fine, not just the current page
+    totals = fines.aggregate(count=models.Count('id'), amount=models.Sum('amount'))
     
-    # Filter overdue records that actually have fines
-    overdue_with_fines = []
-    for record in overdue_records:
-        fine_amount = record.calculate_fine()
-        if fine_amount > 0:
-            overdue_with_fines.append({
-                'borrow_record': record,
-                'amount': fine_amount,
-                'status': 'pending',
-                'is_calculated': True,  # Flag to indicate this is calculated, not in DB
-            })
-    
-    # Combine existing fines with calculated fines
-    all_fines = []
-    total_amount = 0
-    
-    for fine in existing_fines:
-        record = fine.borrow_record
-        # Calculate days overdue using the model method
-        days_overdue = record.days_overdue()
-        
-        fine_amount = float(fine.amount)
-        total_amount += fine_amount
-        
-        all_fines.append({
-            'borrow_record': record,
-            'amount': fine_amount,
-            'status': fine.status,
-            'paid_date': fine.paid_date,
-            'is_calculated': False,
-            'days_overdue': days_overdue,
-            'fine_id': fine.id,  # Add fine_id for existing fines
-        })
-    
-    # Add calculated fines
-    for fine_data in overdue_with_fines:
-        record = fine_data['borrow_record']
-        # Calculate days overdue using the model method
-        days_overdue = record.days_overdue()
-        
-        fine_amount = fine_data['amount']
-        total_amount += fine_amount
-        
-        all_fines.append({
-            'borrow_record': record,
-            'amount': fine_amount,
-            'status': fine_data['status'],
-            'paid_date': None,
-            'is_calculated': True,
-            'days_overdue': days_overdue,
-            'fine_id': None,  # No fine_id for calculated fines (not in DB yet)
-        })
-    
-    # Sort by borrow date (most recent first)
-    all_fines.sort(key=lambda x: x['borrow_record'].borrow_date, reverse=True)
-    
-    # Apply status filter if specified
-    if status_filter:
-        all_fines = [f for f in all_fines if f['status'] == status_filter]
-        # Recalculate total for filtered fines
-        total_amount = sum(f['amount'] for f in all_fines)
+    fines = paginate_keyset(
+        request,
+        fines.annotate(borrow_date=F('borrow_record__borrow_date')).select_related(
+            'borrow_record__student', 'borrow_record__book'
+        ),
+        '-borrow_date',
+    )
     
     return render(request, 'library/fine_list.html', {
-        'fines': all_fines,
+        'fines': fines,
         'status_filter': status_filter,
-        'total_amount': total_amount,
-        'total_count': len(all_fines),
+        'total_amount': totals['amount'] or 0,
+        'total_count': totals['count'],
         'is_librarian': is_librarian,
     })
 
 
+# List page to go back to when an export request is rejected
+EXPORT_LIST_PAGES = {
+    'loans': 'borrow_list',
+    'fines': 'fine_list',
+    'students': 'student_list',
+}
+
+
 @login_required
+@role_required('librarian', 'Only librarians can export records')
+def export_records(request, dataset):
+    if dataset not in EXPORTS:
+        raise Http404('Unknown export')
+    
+    form = ExportFilterForm(request.GET, statuses=EXPORTS[dataset].statuses)
+    if not form.is_valid():
+        for errors in form.errors.values():
+            for error in errors:
+                messages.error(request, error)
+        return redirect(EXPORT_LIST_PAGES[dataset])
+    
+    fmt = form.cleaned_data['format']
+    # Rows are written while the response is sent, so nothing is buffered here
+    response = StreamingHttpResponse(
+        stream_export(
+            dataset,
+            fmt,
+            start=form.cleaned_data['start'],
+            end=form.cleaned_data['end'],
+            status=form.cleaned_data['status'],
+        ),
+        content_type=CONTENT_TYPES[fmt],
+    )
+    filename = f"{dataset}-{timezone.localdate():%Y%m%d}.{fmt}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@login_required
+@role_required('librarian', 'Only librarians can mark fines as paid', redirect_to='fine_list')
 def mark_fine_paid(request, fine_id):
-    # Check if user is librarian
-    try:
-        profile = UserProfile.objects.get(user=request.user)
-        if profile.role != 'librarian':
-            messages.error(request, 'Only librarians can mark fines as paid')
-            return redirect('fine_list')
-    except UserProfile.DoesNotExist:
-        messages.error(request, 'Access denied')
-        return redirect('fine_list')
-    
     fine = get_object_or_404(Fine, id=fine_id)
     
     if request.method == 'POST':
-        fine.status = 'paid'
-        fine.paid_date = timezone.now()
-        fine.save()
+        with transaction.atomic():
+            was_pending = fine.status == 'pending'
+            fine.status = 'paid'
+            fine.paid_date = timezone.now()
+            fine.save()
+            if was_pending:
+                adjust_student_stats(fine.borrow_record.student_id, pending_fine_total=-fine.amount)
         messages.success(request, f'Fine of RM{fine.amount:.2f} marked as paid successfully!')
         return redirect('fine_list')
     
@@ -317,17 +328,8 @@ def mark_fine_paid(request, fine_id):
 
 
 @login_required
+@role_required('librarian', 'Only librarians can mark fines as paid', redirect_to='fine_list')
 def create_and_mark_fine_paid(request, record_id):
-    # Check if user is librarian
-    try:
-        profile = UserProfile.objects.get(user=request.user)
-        if profile.role != 'librarian':
-            messages.error(request, 'Only librarians can mark fines as paid')
-            return redirect('fine_list')
-    except UserProfile.DoesNotExist:
-        messages.error(request, 'Access denied')
-        return redirect('fine_list')
-    
     record = get_object_or_404(BorrowRecord, id=record_id)
     
     if request.method == 'POST':
@@ -335,21 +337,24 @@ def create_and_mark_fine_paid(request, record_id):
         fine_amount = record.calculate_fine()
         
         if fine_amount > 0:
-            # Check if fine already exists
-            fine, created = Fine.objects.get_or_create(
-                borrow_record=record,
-                defaults={
-                    'amount': fine_amount,
-                    'status': 'paid',  # Mark as paid immediately
-                    'paid_date': timezone.now()
-                }
-            )
-            
-            if not created:
-                # Fine already exists, just update it
-                fine.status = 'paid'
-                fine.paid_date = timezone.now()
-                fine.save()
+            with transaction.atomic():
+                # Check if fine already exists
+                fine, created = Fine.objects.get_or_create(
+                    borrow_record=record,
+                    defaults={
+                        'amount': fine_amount,
+                        'status': 'paid',  # Mark as paid immediately
+                        'paid_date': timezone.now()
+                    }
+                )
+                
+                if not created:
+                    # Fine already exists, just update it
+                    if fine.status == 'pending':
+                        adjust_student_stats(record.student_id, pending_fine_total=-fine.amount)
+                    fine.status = 'paid'
+                    fine.paid_date = timezone.now()
+                    fine.save()
             
             messages.success(request, f'Fine of RM{fine_amount:.2f} created and marked as paid successfully!')
         else:
@@ -370,14 +375,9 @@ def create_and_mark_fine_paid(request, record_id):
 def login_view(request):
     # If user is already logged in, redirect them based on role
     if request.user.is_authenticated:
-        try:
-            profile = UserProfile.objects.get(user=request.user)
-            if profile.role == 'librarian':
-                return redirect('home')
-            else:
-                return redirect('student_dashboard')
-        except UserProfile.DoesNotExist:
-            return redirect('home')
+        if request.user_role == 'student':
+            return redirect('student_dashboard')
+        return redirect('home')
     
     if request.method == 'POST':
         username = request.POST.get('username')
@@ -390,14 +390,9 @@ def login_view(request):
             messages.success(request, f'Welcome back, {user.username}!')
             
             # Redirect based on role
-            try:
-                profile = UserProfile.objects.get(user=user)
-                if profile.role == 'librarian':
-                    return redirect('home')
-                else:
-                    return redirect('student_dashboard')
-            except UserProfile.DoesNotExist:
-                return redirect('home')
+            if get_user_role(user) == 'student':
+                return redirect('student_dashboard')
+            return redirect('home')
         else:
             messages.error(request, 'Invalid username or password')
     
@@ -469,67 +464,82 @@ def logout_view(request):
     return redirect('login')
 
 
+def _student_dashboard_queries(student):
+    """The dashboard's independent reads, as callables for student_dashboard_async to run at once"""
+    loans = BorrowRecord.objects.filter(student=student)
+    # Every table shows book titles; the same queries whatever the student holds
+    return [
+        lambda: list(
+            loans.filter(status__in=['borrowed', 'overdue', 'pending_return']).select_related('book', 'fine')
+        ),
+        # Only the five most recent are shown
+        lambda: list(loans.order_by('-borrow_date').select_related('book')[:5]),
+        lambda: get_student_stats(student),
+        # Get existing fines from database
+        lambda: list(
+            Fine.objects.filter(borrow_record__student=student, status='pending').select_related('borrow_record__book')
+        ),
+    ]
+
+
+def _student_dashboard_context(student, borrowed_books, borrow_history, stats, fines):
+    return {
+        'student': student,
+        'borrowed_books': loan_views(borrowed_books),
+        'borrow_history': borrow_history,
+        'stats': stats,
+        'fines': fines,
+        # Pending fines, including ones still accruing on overdue books,
+        # are totalled in the stats row
+        'total_fines': stats.pending_fine_total,
+    }
+
+
 @login_required
 def student_dashboard(request):
     try:
         student = Student.objects.get(user=request.user)
-        borrowed_books = BorrowRecord.objects.filter(student=student, status__in=['borrowed', 'overdue', 'pending_return'])
-        borrow_history = BorrowRecord.objects.filter(student=student).order_by('-borrow_date')
-        
-        # Get existing fines from database
-        fines = Fine.objects.filter(borrow_record__student=student, status='pending')
-        
-        # Calculate total fines including current overdue books
-        total_fines = 0
-        
-        # Add fines from Fine table
-        for fine in fines:
-            total_fines += float(fine.amount)
-        
-        # Add calculated fines for currently overdue books (not yet in Fine table)
-        for record in borrowed_books:
-            if record.is_overdue():
-                # Check if fine already exists for this record
-                existing_fine = Fine.objects.filter(borrow_record=record).first()
-                if not existing_fine:
-                    total_fines += record.calculate_fine()
-        
-        context = {
-            'student': student,
-            'borrowed_books': borrowed_books,
-            'borrow_history': borrow_history,
-            'fines': fines,
-            'total_fines': total_fines,
-        }
-        return render(request, 'library/student_dashboard.html', context)
     except Student.DoesNotExist:
         messages.error(request, 'Student profile not found')
         return redirect('home')
     
+    results = [query() for query in _student_dashboard_queries(student)]
+    return render(request, 'library/student_dashboard.html', _student_dashboard_context(student, *results))
 
-    # Book Management Views (Librarian only)
-@login_required
-def add_book(request):
-    # Check if user is librarian
+
+async def student_dashboard_async(request):
+    """student_dashboard() for ASGI servers, running its loan, fine and stats queries concurrently"""
+    denied = await sync_to_async(login_required(_allow))(request)
+    if denied is not None:
+        return denied
+    
     try:
-        profile = UserProfile.objects.get(user=request.user)
-        if profile.role != 'librarian':
-            messages.error(request, 'Only librarians can add books')
-            return redirect('home')
-    except UserProfile.DoesNotExist:
-        messages.error(request, 'Access denied')
+        student = await Student.objects.aget(user=request.user)
+    except Student.DoesNotExist:
+        messages.error(request, 'Student profile not found')
         return redirect('home')
     
+    results = await gather_queries(*_student_dashboard_queries(student))
+    return await sync_to_async(render)(
+        request, 'library/student_dashboard.html', _student_dashboard_context(student, *results)
+    )
+    
+
+    # Book Management Views (Librarian only)
+@login_required
+@role_required('librarian', 'Only librarians can add books')
+def add_book(request):
     if request.method == 'POST':
         form = BookForm(request.POST, request.FILES)
         if form.is_valid():
             book = form.save(commit=False)
-            # Auto-generate ISBN or use a simple counter
-            import random
-            book.isbn = f"BK{random.randint(100000, 999999)}"
+            # Auto-generate ISBN from the catalog sequence
+            book.isbn = allocate_book_isbns()[0]
             book.total_copies = 1
             book.available_copies = 1
             book.save()
+            if book.cover_image:
+                schedule_thumbnails(book.cover_image.name)
             messages.success(request, f'Book "{book.title}" added successfully!')
             return redirect('book_list')
     else:
@@ -539,23 +549,16 @@ def add_book(request):
 
 
 @login_required
+@role_required('librarian', 'Only librarians can edit books')
 def edit_book(request, book_id):
-    # Check if user is librarian
-    try:
-        profile = UserProfile.objects.get(user=request.user)
-        if profile.role != 'librarian':
-            messages.error(request, 'Only librarians can edit books')
-            return redirect('home')
-    except UserProfile.DoesNotExist:
-        messages.error(request, 'Access denied')
-        return redirect('home')
-    
     book = get_object_or_404(Book, id=book_id)
     
     if request.method == 'POST':
         form = BookForm(request.POST, request.FILES, instance=book)
         if form.is_valid():
             book = form.save()
+            if 'cover_image' in form.changed_data and book.cover_image:
+                schedule_thumbnails(book.cover_image.name)
             messages.success(request, f'Book "{book.title}" updated successfully!')
             return redirect('book_list')
     else:
@@ -565,22 +568,17 @@ def edit_book(request, book_id):
 
 
 @login_required
+@role_required('librarian', 'Only librarians can delete books')
 def delete_book(request, book_id):
-    # Check if user is librarian
-    try:
-        profile = UserProfile.objects.get(user=request.user)
-        if profile.role != 'librarian':
-            messages.error(request, 'Only librarians can delete books')
-            return redirect('home')
-    except UserProfile.DoesNotExist:
-        messages.error(request, 'Access denied')
-        return redirect('home')
-    
     book = get_object_or_404(Book, id=book_id)
     
     if request.method == 'POST':
         title = book.title
-        book.delete()
+        with transaction.atomic():
+            # Deleting the book cascades to its loans, so recount the affected students
+            student_ids = list(book.borrowrecord_set.values_list('student_id', flat=True).distinct())
+            book.delete()
+            recompute_student_stats(student_ids)
         messages.success(request, f'Book "{title}" deleted successfully!')
         return redirect('book_list')
     
@@ -592,42 +590,28 @@ def book_detail(request, book_id):
     book = get_object_or_404(Book, id=book_id)
     
     # Check if user is student and has overdue books
-    has_overdue = False
     overdue_count = 0
-    if request.user.is_authenticated:
-        try:
-            profile = UserProfile.objects.get(user=request.user)
-            if profile.role == 'student':
-                student = Student.objects.get(user=request.user)
-                overdue_books = BorrowRecord.objects.filter(
-                    student=student,
-                    status='overdue'
-                )
-                overdue_count = overdue_books.count()
-                has_overdue = overdue_count > 0
-        except (UserProfile.DoesNotExist, Student.DoesNotExist):
-            pass
+    if request.user_role == 'student':
+        overdue_count = BorrowRecord.objects.filter(student__user=request.user, status='overdue').count()
+    has_overdue = overdue_count > 0
     
-    return render(request, 'library/book_detail.html', {
+    etag = _page_etag(book.pk, book.version, request.user.pk, str(request.user_role), overdue_count)
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+    
+    response = render(request, 'library/book_detail.html', {
         'book': book,
         'has_overdue': has_overdue,
         'overdue_count': overdue_count,
     })
+    return _with_validators(response, etag, book.updated_at)
 
 
 # Borrow and Return System
 @login_required
+@role_required('student', 'Only students can borrow books', redirect_to='book_detail', redirect_with_kwargs=True)
 def borrow_book(request, book_id):
-    # Check if user is student
-    try:
-        profile = UserProfile.objects.get(user=request.user)
-        if profile.role != 'student':
-            messages.error(request, 'Only students can borrow books')
-            return redirect('book_detail', book_id=book_id)
-    except UserProfile.DoesNotExist:
-        messages.error(request, 'Access denied')
-        return redirect('book_detail', book_id=book_id)
-    
     book = get_object_or_404(Book, id=book_id)
     student = get_object_or_404(Student, user=request.user)
     
@@ -637,6 +621,7 @@ def borrow_book(request, book_id):
         return redirect('book_detail', book_id=book_id)
     
     # Check if student already borrowed this book and hasn't returned it
+    # (checkout_book() checks again, for two submits racing each other)
     existing_borrow = BorrowRecord.objects.filter(
         student=student,
         book=book,
@@ -648,13 +633,9 @@ def borrow_book(request, book_id):
         return redirect('book_detail', book_id=book_id)
     
     # Check if student has any overdue books
-    overdue_books = BorrowRecord.objects.filter(
-        student=student,
-        status='overdue'
-    )
+    overdue_count = get_student_stats(student).overdue_loans
     
-    if overdue_books.exists():
-        overdue_count = overdue_books.count()
+    if overdue_count > 0:
         messages.error(
             request, 
             f'⚠️ You have {overdue_count} overdue book(s). Please return them before borrowing new books. Go to your dashboard to see details.'
@@ -664,18 +645,20 @@ def borrow_book(request, book_id):
     if request.method == 'POST':
         form = BorrowBookForm(request.POST)
         if form.is_valid():
-            borrow_record = form.save(commit=False)
-            borrow_record.student = student
-            borrow_record.book = book
-            borrow_record.borrow_date = timezone.now()
-            borrow_record.due_date = timezone.now() + timedelta(days=form.cleaned_data['borrow_duration_days'])
-            borrow_record.status = 'borrowed'
-            borrow_record.save()
-            
-            # Decrease available copies
-            book.available_copies = F('available_copies') - 1
-            book.save()
-            book.refresh_from_db()
+            try:
+                # Claims a copy and creates the loan in one transaction
+                borrow_record = checkout_book(
+                    student,
+                    book.id,
+                    form.cleaned_data['borrow_duration_days'],
+                    notes=form.cleaned_data['notes'],
+                )
+            except BookUnavailable:
+                messages.error(request, 'This book is currently not available')
+                return redirect('book_detail', book_id=book_id)
+            except AlreadyBorrowed:
+                messages.error(request, 'You have already borrowed this book')
+                return redirect('book_detail', book_id=book_id)
             
             messages.success(request, f'Successfully borrowed "{book.title}"! Due date: {borrow_record.due_date.strftime("%B %d, %Y")}')
             return redirect('student_dashboard')
@@ -689,17 +672,8 @@ def borrow_book(request, book_id):
 
 
 @login_required
+@role_required('student', 'Access denied')
 def request_return(request, record_id):
-    # Check if user is student
-    try:
-        profile = UserProfile.objects.get(user=request.user)
-        if profile.role != 'student':
-            messages.error(request, 'Access denied')
-            return redirect('home')
-    except UserProfile.DoesNotExist:
-        messages.error(request, 'Access denied')
-        return redirect('home')
-    
     student = get_object_or_404(Student, user=request.user)
     record = get_object_or_404(BorrowRecord, id=record_id, student=student)
     
@@ -707,26 +681,21 @@ def request_return(request, record_id):
         messages.error(request, 'This book cannot be returned')
         return redirect('student_dashboard')
     
+    was_overdue = record.status == 'overdue'
     record.status = 'pending_return'
     record.return_requested_date = timezone.now()
-    record.save()
+    with transaction.atomic():
+        record.save()
+        if was_overdue:
+            adjust_student_stats(student.pk, overdue_loans=-1)
     
     messages.success(request, f'Return request submitted for "{record.book.title}". Please bring the book to the library for verification.')
     return redirect('student_dashboard')
 
 
 @login_required
+@role_required('librarian', 'Only librarians can verify returns')
 def verify_return(request, record_id):
-    # Check if user is librarian
-    try:
-        profile = UserProfile.objects.get(user=request.user)
-        if profile.role != 'librarian':
-            messages.error(request, 'Only librarians can verify returns')
-            return redirect('home')
-    except UserProfile.DoesNotExist:
-        messages.error(request, 'Access denied')
-        return redirect('home')
-    
     record = get_object_or_404(BorrowRecord, id=record_id)
     
     if record.status != 'pending_return':
@@ -744,29 +713,39 @@ def verify_return(request, record_id):
             condition = form.cleaned_data['condition']
             librarian_notes = form.cleaned_data['librarian_notes']
             record.notes = f"Condition: {condition}\nLibrarian Notes: {librarian_notes}"
-            record.save()
             
-            # Increase available copies
-            book = record.book
-            book.available_copies = F('available_copies') + 1
-            book.save()
-            book.refresh_from_db()
+            with transaction.atomic():
+                record.save()
+                
+                # Increase available copies
+                book = record.book
+                book.available_copies = F('available_copies') + 1
+                book.save()
+                book.refresh_from_db()
+                
+                # Create fine if overdue (only if fine doesn't already exist)
+                fine_amount = record.calculate_fine()
+                fine_delta = 0
+                if fine_amount > 0:
+                    fine, created = Fine.objects.get_or_create(
+                        borrow_record=record,
+                        defaults={
+                            'amount': fine_amount,
+                            'status': 'pending'
+                        }
+                    )
+                    if created:
+                        fine_delta = Decimal(str(fine_amount))
+                    # If fine already exists, update the amount in case it changed (but don't change status if already paid)
+                    elif fine.status == 'pending':
+                        fine_delta = Decimal(str(fine_amount)) - fine.amount
+                        fine.amount = fine_amount
+                        fine.accrued_through = None  # Final amount, the accrual job stops here
+                        fine.save()
+                
+                adjust_student_stats(record.student_id, active_loans=-1, pending_fine_total=fine_delta)
             
-            # Create fine if overdue (only if fine doesn't already exist)
-            fine_amount = record.calculate_fine()
             if fine_amount > 0:
-                fine, created = Fine.objects.get_or_create(
-                    borrow_record=record,
-                    defaults={
-                        'amount': fine_amount,
-                        'status': 'pending'
-                    }
-                )
-                # If fine already exists, update the amount in case it changed (but don't change status if already paid)
-                if not created and fine.status == 'pending':
-                    fine.amount = fine_amount
-                    fine.save()
-                
                 if created:
                     messages.warning(request, f'Book returned. Fine of RM{fine_amount:.2f} has been added for late return.')
                 else:
@@ -785,17 +764,47 @@ def verify_return(request, record_id):
 
 
 @login_required
-def reject_return(request, record_id):
-    # Check if user is librarian
-    try:
-        profile = UserProfile.objects.get(user=request.user)
-        if profile.role != 'librarian':
-            messages.error(request, 'Only librarians can reject returns')
-            return redirect('home')
-    except UserProfile.DoesNotExist:
-        messages.error(request, 'Access denied')
-        return redirect('home')
+@role_required('librarian', 'Only librarians can verify returns')
+def bulk_verify_return(request):
+    if request.method != 'POST':
+        return redirect(f"{reverse('borrow_list')}?status=pending_return")
+    
+    valid_conditions = {value for value, label in CONDITION_CHOICES}
+    conditions = {}
+    for value in request.POST.getlist('record_ids'):
+        try:
+            record_id = int(value)
+        except ValueError:
+            continue
+        # Past a 64-bit integer the database driver raises rather than matching nothing
+        if not -2 ** 63 <= record_id < 2 ** 63:
+            continue
+        condition = request.POST.get(f'condition_{record_id}', 'good')
+        conditions[record_id] = condition if condition in valid_conditions else 'good'
+    
+    if not conditions:
+        messages.error(request, 'Select at least one return to verify')
+        return redirect(f"{reverse('borrow_list')}?status=pending_return")
+    
+    outcomes = verify_returns(conditions, request.POST.get('librarian_notes', ''))
+    verified = [outcome for outcome in outcomes if outcome['verified']]
+    total_fines = sum(outcome['fine_amount'] or 0 for outcome in verified)
+    
+    if verified:
+        messages.success(request, f'{len(verified)} of {len(outcomes)} return(s) verified successfully!')
+    else:
+        messages.error(request, 'None of the selected returns could be verified')
     
+    return render(request, 'library/bulk_verify_return.html', {
+        'outcomes': outcomes,
+        'verified_count': len(verified),
+        'total_fines': total_fines,
+    })
+
+
+@login_required
+@role_required('librarian', 'Only librarians can reject returns')
+def reject_return(request, record_id):
     record = get_object_or_404(BorrowRecord, id=record_id)
     
     if record.status != 'pending_return':
@@ -807,9 +816,108 @@ def reject_return(request, record_id):
         record.status = 'overdue' if record.is_overdue() else 'borrowed'
         record.return_requested_date = None
         record.notes = f"Return rejected. Reason: {reason}"
-        record.save()
+        with transaction.atomic():
+            record.save()
+            if record.status == 'overdue':
+                adjust_student_stats(record.student_id, overdue_loans=1)
         
         messages.warning(request, f'Return request rejected for "{record.book.title}".')
         return redirect('borrow_list')
     
-    return render(request, 'library/reject_return.html', {'record': record})
\ No newline at end of file
+    return render(request, 'library/reject_return.html', {'record': record})
+
+# Cover images
+COVER_IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+# Covers stored before content addressing keep their name, so they may change
+COVER_DEFAULT_CACHE = 'public, max-age=86400'
+
+
+def _parse_byte_range(header, size):
+    """Return ``(start, end)`` for a single ``bytes=`` range.
+
+    ``None`` means the header should be ignored (serve the whole file) and
+    ``False`` that the range can't be satisfied.
+    """
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        suffix = int(last)
+        return (max(size - suffix, 0), size - 1) if suffix and size else False
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return False
+    return start, end
+
+
+@require_safe
+def cover_file(request, name):
+    storage = Book._meta.get_field('cover_image').storage
+    # Only covers and their thumbnails live here
+    if not posixpath.normpath(name).startswith('book_covers/'):
+        raise Http404('Not a cover')
+    try:
+        size = storage.size(name)
+        modified = storage.get_modified_time(name)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404('Cover not found')
+    
+    # Content-addressed names change whenever the bytes do, so they can be cached forever
+    etag = hashed_name_etag(name)
+    cache_control = COVER_IMMUTABLE_CACHE
+    if etag is None:
+        etag = f'"{int(modified.timestamp())}-{size}"'
+        cache_control = COVER_DEFAULT_CACHE
+    
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and (if_none_match.strip() == '*' or etag in parse_etags(if_none_match)):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+        return response
+    
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    sendfile = getattr(settings, 'LIBRARY_COVER_SENDFILE', None)
+    if sendfile:
+        # The front-end server sends the file (and handles Range) itself
+        response = HttpResponse(content_type=content_type)
+        if sendfile == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = quote(getattr(settings, 'LIBRARY_COVER_ACCEL_PREFIX', '/protected-media/') + name)
+        else:
+            response['X-Sendfile'] = storage.path(name)
+    else:
+        byte_range = None
+        range_header = request.headers.get('Range')
+        # A stale If-Range means the client's partial copy is outdated: send everything
+        if range_header and request.headers.get('If-Range', etag) == etag:
+            byte_range = _parse_byte_range(range_header, size)
+        
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        if byte_range:
+            start, end = byte_range
+            with storage.open(name) as cover:
+                cover.seek(start)
+                response = HttpResponse(cover.read(end - start + 1), status=206, content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        else:
+            response = FileResponse(storage.open(name), content_type=content_type)
+    
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modified.timestamp())
+    response['Cache-Control'] = cache_control
+    return response
+
+
+def metrics(request):
+    # Scraped by Prometheus with a staff session; no redirect to the login page
+    if not request.user.is_staff:
+        raise PermissionDenied
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -41,11 +41,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'library.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'library.middleware.UserRoleMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -54,7 +56,8 @@ ROOT_URLCONF = 'library_project.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing renders for the /metrics view
+        'BACKEND': 'library.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -63,6 +66,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'library.context_processors.user_role',
             ],
         },
     },
@@ -133,4 +137,41 @@ MEDIA_ROOT = BASE_DIR / 'media'
 CSRF_TRUSTED_ORIGINS = [
     'https://*.ngrok-free.app',
     'https://*.ngrok.io',
-]
\ No newline at end of file
+]
+
+# Rows per page for the keyset-paginated list views
+LIBRARY_PAGE_SIZE = 25
+
+# Seconds the librarian dashboard counters may be served from cache before a recount
+LIBRARY_DASHBOARD_CACHE_TIMEOUT = 60
+
+# Seconds a user's role may be served from cache. A profile change clears it at
+# once only in the process that saved it (and not at all after a bulk update()),
+# so with several workers use a shared cache backend or keep this short
+LIBRARY_ROLE_CACHE_TIMEOUT = 300
+
+# Background threads building cover thumbnails (0 builds them inline), and how
+# many jobs may wait for a thread before new ones are skipped
+LIBRARY_THUMBNAIL_WORKERS = 2
+LIBRARY_THUMBNAIL_QUEUE = 50
+
+# Covers are served by library.views.cover_file under this prefix
+LIBRARY_COVER_URL = '/covers/'
+# Let the front-end server send cover files: None, 'x-accel-redirect' (nginx,
+# with an internal location mapping LIBRARY_COVER_ACCEL_PREFIX to MEDIA_ROOT)
+# or 'x-sendfile' (Apache mod_xsendfile, lighttpd)
+LIBRARY_COVER_SENDFILE = None
+LIBRARY_COVER_ACCEL_PREFIX = '/protected-media/'
+
+# A query repeated more than this many times in one request is reported as a
+# possible N+1 (logged, and counted in /metrics)
+LIBRARY_N_PLUS_ONE_THRESHOLD = 10
+
+# Seconds a rendered catalog card stays cached; a changed book gets a new key anyway
+LIBRARY_BOOK_CARD_CACHE_TIMEOUT = 86400
+
+# Serve home and student_dashboard with their async versions, which run their
+# independent queries concurrently. Only worth it under ASGI (asgi.py); under
+# WSGI every async view pays for an event loop of its own. Each concurrent query
+# needs a connection, so also set CONN_MAX_AGE on a networked database
+LIBRARY_ASYNC_DASHBOARDS = False